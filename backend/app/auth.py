@@ -1,10 +1,16 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Dict, Any, Tuple
+from collections import OrderedDict
+import threading, time, uuid
 from jose import JWTError, jwt
 from fastapi import  HTTPException, status, Security
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import delete, insert
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
 import os, logging
 from dotenv import load_dotenv
+from . import models
 
 
 #Chave secreta
@@ -13,7 +19,10 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "CHAVE_SECRETA")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+TOKEN_CACHE_MAX = int(os.getenv("TOKEN_CACHE_MAX", "4096"))
 LIMITE_TENTATIVAS = int(os.getenv("LIMITE_TENTATIVAS", "50"))
+LIMITE_RASTREIO_POR_MINUTO = int(os.getenv("LIMITE_RASTREIO_POR_MINUTO", "120"))
 TEMPO_BLOQUEIO = int(os.getenv("TEMPO_BLOQUEIO", "1000"))  # em segundos
 
 logger = logging.getLogger(__name__)
@@ -36,21 +45,148 @@ try:
     except Exception as e:
         logger.warning("Redis ping falhou: %s — usando fallback em memória", e)
         raise
+    REDIS_DISPONIVEL = True
 except Exception:
-    # fallback simples em memória (não thread-safe e não persistente)
-    logger.warning("Redis indisponível — usando fallback em memória (apenas para dev).")
-    class _DummyRedis:
-        def __init__(self):
-            self._m = {}
-        def get(self, k): return self._m.get(k)
-        def incr(self, k):
-            v = int(self._m.get(k, 0)) + 1
-            self._m[k] = v
-            return v
-        def expire(self, k, t): pass
-        def delete(self, k):
-            if k in self._m: del self._m[k]
-    redis_client = _DummyRedis()
+    logger.warning("Redis indisponível — usando limitador em memória (por processo).")
+    redis_client = None
+    REDIS_DISPONIVEL = False
+
+LIMITE_MEMORIA_MAX_CHAVES = int(os.getenv("LIMITE_MEMORIA_MAX_CHAVES", "100000"))
+_PARTICOES_LIMITE = 16
+
+
+class _LimitadorMemoria:
+    # janela deslizante (contador da janela atual + anterior ponderada) por chave;
+    # locks particionados por hash da chave, TTL de 2 janelas e teto de chaves (LRU)
+
+    def __init__(self, max_chaves: int, particoes: int = _PARTICOES_LIMITE):
+        self._particoes = [(threading.Lock(), OrderedDict()) for _ in range(particoes)]
+        self._max_por_particao = max(1, max_chaves // particoes)
+
+    def _particao(self, chave: str):
+        return self._particoes[hash(chave) % len(self._particoes)]
+
+    @staticmethod
+    def _avancar(item: list, agora: float) -> None:
+        # item = [inicio_janela, janela, atual, anterior]
+        inicio, janela = item[0], item[1]
+        if agora < inicio + janela:
+            return
+        passos = int((agora - inicio) // janela)
+        item[3] = item[2] if passos == 1 else 0
+        item[2] = 0
+        item[0] = inicio + passos * janela
+
+    @staticmethod
+    def _estimar(item: list, agora: float) -> float:
+        inicio, janela, atual, anterior = item
+        return atual + anterior * max(0.0, 1 - (agora - inicio) / janela)
+
+    def _despejar(self, dados: OrderedDict, agora: float) -> None:
+        # as menos usadas ficam na frente; remove expiradas e o que passar do teto
+        while dados:
+            item = next(iter(dados.values()))
+            if agora < item[0] + 2 * item[1] and len(dados) <= self._max_por_particao:
+                break
+            dados.popitem(last=False)
+
+    def incr(self, chave: str, janela: int) -> Tuple[float, int]:
+        agora = time.monotonic()
+        lock, dados = self._particao(chave)
+        with lock:
+            item = dados.get(chave)
+            if item is None:
+                item = dados[chave] = [agora, float(janela), 0, 0]
+            else:
+                self._avancar(item, agora)
+                dados.move_to_end(chave)
+            item[2] += 1
+            self._despejar(dados, agora)
+            return self._estimar(item, agora), max(1, int(item[0] + item[1] - agora + 0.999))
+
+    def contar(self, chave: str) -> float:
+        agora = time.monotonic()
+        lock, dados = self._particao(chave)
+        with lock:
+            item = dados.get(chave)
+            if item is None:
+                return 0
+            self._avancar(item, agora)
+            return self._estimar(item, agora)
+
+    def devolver(self, chave: str) -> None:
+        lock, dados = self._particao(chave)
+        with lock:
+            item = dados.get(chave)
+            if item is not None:
+                self._avancar(item, time.monotonic())
+                item[2] = max(0, item[2] - 1)
+
+    def limpar(self, chave: str) -> None:
+        lock, dados = self._particao(chave)
+        with lock:
+            dados.pop(chave, None)
+
+
+# INCR + EXPIRE atômicos em uma ida ao Redis (janela fixa iniciada no primeiro acesso)
+_LUA_INCR_EXPIRE = """
+local v = redis.call('INCR', KEYS[1])
+local ttl = redis.call('TTL', KEYS[1])
+if ttl < 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    ttl = tonumber(ARGV[1])
+end
+return {v, ttl}
+"""
+
+
+# DECR só se a chave ainda existe (não recria sem TTL uma janela que já expirou)
+_LUA_DEVOLVER = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('DECR', KEYS[1])
+end
+return 0
+"""
+
+
+class _LimitadorRedis:
+
+    def __init__(self, cliente):
+        self._cliente = cliente
+        self._script = cliente.register_script(_LUA_INCR_EXPIRE)
+        self._script_devolver = cliente.register_script(_LUA_DEVOLVER)
+
+    def incr(self, chave: str, janela: int) -> Tuple[float, int]:
+        v, ttl = self._script(keys=[chave], args=[int(janela)])
+        return int(v), max(1, int(ttl))
+
+    def contar(self, chave: str) -> float:
+        v = self._cliente.get(chave)
+        return int(v) if v else 0
+
+    def devolver(self, chave: str) -> None:
+        self._script_devolver(keys=[chave])
+
+    def limpar(self, chave: str) -> None:
+        self._cliente.delete(chave)
+
+
+limitador = _LimitadorRedis(redis_client) if REDIS_DISPONIVEL else _LimitadorMemoria(LIMITE_MEMORIA_MAX_CHAVES)
+
+
+def consumir_limite(chave: str, limite: int, janela: int, devolver_se_negado: bool = False) -> Tuple[bool, int]:
+    # registra um acesso; devolve (permitido, segundos para o Retry-After).
+    # devolver_se_negado: a tentativa recusada não conta (quem só adia e tenta de novo)
+    if limite <= 0:
+        return True, 0
+    try:
+        usados, retry = limitador.incr(chave, janela)
+        if usados > limite and devolver_se_negado:
+            limitador.devolver(chave)
+    except Exception as e:
+        logger.warning("Erro ao acessar limitador: %s", e)
+        return True, 0
+    return usados <= limite, retry
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/admin/login")
 
@@ -60,64 +196,183 @@ def chave_login(email: str, ip: str) -> str:
     return f"login_attempts:{em}:{ip}"
 
 
+class ContextoAuth:
+    # dados do admin que vêm assinados no token (evita ir ao banco em cada requisição)
+    __slots__ = ("admin_id", "email", "foto_perfil", "tem_foto")
+
+    def __init__(self, admin_id: int, email: Optional[str] = None, foto_perfil: Optional[str] = None, tem_foto: bool = False):
+        self.admin_id = admin_id
+        self.email = email
+        self.foto_perfil = foto_perfil
+        # False em tokens antigos, emitidos antes do claim 'foto' existir
+        self.tem_foto = tem_foto
+
+
+def claims_admin(admin) -> Dict[str, Any]:
+    return {
+        "sub": str(admin.id),
+        "email": getattr(admin, "email", None),
+        "foto": getattr(admin, "foto_perfil", None),
+    }
+
+
 def criar_token_acesso(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "typ": "access"})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verificar_token(token: str = Security(oauth2_scheme)) -> int:
 
-    credentials_exception = HTTPException(
+def criar_token_refresh(admin_id: int, expires_delta: Optional[timedelta] = None) -> str:
+    expire = datetime.utcnow() + (expires_delta or timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+    to_encode = {"sub": str(admin_id), "exp": expire, "typ": "refresh", "jti": uuid.uuid4().hex}
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+class _CacheTokens:
+    # LRU de tokens já validados: token repetido não refaz o decode/HMAC
+
+    def __init__(self, max_itens: int):
+        self.max_itens = max_itens
+        self._dados: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[ContextoAuth]:
+        with self._lock:
+            item = self._dados.get(token)
+            if item is None:
+                return None
+            exp, ctx = item
+            if exp <= time.time():
+                del self._dados[token]
+                return None
+            self._dados.move_to_end(token)
+            return ctx
+
+    def put(self, token: str, exp: float, ctx: ContextoAuth) -> None:
+        if self.max_itens <= 0:
+            return
+        with self._lock:
+            self._dados[token] = (exp, ctx)
+            self._dados.move_to_end(token)
+            while len(self._dados) > self.max_itens:
+                self._dados.popitem(last=False)
+
+
+_cache_tokens = _CacheTokens(TOKEN_CACHE_MAX)
+
+
+def _credenciais_invalidas() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Token invalido ou expirado",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+
+def _decodificar(token: str, tipo: str) -> Dict[str, Any]:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        sub = payload.get("sub")
-        if sub is None:
-            raise credentials_exception
-        try:
-            admin_id = int(sub)
-        except Exception:
-            raise credentials_exception
-        return admin_id
     except JWTError:
-        raise credentials_exception
+        raise _credenciais_invalidas()
+    # tokens antigos não têm 'typ' e são de acesso
+    if payload.get("typ", "access") != tipo:
+        raise _credenciais_invalidas()
+    sub = payload.get("sub")
+    if sub is None:
+        raise _credenciais_invalidas()
+    try:
+        payload["sub"] = int(sub)
+    except Exception:
+        raise _credenciais_invalidas()
+    return payload
+
+
+def verificar_contexto(token: str = Security(oauth2_scheme)) -> ContextoAuth:
+    ctx = _cache_tokens.get(token)
+    if ctx is not None:
+        return ctx
+    payload = _decodificar(token, "access")
+    ctx = ContextoAuth(
+        admin_id=payload["sub"],
+        email=payload.get("email"),
+        foto_perfil=payload.get("foto"),
+        tem_foto="foto" in payload,
+    )
+    _cache_tokens.put(token, float(payload.get("exp", 0)), ctx)
+    return ctx
+
+
+def verificar_token(token: str = Security(oauth2_scheme)) -> int:
+    return verificar_contexto(token).admin_id
+
+
+def _marcar_refresh_usado(db: Session, payload: Dict[str, Any]) -> bool:
+    # jti gravado no banco até o token expirar (o limitador em memória despeja chaves e é
+    # por processo: outro worker aceitaria o mesmo token); True = primeira vez
+    jti = payload.get("jti")
+    if not jti:
+        return False
+    agora = datetime.utcnow()
+    expira_em = datetime.utcfromtimestamp(float(payload.get("exp", 0)))
+    try:
+        # os expirados já são recusados pela assinatura: não precisam mais da linha
+        db.execute(delete(models.RefreshUsado).where(models.RefreshUsado.expira_em < agora))
+        db.execute(insert(models.RefreshUsado).values(jti=jti, expira_em=expira_em))
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return False
+    except SQLAlchemyError as e:
+        # sem onde registrar o uso não dá para garantir uso único: recusa (o usuário faz login)
+        db.rollback()
+        logger.warning("Erro ao registrar uso do refresh token: %s", e)
+        return False
+    return True
+
+
+def consumir_token_refresh(db: Session, token: str) -> int:
+    # refresh é de uso único (rotação): cada renovação devolve um novo e o antigo morre.
+    # Reapresentar um já trocado (vazado ou repetido) dá 401
+    payload = _decodificar(token, "refresh")
+    if not _marcar_refresh_usado(db, payload):
+        logger.warning("Refresh token reutilizado ou sem jti (admin %s)", payload["sub"])
+        raise _credenciais_invalidas()
+    return payload["sub"]
+
+
+def revogar_token_refresh(db: Session, token: str) -> None:
+    # logout: o refresh deixa de valer mesmo antes de expirar
+    try:
+        payload = _decodificar(token, "refresh")
+    except HTTPException:
+        return
+    _marcar_refresh_usado(db, payload)
 
 def pode_tentar_login(email: str, ip: str) -> bool:
     key = chave_login(email, ip)
     try:
-        tentativas = redis_client.get(key)
-        if tentativas and int(tentativas) >= LIMITE_TENTATIVAS:
+        if limitador.contar(key) >= LIMITE_TENTATIVAS:
             return False
     except Exception as e:
-        logger.warning("Erro ao acessar Redis: %s", e)
+        logger.warning("Erro ao acessar limitador: %s", e)
         return True
     return True
 
 
 def registra_erro_login(email: str, ip: str) -> None:
     key = chave_login(email, ip)
-    try:       
-        tentativas = redis_client.incr(key)
-        if tentativas == 1:
-            try:
-                redis_client.expire(key, TEMPO_BLOQUEIO)
-            except Exception:
-                pass
+    try:
+        limitador.incr(key, TEMPO_BLOQUEIO)
     except Exception as e:
-        logger.warning("Erro ao acessar Redis: %s", e)
+        logger.warning("Erro ao acessar limitador: %s", e)
 
 
 def limpa_tentativas(email: str, ip: str) -> None:
     key = chave_login(email, ip)
     try:
-        redis_client.delete(key)
+        limitador.limpar(key)
     except Exception as e:
-        logger.warning("Erro ao acessar Redis: %s", e)
-        
-    
\ No newline at end of file
+        logger.warning("Erro ao acessar limitador: %s", e)
+
@@ -0,0 +1,124 @@
+import os
+import time
+import hashlib
+import secrets
+import threading
+from typing import List
+
+
+# códigos de rastreio: 12 caracteres Crockford base32 = 60 bits
+#   40 bits de milissegundos desde EPOCA_MS (~34 anos) | 10 bits do processo | 10 bits de contador
+# únicos por construção dentro do processo; a permutação (Feistel com chave) só embaralha,
+# então continua sem colisão e o código público não revela a ordem nem o horário
+_ALFABETO = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+TAMANHO_CODIGO = 12
+
+_BITS_TEMPO = 40
+_BITS_NO = 10
+_BITS_CONTADOR = 10
+_MEIO = 30
+_MASCARA_MEIO = (1 << _MEIO) - 1
+_RODADAS = 4
+
+EPOCA_MS = 1704067200000  # 2024-01-01 UTC
+
+APP_ENV = os.getenv("APP_ENV", "development").lower()
+
+# nó do processo (10 bits) = CODIGO_NO + pid do worker, mod 1024. Os workers do uvicorn/gunicorn
+# herdam o mesmo CODIGO_NO; o pid separa os da mesma máquina (CODIGO_NO separa máquinas/containers).
+# Fora de produção, sem CODIGO_NO, a base é sorteada na subida.
+# Nó repetido que ainda sobrar (pids a 1024 de distância, bases vizinhas em máquinas diferentes) só
+# repete código no mesmo ms e contador: o UNIQUE do banco recusa e criar_ficha/importação geram outro
+_env_no = os.getenv("CODIGO_NO")
+_env_chave = os.getenv("CODIGO_CHAVE")
+if APP_ENV == "production" and not (_env_no and _env_chave):
+    # base sorteada: dois processos podem tirar o mesmo nó; chave vinda da SECRET_KEY: trocar uma muda a outra
+    raise ValueError("Em produção, CODIGO_CHAVE e CODIGO_NO (0-1023, um por máquina) são obrigatórios")
+if _env_no and not 0 <= int(_env_no) < (1 << _BITS_NO):
+    raise ValueError("CODIGO_NO deve estar entre 0 e 1023")
+BASE_NO = int(_env_no) if _env_no else secrets.randbits(_BITS_NO)
+
+
+def no_do_processo() -> int:
+    return (BASE_NO + os.getpid()) % (1 << _BITS_NO)
+
+
+NO_PROCESSO = no_do_processo()
+
+_CHAVE = (_env_chave or os.getenv("SECRET_KEY", "CHAVE_SECRETA")).encode("utf-8")
+_CHAVES_RODADA = [hashlib.blake2b(_CHAVE, digest_size=16, person=b"codigo-%d" % i).digest() for i in range(_RODADAS)]
+
+
+def _f(metade: int, rodada: int) -> int:
+    h = hashlib.blake2b(metade.to_bytes(4, "big"), digest_size=4, key=_CHAVES_RODADA[rodada]).digest()
+    return int.from_bytes(h, "big") & _MASCARA_MEIO
+
+
+def permutar(valor: int) -> int:
+    # rede de Feistel: bijeção em 60 bits
+    esq, dir_ = valor >> _MEIO, valor & _MASCARA_MEIO
+    for rodada in range(_RODADAS):
+        esq, dir_ = dir_, esq ^ _f(dir_, rodada)
+    return (esq << _MEIO) | dir_
+
+
+def despermutar(valor: int) -> int:
+    esq, dir_ = valor >> _MEIO, valor & _MASCARA_MEIO
+    for rodada in reversed(range(_RODADAS)):
+        esq, dir_ = dir_ ^ _f(esq, rodada), esq
+    return (esq << _MEIO) | dir_
+
+
+def codificar(valor: int) -> str:
+    chars = []
+    for _ in range(TAMANHO_CODIGO):
+        chars.append(_ALFABETO[valor & 31])
+        valor >>= 5
+    return "".join(reversed(chars))
+
+
+class _Gerador:
+
+    def __init__(self, no: int):
+        self.no = no
+        self.lock = threading.Lock()
+        self.ultimo_ms = 0
+        self.contador = 0
+
+    def proximo(self) -> int:
+        with self.lock:
+            agora = int(time.time() * 1000) - EPOCA_MS
+            # relógio voltou: segue no último ms usado em vez de repetir valores
+            if agora <= self.ultimo_ms:
+                agora = self.ultimo_ms
+                self.contador += 1
+                if self.contador >> _BITS_CONTADOR:
+                    # contador do ms esgotado: avança o ms "emprestado"
+                    agora += 1
+                    self.contador = 0
+            else:
+                self.contador = 0
+            self.ultimo_ms = agora
+            tempo = agora & ((1 << _BITS_TEMPO) - 1)
+            return (tempo << (_BITS_NO + _BITS_CONTADOR)) | (self.no << _BITS_CONTADOR) | self.contador
+
+
+_gerador = _Gerador(NO_PROCESSO)
+
+
+def _depois_do_fork() -> None:
+    # worker criado por fork (gunicorn --preload) herda o gerador do pai: recalcula o nó pelo pid novo
+    global NO_PROCESSO, _gerador
+    NO_PROCESSO = no_do_processo()
+    _gerador = _Gerador(NO_PROCESSO)
+
+
+os.register_at_fork(after_in_child=_depois_do_fork)
+
+
+def novo_codigo() -> str:
+    return codificar(permutar(_gerador.proximo()))
+
+
+def novos_codigos(quantidade: int) -> List[str]:
+    return [novo_codigo() for _ in range(quantidade)]
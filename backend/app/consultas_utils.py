@@ -0,0 +1,170 @@
+import os
+import json
+import logging
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger(__name__)
+
+
+# Detector de N+1 para desenvolvimento e testes: conta as queries de cada requisição,
+# aponta o mesmo SQL repetido (o sintoma clássico de lazy load em laço) e compara
+# com o orçamento declarado no endpoint (@orcamento_queries)
+
+# opt-in: o listener roda em toda query do processo; ligar em dev e na suíte de testes
+CONSULTAS_DETECTOR = os.getenv("CONSULTAS_DETECTOR", "false").lower() in ("1", "true", "yes")
+# estrito: estourar o orçamento vira 500 com o relatório (para rodar a suíte de testes assim)
+CONSULTAS_ESTRITO = os.getenv("CONSULTAS_ESTRITO", "false").lower() in ("1", "true", "yes")
+# orçamento dos endpoints sem @orcamento_queries (0 = só os declarados são checados)
+CONSULTAS_ORCAMENTO_PADRAO = int(os.getenv("CONSULTAS_ORCAMENTO_PADRAO", "20"))
+# a partir de quantas execuções do mesmo SQL na requisição vira suspeita de N+1
+CONSULTAS_REPETIDAS_MAX = int(os.getenv("CONSULTAS_REPETIDAS_MAX", "3"))
+
+
+class OrcamentoExcedido(AssertionError):
+
+    def __init__(self, relatorio: Dict):
+        self.relatorio = relatorio
+        super().__init__(formatar(relatorio))
+
+
+def orcamento_queries(maximo: int) -> Callable:
+    # decorador do endpoint (abaixo do @app.get/...): máximo de queries por requisição
+    def _marcar(func):
+        func._orcamento_queries = maximo
+        return func
+    return _marcar
+
+
+class Registro:
+
+    def __init__(self):
+        self.total = 0
+        self.statements: Counter = Counter()
+
+    def repetidas(self, minimo: int = None) -> Dict[str, int]:
+        minimo = minimo or CONSULTAS_REPETIDAS_MAX
+        return {sql: n for sql, n in self.statements.most_common() if n >= minimo}
+
+
+_registro: contextvars.ContextVar[Optional[Registro]] = contextvars.ContextVar("registro_consultas", default=None)
+
+
+def _ao_executar(conn, cursor, statement, parameters, context, executemany):
+    registro = _registro.get()
+    if registro is not None:
+        registro.total += 1
+        registro.statements[statement] += 1
+
+
+if CONSULTAS_DETECTOR:
+    event.listen(Engine, "before_cursor_execute", _ao_executar)
+
+
+@contextmanager
+def contar_queries(maximo: Optional[int] = None) -> Iterator[Registro]:
+    # para testes: with contar_queries(3) as r: ... (levanta OrcamentoExcedido ao sair se passar)
+    registro = Registro()
+    if not CONSULTAS_DETECTOR:
+        event.listen(Engine, "before_cursor_execute", _ao_executar)
+    token = _registro.set(registro)
+    try:
+        yield registro
+    finally:
+        _registro.reset(token)
+        if not CONSULTAS_DETECTOR:
+            event.remove(Engine, "before_cursor_execute", _ao_executar)
+    relatorio = avaliar(registro, maximo)
+    if relatorio and relatorio["excedeu"]:
+        raise OrcamentoExcedido(relatorio)
+
+
+@contextmanager
+def ignorar_queries() -> Iterator[None]:
+    # queries feitas uma vez por processo (sondagens, caches) não contam no orçamento da requisição
+    token = _registro.set(None)
+    try:
+        yield
+    finally:
+        _registro.reset(token)
+
+
+def avaliar(registro: Registro, maximo: Optional[int], rota: str = "") -> Optional[Dict]:
+    repetidas = registro.repetidas()
+    excedeu = maximo is not None and maximo > 0 and registro.total > maximo
+    if not excedeu and not repetidas:
+        return None
+    return {"rota": rota, "queries": registro.total, "orcamento": maximo, "excedeu": excedeu, "repetidas": repetidas}
+
+
+def formatar(relatorio: Dict) -> str:
+    partes = [f"{relatorio['rota'] or 'bloco'}: {relatorio['queries']} queries"]
+    if relatorio["orcamento"]:
+        partes.append(f"(orçamento {relatorio['orcamento']})")
+    for sql, n in list(relatorio["repetidas"].items())[:3]:
+        partes.append(f"\n  {n}x {' '.join(sql.split())[:200]}")
+    return " ".join(partes)
+
+
+def _orcamento(scope) -> Optional[int]:
+    endpoint = scope.get("endpoint")
+    maximo = getattr(endpoint, "_orcamento_queries", None)
+    if maximo is None and CONSULTAS_ORCAMENTO_PADRAO > 0:
+        maximo = CONSULTAS_ORCAMENTO_PADRAO
+    return maximo
+
+
+class DetectorN1Middleware:
+    # ASGI puro; a checagem roda no início da resposta, quando o endpoint já terminou
+    # (queries feitas durante o corpo de um StreamingResponse ficam fora da conta).
+    # o total vai no cabeçalho X-Consultas, para conferir no navegador/testes
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not CONSULTAS_DETECTOR:
+            return await self.app(scope, receive, send)
+        registro = Registro()
+        token = _registro.set(registro)
+        checado = [False]
+        bloqueado = [False]
+
+        async def _send(mensagem):
+            if bloqueado[0]:
+                return
+            if mensagem["type"] == "http.response.start" and not checado[0]:
+                checado[0] = True
+                relatorio = avaliar(registro, _orcamento(scope), scope["path"])
+                if relatorio:
+                    logger.warning("Possível N+1 / orçamento de queries: %s", formatar(relatorio))
+                    if CONSULTAS_ESTRITO and relatorio["excedeu"]:
+                        bloqueado[0] = True
+                        await _responder_500(send, relatorio)
+                        return
+                mensagem = {**mensagem, "headers": [*mensagem.get("headers", []), (b"x-consultas", str(registro.total).encode("ascii"))]}
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _registro.reset(token)
+
+
+async def _responder_500(send, relatorio: Dict) -> None:
+    corpo = json.dumps({"detail": "Orçamento de queries excedido.", "consultas": relatorio}, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 500,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(corpo)).encode("ascii")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": corpo})
@@ -1,15 +1,23 @@
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from . import models, schemas
-from passlib.context import CryptContext
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import extract, func, or_, select, tuple_, update, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, schemas, search_utils, rastreio_cache, codigo_utils
+from .pdf_cache import invalidar_pdf_ficha, invalidar_pdf_cliente
+from .senha_utils import verificar_senha
+from .notificacao_utils import notificar_status_ficha, notificar_status_fichas
 from datetime import datetime
-import uuid, logging
-from typing import List, Optional, Dict, Any
+from enum import Enum
+import logging, json, base64
+from typing import List, Optional, Dict, Any, Callable, Tuple
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 logger = logging.getLogger(__name__)
 
+# novas tentativas quando um código de rastreio gerado bate no UNIQUE
+CODIGO_TENTATIVAS = 3
 
 
 def autenticar_admin(db: Session, email: str, password: str) -> Optional[models.Admin]:
@@ -24,31 +32,61 @@ def autenticar_admin(db: Session, email: str, password: str) -> Optional[models.
 
     stored = getattr(admin, "hashed_password", getattr(admin, "hashed", "") or "")
 
-    # tentativa com passlib CryptContext (global pwd_context)
-    try:
-        if pwd_context.verify(password, stored):
-            return admin
-    except ValueError:
-        # senha >72 bytes - tentar truncar
+    # bcrypt roda fora da thread da requisição (pool de processos com fila limitada)
+    ok, novo_hash = verificar_senha(password, stored)
+    if not ok:
+        return None
+
+    if novo_hash:
+        # rehash transparente quando o custo/esquema do hash está desatualizado
         try:
-            if pwd_context.verify(password[:72], stored):
-                return admin
+            admin.hashed_password = novo_hash
+            db.add(admin)
+            db.commit()
         except Exception:
-            logger.warning("passlib truncated verify falhou")
-    except Exception:
-        logger.warning("passlib verify falhou")
+            db.rollback()
+            logger.warning("Falha ao atualizar hash da senha (não crítico)")
+
+    return admin
+
+
+#Paginação
 
-    # fallback direto com bcrypt.checkpw
+def codificar_cursor(ultimo_id: int) -> str:
+    raw = json.dumps({"id": int(ultimo_id)}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor: str) -> int:
     try:
-        import bcrypt as _bcrypt
-        pw = (password or "").encode("utf-8")[:72]
-        stored_b = (stored or "").encode("utf-8")
-        if _bcrypt.checkpw(pw, stored_b):
-            return admin
+        pad = "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(cursor + pad).decode("utf-8"))
+        ultimo_id = int(data["id"])
     except Exception:
-        logger.exception("bcrypt fallback falhou")
-
-    return None
+        raise ValueError("Cursor inválido")
+    # cursor adulterado com id fora do INTEGER do banco estourava no driver (500)
+    if not 0 < ultimo_id < 2 ** 63:
+        raise ValueError("Cursor inválido")
+    return ultimo_id
+
+
+def paginar(query, coluna_id, page: int = 1, page_size: int = 12, cursor: Optional[str] = None,
+            include_total: bool = True, id_de: Callable[[Any], int] = lambda r: r.id) -> Tuple[List[Any], Optional[int], Optional[str]]:
+    # cursor=None -> paginação por OFFSET; cursor="" -> primeira página no modo cursor
+    total = query.count() if include_total else None
+    q = query.order_by(coluna_id.desc())
+    if cursor is not None:
+        if cursor:
+            q = q.filter(coluna_id < decodificar_cursor(cursor))
+    else:
+        q = q.offset((page - 1) * page_size)
+    # busca um registro extra só para saber se existe próxima página
+    rows = q.limit(page_size + 1).all()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = codificar_cursor(id_de(rows[-1]))
+    return rows, total, next_cursor
 
 
 #Cliente
@@ -96,7 +134,7 @@ def atualizar_cliente(db: Session, cliente_id: int, dados: dict[str, Any]):
     if not cliente:
         return None
     proibidos = {'id', 'created_at', 'data_criacao'}
-    changed = False
+    alterados = set()
     for key, value in (dados or {}).items():
         if key in proibidos:
             continue
@@ -106,9 +144,10 @@ def atualizar_cliente(db: Session, cliente_id: int, dados: dict[str, Any]):
             continue
         if isinstance(value, str):
             value = value.strip()
+        if getattr(cliente, key) != value:
+            alterados.add(key)
         setattr(cliente, key, value)
-        changed = True
-    if not changed:
+    if not alterados:
         return cliente
     try:
         db.add(cliente)
@@ -117,21 +156,72 @@ def atualizar_cliente(db: Session, cliente_id: int, dados: dict[str, Any]):
     except Exception:
         db.rollback()
         raise
+    invalidar_pdf_cliente(cliente.id, alterados)
     return cliente
 
 
 #Ficha
 
-def gerar_codigo_ficha(db: Session, length: int = 12, max_attempts: int = 8) -> str:
-    attempts = 0
-    while attempts < max_attempts:
-        codigo = uuid.uuid4().hex[:length].upper()
-        exists = db.query(models.Ficha).filter(models.Ficha.codigo_rastreio == codigo).first()
-        if not exists:
-            return codigo
-        attempts += 1
-    raise RuntimeError("Não foi possível gerar um código único ")
-        
+def gerar_codigo_ficha(db: Optional[Session] = None) -> str:
+    # único por construção (codigo_utils); o UNIQUE do banco cobre o resto, sem SELECT de checagem
+    return codigo_utils.novo_codigo()
+
+
+def gerar_codigos_ficha(db: Optional[Session], quantidade: int) -> List[str]:
+    return codigo_utils.novos_codigos(quantidade)
+
+
+def _conflito_codigo(e: IntegrityError) -> bool:
+    return "codigo_rastreio" in str(getattr(e, "orig", e))
+
+
+def codigos_existentes(db: Session, codigos) -> set:
+    codigos = [c for c in codigos if c]
+    if not codigos:
+        return set()
+    return set(db.execute(select(models.Ficha.codigo_rastreio).where(models.Ficha.codigo_rastreio.in_(codigos))).scalars())
+
+
+def chave_cliente(nome: Optional[str], telefone: Optional[str]) -> Tuple[str, str]:
+    # identifica o cliente na importação: (nome em minúsculas, telefone)
+    return (nome or "").strip().lower(), (telefone or "").strip()
+
+
+def mapa_clientes_do_admin(db: Session, admin_id: int) -> Dict[Tuple[str, str], int]:
+    # chave_cliente -> id; usado para não duplicar clientes na importação
+    rows = db.execute(
+        select(models.Cliente.id, models.Cliente.nome, models.Cliente.telefone).where(models.Cliente.admin_id == admin_id)
+    ).all()
+    return {chave_cliente(nome, telefone): id_ for id_, nome, telefone in rows}
+
+
+def inserir_clientes_em_lote(db: Session, clientes: List[Dict[str, Any]]) -> Dict[Tuple[str, str], int]:
+    # INSERT em lote (sem commit) devolvendo chave_cliente -> id. Sem sort_by_parameter_order:
+    # no SQLite ele obriga um INSERT por linha; os ids voltam casados pela chave
+    if not clientes:
+        return {}
+    res = db.execute(
+        insert(models.Cliente).returning(models.Cliente.id, models.Cliente.nome, models.Cliente.telefone),
+        clientes,
+    )
+    return {chave_cliente(nome, telefone): id_ for id_, nome, telefone in res}
+
+
+def inserir_fichas_em_lote(db: Session, fichas: List[Dict[str, Any]], gerados: Optional[List[int]] = None) -> None:
+    # executemany sem RETURNING (sem commit); gerados = posições com código gerado, trocadas se houver colisão
+    if not fichas:
+        return
+    for tentativa in range(CODIGO_TENTATIVAS):
+        try:
+            with db.begin_nested():
+                db.execute(insert(models.Ficha), fichas)
+            return
+        except IntegrityError as e:
+            if not gerados or not _conflito_codigo(e) or tentativa == CODIGO_TENTATIVAS - 1:
+                raise
+            logger.warning("Colisão de código de rastreio gerado no lote; gerando outros")
+            for i, codigo in zip(gerados, gerar_codigos_ficha(db, len(gerados))):
+                fichas[i]["codigo_rastreio"] = codigo
 
 
 def criar_ficha(db: Session, ficha: schemas.FichaCreate, cliente_id: int, admin_id: Optional[int] = None):
@@ -142,40 +232,86 @@ def criar_ficha(db: Session, ficha: schemas.FichaCreate, cliente_id: int, admin_
     data['cliente_id'] = cliente_id
     # restante do código existente...
     codigo = (data.get('codigo_rastreio') or '').strip()
-    if codigo:
-        if db.query(models.Ficha).filter(models.Ficha.codigo_rastreio == codigo).first():
-            raise ValueError("Código de rastreio já existe.")
-    else:
-        codigo = gerar_codigo_ficha(db)
-    data["codigo_rastreio"] = codigo
+    informado = bool(codigo)
     now = datetime.utcnow()
     if hasattr(models.Ficha, "data_criacao"):
         data.setdefault("data_criacao", now)
     elif hasattr(models.Ficha, "created_at"):
         data.setdefault("created_at", now)
 
-    db_ficha = models.Ficha(**data)
-    try:
-        db.add(db_ficha)
-        db.commit()
-        db.refresh(db_ficha)
-    except IntegrityError:
-        db.rollback()
-        raise
-    return db_ficha
+    # sem SELECT prévio: o UNIQUE de codigo_rastreio decide; código gerado que colidir é trocado e tenta de novo
+    for _ in range(CODIGO_TENTATIVAS):
+        data["codigo_rastreio"] = codigo if informado else gerar_codigo_ficha()
+        db_ficha = models.Ficha(**data)
+        try:
+            db.add(db_ficha)
+            db.commit()
+            db.refresh(db_ficha)
+        except IntegrityError as e:
+            db.rollback()
+            if not _conflito_codigo(e):
+                raise
+            if informado:
+                raise ValueError("Código de rastreio já existe.")
+            logger.warning("Colisão de código de rastreio gerado; tentando outro")
+            continue
+        return db_ficha
+    raise RuntimeError("Não foi possível gerar um código único ")
     
 
+def _filtro_dono(admin_id: int):
+    # clientes sem admin (admin removido -> SET NULL) continuam acessíveis
+    return or_(models.Cliente.admin_id == admin_id, models.Cliente.admin_id.is_(None))
+
+
+def query_ficha_escopo(db: Session, admin_id: Optional[int] = None, *entidades):
+    # ficha + checagem de dono no mesmo SELECT (join com clientes)
+    q = db.query(*(entidades or (models.Ficha,)))
+    if admin_id is not None or models.Cliente in entidades:
+        q = q.join(models.Cliente, models.Ficha.cliente_id == models.Cliente.id)
+    if admin_id is not None:
+        q = q.filter(_filtro_dono(admin_id))
+    return q
+
+
+def buscar_ficha_com_cliente(db: Session, ficha_id: int, admin_id: Optional[int] = None) -> Optional[Tuple[models.Ficha, models.Cliente]]:
+    if ficha_id is None:
+        return None
+    row = query_ficha_escopo(db, admin_id, models.Ficha, models.Cliente).filter(models.Ficha.id == ficha_id).first()
+    if not row:
+        return None
+    return row[0], row[1]
+
+
 def buscar_ficha_por_codigo(db: Session, codigo: str, admin_id: Optional[int] = None) -> Optional[models.Ficha]:
     if not codigo:
         return None
-    ficha = db.query(models.Ficha).filter(models.Ficha.codigo_rastreio == codigo.strip()).first()
-    if not ficha:
+    return query_ficha_escopo(db, admin_id).filter(models.Ficha.codigo_rastreio == codigo.strip()).first()
+
+def _select_rastreio_publico(codigo: str):
+    # só as colunas da página pública, sem montar o objeto ORM inteiro
+    return (
+        select(
+            models.Ficha.codigo_rastreio,
+            models.Ficha.status,
+            models.Ficha.defeito,
+            models.Ficha.previsao_entrega,
+            models.Ficha.observacao_publica,
+            models.Ficha.data_criacao,
+        )
+        .where(models.Ficha.codigo_rastreio == codigo.strip())
+        .limit(1)
+    )
+
+def buscar_rastreio_publico(db: Session, codigo: str):
+    if not codigo:
         return None
-    if admin_id is not None:
-        cliente = db.query(models.Cliente).filter(models.Cliente.id == ficha.cliente_id).first()
-        if not cliente or (cliente.admin_id is not None and cliente.admin_id != admin_id):
-            return None
-    return ficha
+    return db.execute(_select_rastreio_publico(codigo)).first()
+
+async def buscar_rastreio_publico_async(db: AsyncSession, codigo: str):
+    if not codigo:
+        return None
+    return (await db.execute(_select_rastreio_publico(codigo))).first()
 
 def listar_fichas(db: Session, admin_id: Optional[int] = None) -> List[models.Ficha]:
    
@@ -190,17 +326,35 @@ def listar_fichas(db: Session, admin_id: Optional[int] = None) -> List[models.Fi
     return q.order_by(models.Ficha.id.desc()).all()
 
 
+def aplicar_filtros_fichas(db: Session, query, q: str = "", status: str = "", data_ini: str = "", data_fim: str = "", ranquear: bool = True):
+    # mesmos filtros da listagem /fichas; a query precisa ter o join com clientes
+    if q:
+        query = search_utils.filtrar_fichas(db, query, q, ranquear=ranquear)
+            
+    if status:
+        # igualdade (valores do StatusEnum): usa o ix_fichas_status, o ILIKE '%...%' não usava
+        query = query.filter(models.Ficha.status == status.strip().upper())
+        
+    if data_ini:
+        try:
+            dt = datetime.fromisoformat(data_ini)
+            query = query.filter(models.Ficha.data_criacao >= dt)
+        except ValueError:
+            pass
+        
+    if data_fim:
+        try:
+            dt = datetime.fromisoformat(data_fim)
+            query = query.filter(models.Ficha.data_criacao < dt)
+        except ValueError:
+            pass
+    return query
+
+
 def buscar_ficha_por_id(db: Session, ficha_id: str, admin_id: Optional[int] = None) -> Optional[models.Ficha]:
     if ficha_id is None:
         return None
-    ficha = db.query(models.Ficha).filter(models.Ficha.id == ficha_id).first()
-    if not ficha: 
-        return None
-    if admin_id is not None:
-        cliente = db.query(models.Cliente).filter(models.Cliente.id == getattr(ficha, "cliente_id", None)).first()
-        if cliente and cliente.admin_id is not None and cliente.admin_id != admin_id:
-            return None 
-    return ficha
+    return query_ficha_escopo(db, admin_id).filter(models.Ficha.id == ficha_id).first()
 
 def buscar_ficha_por_cliente(db: Session, cliente_id: int, admin_id: Optional[int] = None) -> List[models.Ficha]:
     if cliente_id is None:
@@ -249,20 +403,35 @@ def buscar_ficha_por_marca(db: Session, marca: str, admin_id: Optional[int] = No
     return q.filter(models.Ficha.marca.ilike(termo)).order_by(models.Ficha.id.desc()).all()
 
 
-def atualizar_ficha(db: Session, ficha_id: int, dados: Dict[str, Any], admin_id: Optional[int] = None):
+class ConflitoVersao(Exception):
+    pass
+
+
+class LoteGrandeDemais(Exception):
+    pass
+
+
+def _valor_log(v):
+    # valores do diff precisam caber em JSON
+    if isinstance(v, Enum):
+        return v.value
+    if v is None or isinstance(v, (str, int, float, bool)):
+        return v
+    return str(v)
+
+
+def atualizar_ficha(db: Session, ficha_id: int, dados: Dict[str, Any], admin_id: Optional[int] = None, versao: Optional[int] = None):
     
-    ficha = db.query(models.Ficha).filter(models.Ficha.id == ficha_id).first()
+    ficha = buscar_ficha_por_id(db, ficha_id, admin_id=admin_id)
     if not ficha:
         return None
-    
-    if admin_id is not None:
-        cliente = db.query(models.Cliente).filter(models.Cliente.id == getattr(ficha, "cliente_id", None)).first()
-        if cliente and cliente.admin_id is not None and cliente.admin_id != admin_id: 
-            return None
+    if versao is not None and ficha.versao != versao:
+        raise ConflitoVersao("A ficha foi alterada por outra pessoa. Recarregue e tente novamente.")
 
 
-    proibidos = {'id', 'created_at', 'data_criacao', 'cliente_id'}
+    proibidos = {'id', 'created_at', 'data_criacao', 'cliente_id', 'versao'}
     mudancas: Dict[str, Dict[str, Any]] = {}
+    codigo_anterior = ficha.codigo_rastreio
     for key, value in (dados or {}).items():
         if key in proibidos:
             continue
@@ -273,54 +442,240 @@ def atualizar_ficha(db: Session, ficha_id: int, dados: Dict[str, Any], admin_id:
         old = getattr(ficha, key, None)
         if old != value:
             setattr(ficha, key, value)
-            mudancas[key] = {'old': old, 'new': value}
+            mudancas[key] = {'old': _valor_log(old), 'new': _valor_log(value)}
 
     if mudancas:
+        # ficha, histórico e email (outbox) no mesmo commit
         try:
             db.add(ficha)
+            if 'status' in mudancas:
+                notificar_status_ficha(db, ficha, ficha.cliente)
+            db.add(models.LogAtualizacao(
+                status=mudancas['status']['new'] if 'status' in mudancas else "",
+                mudancas=mudancas,
+                ficha_id=ficha.id,
+                data=datetime.utcnow(),
+            ))
             db.commit()
-            db.refresh(ficha)
+        except StaleDataError:
+            # outra edição gravou entre a leitura e o UPDATE (versao mudou)
+            db.rollback()
+            raise ConflitoVersao("A ficha foi alterada por outra pessoa. Recarregue e tente novamente.")
         except Exception:
             db.rollback()
             raise
+        invalidar_pdf_ficha(ficha.id, mudancas.keys())
+        rastreio_cache.invalidar_se_mudou({codigo_anterior, ficha.codigo_rastreio}, mudancas.keys())
+    return ficha
+
 
+def atualizar_fichas_em_lote(db: Session, query, dados: Dict[str, Any], admin_id: int, ids: Optional[List[int]] = None, limite: int = 500) -> Dict[str, Any]:
+    # query = fichas já filtradas e com join de dono (query_ficha_escopo com models.Ficha, models.Cliente)
+    proibidos = {'id', 'created_at', 'data_criacao', 'cliente_id', 'versao', 'codigo_rastreio'}
+    novos = {}
+    for key, value in (dados or {}).items():
+        if key in proibidos or value is None or not hasattr(models.Ficha, key):
+            continue
+        novos[key] = value.strip() if isinstance(value, str) else value
+    if not novos:
+        raise ValueError("Nenhum campo válido para atualizar.")
+
+    rows = query.order_by(models.Ficha.id).limit(limite + 1).all()
+    if len(rows) > limite:
+        raise LoteGrandeDemais(f"Máximo de {limite} fichas por lote. Refine o filtro.")
+
+    itens: Dict[int, str] = {i: "nao_encontrada" for i in (ids or [])}
+    alteradas: List[Tuple[models.Ficha, models.Cliente, Dict[str, Any]]] = []
+    for ficha, cliente in rows:
+        mudancas = {
+            k: {'old': _valor_log(getattr(ficha, k)), 'new': _valor_log(v)}
+            for k, v in novos.items() if getattr(ficha, k) != v
+        }
+        if not mudancas:
+            itens[ficha.id] = "sem_alteracao"
+            continue
+        alteradas.append((ficha, cliente, mudancas))
+
+    if alteradas:
+        donos = select(models.Cliente.id).where(_filtro_dono(admin_id))
+        agora = datetime.utcnow()
         try:
-            detalhe = "; ".join([f"{k}: '{v['old']}' -> '{v['new']}'" for k, v in mudancas.items()])
-            db_log = models.LogAtualizacao(status="", descricao=detalhe, ficha_id=ficha.id, data=datetime.utcnow())
-            db.add(db_log)
+            # um UPDATE só, com o escopo de dono repetido no WHERE e a versão lida de cada ficha:
+            # quem foi editada entre o SELECT e aqui fica de fora (conflito), como no PUT
+            gravadas = set(db.execute(
+                update(models.Ficha)
+                .where(
+                    tuple_(models.Ficha.id, models.Ficha.versao).in_([(f.id, f.versao) for f, _, _ in alteradas]),
+                    models.Ficha.cliente_id.in_(donos),
+                )
+                .values(**novos, versao=models.Ficha.versao + 1)
+                .returning(models.Ficha.id)
+                .execution_options(synchronize_session=False)
+            ).scalars())
+            for ficha, _, _ in alteradas:
+                if ficha.id not in gravadas:
+                    itens[ficha.id] = "conflito"
+            alteradas = [a for a in alteradas if a[0].id in gravadas]
+            # reflete nos objetos carregados sem marcá-los como alterados (não gera UPDATE por linha)
+            for ficha, _, _ in alteradas:
+                itens[ficha.id] = "atualizada"
+                for k, v in novos.items():
+                    set_committed_value(ficha, k, v)
+                set_committed_value(ficha, "versao", ficha.versao + 1)
+            if alteradas:
+                db.execute(insert(models.LogAtualizacao), [
+                    {
+                        "status": mudancas['status']['new'] if 'status' in mudancas else "",
+                        "mudancas": mudancas,
+                        "ficha_id": ficha.id,
+                        "data": agora,
+                    }
+                    for ficha, _, mudancas in alteradas
+                ])
+            if 'status' in novos:
+                notificar_status_fichas(db, [(f, c) for f, c, m in alteradas if 'status' in m])
             db.commit()
         except Exception:
-            try:
-                db.rollback()
-            except Exception:
-                pass        
-    return ficha
+            db.rollback()
+            raise
+        for ficha, _, _ in alteradas:
+            invalidar_pdf_ficha(ficha.id, novos.keys())
+        rastreio_cache.invalidar_se_mudou({f.codigo_rastreio for f, _, _ in alteradas}, novos.keys())
 
+    return {
+        "atualizadas": len(alteradas),
+        "itens": [{"id": i, "resultado": r} for i, r in itens.items()],
+    }
 
-def listar_fichas_para_admin(db: Session, admin_id: int, limit: int = 100) -> List[models.Ficha]:
 
-    if admin_id is None:
-        return []
-    q = (
+def query_fichas_do_admin(db: Session, admin_id: int):
+    return (
         db.query(models.Ficha)
         .join(models.Cliente, models.Ficha.cliente_id == models.Cliente.id)
         .filter(models.Cliente.admin_id == admin_id)
     )
+
+
+# Leituras das listagens: funções síncronas que recebem a Session, para rodar direto ou
+# nos endpoints async via AsyncSession.run_sync (mesmo SQL, I/O pelo driver async)
+
+def pagina_fichas(db: Session, admin_id: int, q: str = "", status: str = "", data_ini: str = "", data_fim: str = "",
+                  page: int = 1, page_size: int = 12, cursor: Optional[str] = None, include_total: bool = True):
+    query = (
+        db.query(models.Ficha, models.Cliente.nome.label("cliente"))
+        .join(models.Cliente, models.Ficha.cliente_id == models.Cliente.id)
+        .filter(models.Cliente.admin_id == admin_id)
+    )
+    query = aplicar_filtros_fichas(db, query, q=q, status=status, data_ini=data_ini, data_fim=data_fim, ranquear=cursor is None)
+    return paginar(query, models.Ficha.id, page, page_size, cursor=cursor, include_total=include_total, id_de=lambda r: r[0].id)
+
+
+def pagina_clientes(db: Session, admin_id: int, q: str = "", page: int = 1, page_size: int = 12,
+                    cursor: Optional[str] = None, include_total: bool = True):
+    query = db.query(models.Cliente).filter(models.Cliente.admin_id == admin_id)
+    if q:
+        query = search_utils.filtrar_clientes(db, query, q, ranquear=cursor is None)
+    return paginar(query, models.Cliente.id, page, page_size, cursor=cursor, include_total=include_total)
+
+
+def buscar_clientes_por_termo(db: Session, admin_id: int, q: str, limite: int = 10) -> List[models.Cliente]:
+    query = db.query(models.Cliente).filter(models.Cliente.admin_id == admin_id)
+    return search_utils.filtrar_clientes(db, query, q).order_by(models.Cliente.nome.asc()).limit(limite).all()
+
+
+def pagina_fichas_do_admin(db: Session, admin_id: int, page: int = 1, page_size: int = 20,
+                           cursor: Optional[str] = None, include_total: bool = True):
+    return paginar(query_fichas_do_admin(db, admin_id), models.Ficha.id, page, page_size, cursor=cursor, include_total=include_total)
+
+
+def pagina_fichas_do_cliente(db: Session, cliente_id: int, page: int = 1, page_size: int = 12):
+    query = db.query(models.Ficha).filter(models.Ficha.cliente_id == cliente_id)
+    items, total, _ = paginar(query, models.Ficha.id, page, page_size)
+    return items, total
+
+
+def listar_fichas_do_cliente(db: Session, cliente_id: int, limite: int = 10) -> List[models.Ficha]:
+    return (
+        db.query(models.Ficha)
+        .filter(models.Ficha.cliente_id == cliente_id)
+        .order_by(models.Ficha.id.desc())
+        .limit(limite)
+        .all()
+    )
+
+
+def pagina_logs_acesso(db: Session, admin_id: int, page: int = 1, page_size: int = 20,
+                       cursor: Optional[str] = None, include_total: bool = True):
+    query = db.query(models.LogAcesso).filter(models.LogAcesso.admin_id == admin_id)
+    return paginar(query, models.LogAcesso.id, page, page_size, cursor=cursor, include_total=include_total)
+
+
+def listar_fichas_para_admin(db: Session, admin_id: int, limit: int = 100) -> List[models.Ficha]:
+
+    if admin_id is None:
+        return []
+    q = query_fichas_do_admin(db, admin_id)
     # garante limite mínimo/máximo razoável
     lim = max(1, min(1000, int(limit or 100)))
     return q.order_by(models.Ficha.id.desc()).limit(lim).all()
 
+
+def _expr_mes(dialeto: str, coluna):
+    # agrupa por 'YYYY-MM' usando a função nativa de cada banco
+    if dialeto == "postgresql":
+        return func.to_char(coluna, "YYYY-MM")
+    if dialeto == "sqlite":
+        return func.strftime("%Y-%m", coluna)
+    if dialeto in ("mysql", "mariadb"):
+        return func.date_format(coluna, "%Y-%m")
+    # demais bancos: EXTRACT é SQL padrão; vira AAAAMM inteiro e _chave_mes formata
+    return extract("year", coluna) * 100 + extract("month", coluna)
+
+
+def _chave_mes(valor) -> Optional[str]:
+    if valor is None or isinstance(valor, str):
+        return valor
+    valor = int(valor)
+    return f"{valor // 100:04d}-{valor % 100:02d}"
+
+
+def _select_fichas_por_mes(dialeto: str, admin_id: int, desde: datetime, por_status: bool = False):
+    mes = _expr_mes(dialeto, models.Ficha.data_criacao).label("mes")
+    colunas = [mes]
+    if por_status:
+        colunas.append(models.Ficha.status)
+    return (
+        select(*colunas, func.count(models.Ficha.id))
+        .join(models.Cliente, models.Ficha.cliente_id == models.Cliente.id)
+        .where(models.Cliente.admin_id == admin_id)
+        .where(models.Ficha.data_criacao >= desde)
+        .group_by(*colunas)
+    )
+
+
+def contar_fichas_por_mes(db: Session, admin_id: int, desde: datetime, por_status: bool = False) -> List[tuple]:
+
+    if admin_id is None:
+        return []
+    stmt = _select_fichas_por_mes(db.get_bind().dialect.name, admin_id, desde, por_status)
+    return [(_chave_mes(row[0]), *row[1:]) for row in db.execute(stmt).all()]
+
+
+async def contar_fichas_por_mes_async(db: AsyncSession, admin_id: int, desde: datetime, por_status: bool = False) -> List[tuple]:
+
+    if admin_id is None:
+        return []
+    stmt = _select_fichas_por_mes(db.bind.dialect.name, admin_id, desde, por_status)
+    return [(_chave_mes(row[0]), *row[1:]) for row in (await db.execute(stmt)).all()]
+
 #Log de Atualização
 
 def criar_log(db: Session, ficha_id: int, log: schemas.LogCreate, admin_id: Optional[int] = None):
     
     if admin_id is not None:
-        f = db.query(models.Ficha).filter(models.Ficha.id == ficha_id).first()
-        if not f:
+        existe = query_ficha_escopo(db, admin_id, models.Ficha.id).filter(models.Ficha.id == ficha_id).first()
+        if not existe:
             raise ValueError("Ficha não encontrada")
-        cliente = db.query(models.Cliente).filter(models.Cliente.id == f.cliente_id).first()
-        if cliente and cliente.admin_id is not None and cliente.admin_id != admin_id:
-            raise ValueError("Sem permissão para adicionar log nesta ficha")
     data = log.dict(exclude_unset=True)
     data['ficha_id'] = ficha_id
     allowed = {k: v for k, v in data.items() if hasattr(models.LogAtualizacao, k)}
@@ -341,15 +696,14 @@ def listar_logs_por_ficha(db: Session, ficha_id: int, admin_id: Optional[int] =
     if ficha_id is None:
         return []
     
-    # checar propriedade da ficha quando admin_id for informado
-    if admin_id is not None:
-        f = db.query(models.Ficha).filter(models.Ficha.id == ficha_id).first()
-        if not f:
-            return []
-        cliente = db.query(models.Cliente).filter(models.Cliente.id == f.cliente_id).first()
-        if cliente and cliente.admin_id is not None and cliente.admin_id != admin_id:
-            return []
     q = db.query(models.LogAtualizacao).filter(models.LogAtualizacao.ficha_id == ficha_id)
+    # checar propriedade da ficha no mesmo SELECT quando admin_id for informado
+    if admin_id is not None:
+        q = (
+            q.join(models.Ficha, models.LogAtualizacao.ficha_id == models.Ficha.id)
+            .join(models.Cliente, models.Ficha.cliente_id == models.Cliente.id)
+            .filter(_filtro_dono(admin_id))
+        )
     if hasattr(models.LogAtualizacao, "data"):
         q = q.order_by(models.LogAtualizacao.data.desc())
     return q.all()
@@ -3,7 +3,7 @@ import logging
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
-from typing import Generator
+from typing import Generator, AsyncGenerator
 from sqlalchemy.engine import Engine
 
 ENV_PATH = os.path.join(os.path.dirname(__file__), '.env')
@@ -50,6 +50,55 @@ def get_db() -> Generator:
     finally:
         db.close()
 
+
+# Engine assíncrono (asyncpg / aiosqlite) para os endpoints async.
+# Criado só no primeiro uso para não exigir o driver async em quem não usa.
+
+def url_async(url: str) -> str:
+    if url.startswith("postgresql"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+async_engine = None
+AsyncSessionLocal = None
+
+def obter_async_sessionmaker():
+    global async_engine, AsyncSessionLocal
+    if AsyncSessionLocal is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+        async_connect_args = {}
+        if DATABASE_URL.startswith("postgresql") and DB_SSLMODE:
+            # asyncpg usa 'ssl' no lugar de 'sslmode'
+            async_connect_args["ssl"] = DB_SSLMODE
+        async_engine = create_async_engine(
+            url_async(DATABASE_URL),
+            pool_pre_ping=True,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            connect_args=async_connect_args,
+        )
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    return AsyncSessionLocal
+
+async def get_async_db() -> AsyncGenerator:
+    async with obter_async_sessionmaker()() as db:
+        yield db
+
 def init_db(create_all: bool = False):
     if create_all and APP_ENV != "production":
         Base.metadata.create_all(bind=engine)
+
+
+def aplicar_migracoes(revisao: str = "head"):
+    from alembic import command
+    from alembic.config import Config
+
+    backend_dir = os.path.dirname(os.path.dirname(__file__))
+    cfg = Config(os.path.join(backend_dir, "alembic.ini"))
+    cfg.set_main_option("script_location", os.path.join(backend_dir, "migrations"))
+    # não sobrescrever a configuração de logging da aplicação
+    cfg.attributes["configure_logger"] = False
+    command.upgrade(cfg, revisao)
@@ -0,0 +1,109 @@
+import io
+import csv
+import tempfile
+from datetime import datetime
+from typing import Any, Callable, Iterable, Iterator, List, Sequence, Tuple
+
+
+# linhas buscadas por ida ao banco (server-side cursor no Postgres)
+EXPORT_YIELD_PER = 1000
+# linhas acumuladas antes de mandar um pedaço do CSV
+_CSV_LINHAS_POR_PEDACO = 500
+
+Coluna = Tuple[str, Callable[[Any], Any]]
+
+COLUNAS_FICHAS: List[Coluna] = [
+    ("id", lambda r: r[0].id),
+    ("codigo_rastreio", lambda r: r[0].codigo_rastreio),
+    ("status", lambda r: r[0].status),
+    ("cliente", lambda r: r[1].nome),
+    ("cliente_telefone", lambda r: r[1].telefone),
+    ("categoria", lambda r: r[0].categoria),
+    ("marca", lambda r: r[0].marca),
+    ("modelo", lambda r: r[0].modelo),
+    ("serial", lambda r: r[0].serial),
+    ("descricao", lambda r: r[0].descricao),
+    ("defeito", lambda r: r[0].defeito),
+    ("acessorios", lambda r: r[0].acessorios),
+    ("valor", lambda r: r[0].valor),
+    ("previsao_entrega", lambda r: r[0].previsao_entrega),
+    ("data_criacao", lambda r: r[0].data_criacao),
+]
+
+COLUNAS_CLIENTES: List[Coluna] = [
+    ("id", lambda c: c.id),
+    ("nome", lambda c: c.nome),
+    ("telefone", lambda c: c.telefone),
+    ("email", lambda c: c.email),
+    ("endereco", lambda c: c.endereco),
+    ("numero", lambda c: c.numero),
+    ("bairro", lambda c: c.bairro),
+    ("criado_em", lambda c: c.criado_em),
+]
+
+
+def linhas(query, colunas: Sequence[Coluna]) -> Iterator[list]:
+    # yield_per: não materializa o resultado inteiro (stream_results no Postgres)
+    for row in query.yield_per(EXPORT_YIELD_PER):
+        yield [extrair(row) for _, extrair in colunas]
+
+
+# início de célula que o Excel/LibreOffice interpretam como fórmula (CSV/formula injection)
+_INICIO_FORMULA = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _neutralizar(texto: str) -> str:
+    # o apóstrofo faz a planilha tratar a célula como texto
+    return "'" + texto if texto.startswith(_INICIO_FORMULA) else texto
+
+
+def _texto(valor) -> str:
+    if valor is None:
+        return ""
+    if isinstance(valor, datetime):
+        return valor.isoformat(sep=" ", timespec="seconds")
+    if isinstance(valor, str):
+        return _neutralizar(valor)
+    return str(valor)
+
+
+def csv_stream(colunas: Sequence[Coluna], dados: Iterable[list]) -> Iterator[bytes]:
+    # ';' + BOM: o Excel em pt-BR abre direto com acentos e colunas certas
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=";")
+    writer.writerow([nome for nome, _ in colunas])
+    yield "\ufeff".encode("utf-8") + buf.getvalue().encode("utf-8")
+    buf.seek(0)
+    buf.truncate()
+    pendentes = 0
+    for linha in dados:
+        writer.writerow([_texto(v) for v in linha])
+        pendentes += 1
+        if pendentes >= _CSV_LINHAS_POR_PEDACO:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+            pendentes = 0
+    if pendentes:
+        yield buf.getvalue().encode("utf-8")
+
+
+def xlsx_arquivo(colunas: Sequence[Coluna], dados: Iterable[list], titulo: str):
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    # write-only: as linhas vão para arquivos temporários do openpyxl, não para a memória
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=titulo[:31])
+    ws.append([nome for nome, _ in colunas])
+    for linha in dados:
+        # caracteres de controle quebram o XML da planilha; texto com "=" viraria fórmula
+        ws.append([_neutralizar(ILLEGAL_CHARACTERS_RE.sub("", v)) if isinstance(v, str) else v for v in linha])
+    saida = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    wb.save(saida)
+    saida.seek(0)
+    return saida
+
+
+def nome_arquivo(base: str, extensao: str) -> str:
+    return f"{base}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{extensao}"
@@ -0,0 +1,283 @@
+import os
+import csv
+import codecs
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError, validate_model
+from sqlalchemy.orm import Session
+
+from . import crud, schemas
+
+
+logger = logging.getLogger(__name__)
+
+
+# linhas validadas e gravadas por commit
+IMPORT_LOTE = max(1, int(os.getenv("IMPORT_LOTE", "2000")))
+IMPORT_MAX_LINHAS = int(os.getenv("IMPORT_MAX_LINHAS", "200000"))
+
+CAMPOS_CLIENTE = {"nome", "telefone", "email", "endereco", "numero", "bairro"}
+CAMPOS_FICHA = {
+    "categoria", "marca", "modelo", "serial", "descricao", "status", "codigo_rastreio",
+    "defeito", "acessorios", "previsao_entrega", "valor",
+}
+# cabeçalhos do /fichas/export aceitos direto (exporta de um lugar, importa em outro)
+ALIASES = {"cliente": "nome", "cliente_telefone": "telefone", "numero_serie": "serial"}
+
+
+class ArquivoInvalido(ValueError):
+    pass
+
+
+def _normalizar_cabecalho(nome) -> str:
+    nome = str(nome or "").strip().lower().replace(" ", "_")
+    return ALIASES.get(nome, nome)
+
+
+def _decodificar(bruta: bytes) -> Optional[str]:
+    # UTF-8 ou, se não for, Windows-1252 (CSV do Excel pt-BR); None = nenhuma das duas
+    try:
+        return bruta.decode("utf-8")
+    except UnicodeDecodeError:
+        pass
+    try:
+        return bruta.decode("cp1252")
+    except UnicodeDecodeError:
+        return None
+
+
+def _linhas_csv(arquivo) -> Iterator[Tuple[List[str], list, Optional[str]]]:
+    amostra = arquivo.read(64 * 1024)
+    arquivo.seek(0)
+    invalidas = set()
+
+    def _texto():
+        # detecta a codificação linha a linha: arquivos colados de origens diferentes
+        # funcionam, e um byte que não existe em nenhuma vira erro só daquela linha
+        for n, bruta in enumerate(arquivo, start=1):
+            if n == 1 and bruta.startswith(codecs.BOM_UTF8):
+                bruta = bruta[len(codecs.BOM_UTF8):]
+            linha = _decodificar(bruta)
+            if linha is None:
+                invalidas.add(n)
+                linha = bruta.decode("cp1252", errors="replace")
+            yield linha
+
+    texto = amostra.decode("utf-8", errors="ignore")
+    # ';' (Excel pt-BR e o nosso export) ou ','
+    delimitador = ";" if texto.count(";") > texto.count(",") else ","
+    reader = csv.reader(_texto(), delimiter=delimitador)
+    cabecalho = next(reader, None)
+    if not cabecalho:
+        raise ArquivoInvalido("Arquivo vazio.")
+    cabecalho = [_normalizar_cabecalho(c) for c in cabecalho]
+    anterior = reader.line_num
+    for linha in reader:
+        # um registro pode ocupar várias linhas físicas (campo entre aspas com quebra de linha)
+        erro = None
+        if invalidas and any(n in invalidas for n in range(anterior + 1, reader.line_num + 1)):
+            erro = "Caracteres inválidos para a codificação do arquivo."
+        anterior = reader.line_num
+        yield cabecalho, linha, erro
+
+
+def _linhas_xlsx(arquivo) -> Iterator[Tuple[List[str], list, Optional[str]]]:
+    from openpyxl import load_workbook
+
+    try:
+        # read_only: lê as linhas sob demanda, sem carregar a planilha inteira
+        wb = load_workbook(arquivo, read_only=True, data_only=True)
+    except Exception:
+        raise ArquivoInvalido("Planilha XLSX inválida.")
+    try:
+        linhas = wb.worksheets[0].iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if not cabecalho:
+            raise ArquivoInvalido("Arquivo vazio.")
+        cabecalho = [_normalizar_cabecalho(c) for c in cabecalho]
+        for linha in linhas:
+            yield cabecalho, linha, None
+    finally:
+        wb.close()
+
+
+def ler_linhas(arquivo, nome_arquivo: str) -> Iterator[Tuple[Dict[str, Any], Optional[str]]]:
+    # (campos da linha, erro de leitura ou None)
+    nome = (nome_arquivo or "").lower()
+    if nome.endswith(".xlsx"):
+        origem = _linhas_xlsx(arquivo)
+    elif nome.endswith(".csv") or nome.endswith(".txt"):
+        origem = _linhas_csv(arquivo)
+    else:
+        raise ArquivoInvalido("Formato não suportado. Envie um arquivo .csv ou .xlsx.")
+    for cabecalho, linha, erro in origem:
+        if erro:
+            yield {}, erro
+            continue
+        dados = {}
+        for campo, valor in zip(cabecalho, linha):
+            if isinstance(valor, str):
+                valor = valor.strip()
+            if valor is None or valor == "":
+                continue
+            dados[campo] = valor
+        yield dados, None
+
+
+def _valor_decimal(v):
+    # "1.234,56" / "1234,56" -> 1234.56
+    if isinstance(v, str) and "," in v:
+        v = v.replace(".", "").replace(",", ".")
+    return v
+
+
+def _data(v) -> Optional[datetime]:
+    if v is None or isinstance(v, datetime):
+        return v
+    try:
+        return datetime.fromisoformat(str(v))
+    except ValueError:
+        return None
+
+
+def _erro_validacao(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+
+
+def _validar(modelo, campos: Dict[str, Any]) -> Dict[str, Any]:
+    # mesma validação de Modelo(**campos).dict(), sem montar o objeto: o .dict() custava
+    # tanto quanto a validação em si, por linha
+    valores, _, erro = validate_model(modelo, campos)
+    if erro:
+        raise erro
+    return valores
+
+
+def _validar_cliente(campos: Dict[str, Any], cache: Optional[Dict]) -> Dict[str, Any]:
+    # o mesmo cliente se repete em várias linhas (uma por ficha): valida uma vez só
+    chave = tuple(sorted((k, str(v)) for k, v in campos.items()))
+    if cache is not None and chave in cache:
+        return cache[chave]
+    cliente = _validar(schemas.ClienteCreate, campos)
+    if cliente.get("email"):
+        cliente["email"] = cliente["email"].strip().lower()
+    if cache is not None:
+        cache[chave] = cliente
+    return cliente
+
+
+def validar_linha(dados: Dict[str, Any], cache_clientes: Optional[Dict] = None) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    # devolve (cliente, ficha ou None); ValidationError com o problema
+    cliente = _validar_cliente({k: v for k, v in dados.items() if k in CAMPOS_CLIENTE}, cache_clientes)
+
+    campos_ficha = {k: v for k, v in dados.items() if k in CAMPOS_FICHA}
+    if not campos_ficha:
+        return cliente, None
+    if "valor" in campos_ficha:
+        campos_ficha["valor"] = _valor_decimal(campos_ficha["valor"])
+    # dict() completo: todas as fichas com as mesmas chaves -> um executemany por lote
+    # (chaves diferentes fazem o SQLAlchemy quebrar o INSERT em vários)
+    ficha = _validar(schemas.FichaCreate, campos_ficha)
+    ficha["status"] = (ficha["status"] or schemas.StatusEnum.ABERTA).value
+    ficha["data_criacao"] = _data(dados.get("data_criacao"))
+    return cliente, ficha
+
+
+def _gravar_lote(db: Session, admin_id: int, itens: List[Tuple[int, Dict, Optional[Dict]]], clientes: Dict, codigos_vistos: set) -> Tuple[int, int, List[Dict]]:
+    erros: List[Dict] = []
+
+    # códigos informados: repetidos no arquivo ou já existentes no banco
+    informados = [f["codigo_rastreio"] for _, _, f in itens if f and f.get("codigo_rastreio")]
+    ocupados = crud.codigos_existentes(db, informados) | (codigos_vistos & set(informados))
+    validos = []
+    for num, cliente, ficha in itens:
+        codigo = (ficha or {}).get("codigo_rastreio")
+        if codigo:
+            if codigo in ocupados:
+                erros.append({"linha": num, "erro": f"Código de rastreio já existe: {codigo}"})
+                continue
+            ocupados.add(codigo)
+        validos.append((num, cliente, ficha))
+
+    # clientes novos (pela chave nome+telefone) em um INSERT só
+    novos: Dict[Tuple[str, str], Dict] = {}
+    for _, cliente, _ in validos:
+        chave = crud.chave_cliente(cliente["nome"], cliente["telefone"])
+        if chave not in clientes and chave not in novos:
+            novos[chave] = {**cliente, "admin_id": admin_id, "criado_em": datetime.utcnow()}
+    criados = crud.inserir_clientes_em_lote(db, list(novos.values()))
+
+    agora = datetime.utcnow()
+    fichas = []
+    posicoes_geradas = []
+    for _, cliente, ficha in validos:
+        if ficha is None:
+            continue
+        ficha = dict(ficha)
+        chave = crud.chave_cliente(cliente["nome"], cliente["telefone"])
+        ficha["cliente_id"] = criados[chave] if chave in criados else clientes[chave]
+        if not ficha.get("codigo_rastreio"):
+            posicoes_geradas.append(len(fichas))
+        ficha["data_criacao"] = ficha["data_criacao"] or agora
+        fichas.append(ficha)
+    # códigos que faltam reservados de uma vez, gerados localmente (sem consulta ao banco)
+    for i, codigo in zip(posicoes_geradas, crud.gerar_codigos_ficha(db, len(posicoes_geradas))):
+        fichas[i]["codigo_rastreio"] = codigo
+    crud.inserir_fichas_em_lote(db, fichas, posicoes_geradas)
+    db.commit()
+    # só depois do commit: num lote desfeito (rollback) os ids novos não existem mais
+    clientes.update(criados)
+    codigos_vistos |= {f["codigo_rastreio"] for f in fichas}
+    return len(novos), len(fichas), erros
+
+
+def importar(db: Session, admin_id: int, arquivo, nome_arquivo: str) -> Iterator[Dict[str, Any]]:
+    # gera eventos de progresso (um por lote) e um resumo no final
+    clientes = crud.mapa_clientes_do_admin(db, admin_id)
+    codigos_vistos: set = set()
+    cache_clientes: Dict = {}
+    total = {"linhas": 0, "clientes": 0, "fichas": 0, "erros": 0}
+    itens: List[Tuple[int, Dict, Optional[Dict]]] = []
+    erros: List[Dict] = []
+
+    def _lote():
+        try:
+            n_clientes, n_fichas, erros_lote = _gravar_lote(db, admin_id, itens, clientes, codigos_vistos)
+        except Exception:
+            db.rollback()
+            logger.exception("Erro ao gravar lote da importação")
+            n_clientes, n_fichas = 0, 0
+            erros_lote = [{"linha": num, "erro": "Erro ao gravar o lote desta linha."} for num, _, _ in itens]
+        total["clientes"] += n_clientes
+        total["fichas"] += n_fichas
+        todos = erros + erros_lote
+        total["erros"] += len(todos)
+        itens.clear()
+        erros.clear()
+        return {"tipo": "progresso", **total, "erros_lote": todos}
+
+    # linha 1 = cabeçalho
+    for num, (dados, erro) in enumerate(ler_linhas(arquivo, nome_arquivo), start=2):
+        if IMPORT_MAX_LINHAS and total["linhas"] >= IMPORT_MAX_LINHAS:
+            erros.append({"linha": num, "erro": f"Limite de {IMPORT_MAX_LINHAS} linhas por importação atingido."})
+            break
+        if erro:
+            total["linhas"] += 1
+            erros.append({"linha": num, "erro": erro})
+            continue
+        if not dados:
+            continue
+        total["linhas"] += 1
+        try:
+            cliente, ficha = validar_linha(dados, cache_clientes)
+        except ValidationError as e:
+            erros.append({"linha": num, "erro": _erro_validacao(e)})
+            continue
+        itens.append((num, cliente, ficha))
+        if len(itens) >= IMPORT_LOTE:
+            yield _lote()
+    if itens or erros:
+        yield _lote()
+    yield {"tipo": "fim", **total}
@@ -0,0 +1,117 @@
+import os
+import re
+import json
+import logging
+from typing import List, Optional, Pattern, Tuple
+
+from fastapi import HTTPException
+
+from . import auth
+
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_limite(valor: str) -> Tuple[int, int]:
+    # formato "requisições/segundos", ex.: "30/60"; "0" desliga a classe
+    qtd, _, janela = valor.strip().partition("/")
+    return int(qtd), max(1, int(janela or 60))
+
+
+def _ler_limite(nome: str, padrao: str) -> Tuple[int, int]:
+    valor = os.getenv(nome)
+    if valor:
+        try:
+            return _parse_limite(valor)
+        except ValueError:
+            logger.warning("Valor inválido em %s=%r — usando %s", nome, valor, padrao)
+    return _parse_limite(padrao)
+
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# (classe, métodos, regex do caminho, chave: "ip" ou "admin"); a primeira que casar vale
+_ROTAS: List[Tuple[str, Optional[set], Pattern, str]] = [
+    ("rastreio", {"GET"}, re.compile(r"^/rastreio/"), "ip"),
+    ("pdf", None, re.compile(r"^/fichas/(\d+/pdf|pdf/batch)$"), "admin"),
+    ("escrita", {"POST", "PUT", "PATCH", "DELETE"}, re.compile(r"^/"), "admin"),
+    ("api", None, re.compile(r"^/"), "admin"),
+]
+
+# o login tem limite próprio por email+IP (auth.pode_tentar_login) e /static não passa pelo banco
+_IGNORAR = re.compile(r"^/(admin/login|static/)")
+
+LIMITES = {
+    "rastreio": _ler_limite("LIMITE_RASTREIO", f"{auth.LIMITE_RASTREIO_POR_MINUTO}/60"),
+    "pdf": _ler_limite("LIMITE_PDF", "30/60"),
+    "escrita": _ler_limite("LIMITE_ESCRITA", "120/60"),
+    "api": _ler_limite("LIMITE_API", "600/60"),
+}
+
+
+def classificar(metodo: str, caminho: str) -> Optional[Tuple[str, str]]:
+    if _IGNORAR.match(caminho):
+        return None
+    for classe, metodos, padrao, chave in _ROTAS:
+        if metodos is not None and metodo not in metodos:
+            continue
+        if padrao.match(caminho):
+            return classe, chave
+    return None
+
+
+def _admin_do_header(headers) -> Optional[int]:
+    for nome, valor in headers:
+        if nome == b"authorization":
+            esquema, _, token = valor.decode("latin-1").partition(" ")
+            if esquema.lower() != "bearer" or not token:
+                return None
+            try:
+                # usa o cache de tokens do auth: sem HMAC para token já visto
+                return auth.verificar_contexto(token.strip()).admin_id
+            except HTTPException:
+                return None
+    return None
+
+
+def identificar(scope, tipo_chave: str) -> str:
+    if tipo_chave == "admin":
+        admin_id = _admin_do_header(scope.get("headers") or [])
+        if admin_id is not None:
+            return f"admin:{admin_id}"
+    cliente = scope.get("client")
+    return f"ip:{cliente[0] if cliente else 'unknown'}"
+
+
+class LimiteMiddleware:
+    # middleware ASGI puro (BaseHTTPMiddleware custa bem mais por requisição)
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not RATE_LIMIT_ENABLED or scope["method"] == "OPTIONS":
+            return await self.app(scope, receive, send)
+        rota = classificar(scope["method"], scope["path"])
+        if rota is None:
+            return await self.app(scope, receive, send)
+        classe, tipo_chave = rota
+        limite, janela = LIMITES[classe]
+        permitido, retry = auth.consumir_limite(f"rl:{classe}:{identificar(scope, tipo_chave)}", limite, janela)
+        if permitido:
+            return await self.app(scope, receive, send)
+        await _responder_429(send, retry)
+
+
+async def _responder_429(send, retry: int) -> None:
+    corpo = json.dumps({"detail": "Muitas requisições. Tente novamente em instantes."}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(corpo)).encode("ascii")),
+            (b"retry-after", str(max(1, retry)).encode("ascii")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": corpo})
@@ -1,9 +1,18 @@
 import os
+import random
+import asyncio
 import logging
-from typing import List, Union
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 from dotenv import load_dotenv
 from fastapi import BackgroundTasks
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+import aiosmtplib
+
+from . import models, auth
+from .database import SessionLocal, obter_async_sessionmaker
 
 
 
@@ -26,32 +35,27 @@ MAIL_STARTTLS = os.getenv("MAIL_STARTTLS", "True").lower() in ("true", "1", "yes
 MAIL_SSL_TLS = os.getenv("MAIL_SSL_TLS", "False").lower() in ("true", "1", "yes")
 VALIDATE_CERTS = os.getenv("MAIL_VALIDATE_CERTS", "True").lower() in ("1", "true", "yes")
 USE_CREDENTIALS = os.getenv("MAIL_USE_CREDENTIALS", "True").lower() in ("1", "true", "yes")
+MAIL_TIMEOUT = float(os.getenv("MAIL_TIMEOUT", "30"))
+
+# fila (outbox): despachante roda dentro do processo da API
+EMAIL_DESPACHANTE = os.getenv("EMAIL_DESPACHANTE", "true").lower() in ("1", "true", "yes")
+EMAIL_LOTE = max(1, int(os.getenv("EMAIL_LOTE", "20")))
+EMAIL_INTERVALO = float(os.getenv("EMAIL_INTERVALO", "5"))  # em segundos, entre varreduras da fila
+EMAIL_MAX_TENTATIVAS = max(1, int(os.getenv("EMAIL_MAX_TENTATIVAS", "6")))
+EMAIL_BACKOFF_BASE = float(os.getenv("EMAIL_BACKOFF_BASE", "30"))  # em segundos, dobra a cada falha
+EMAIL_BACKOFF_MAX = float(os.getenv("EMAIL_BACKOFF_MAX", "3600"))
+EMAIL_LEASE = int(os.getenv("EMAIL_LEASE", "300"))  # posse de um lote; passado isso outro worker pode reenviar
+EMAIL_SMTP_OCIOSO = float(os.getenv("EMAIL_SMTP_OCIOSO", "60"))  # fecha a conexão SMTP parada há mais que isso
     
 
+# limites de envio por destinatário, por prefixo de chave (ex.: "status_ficha:" -> (5, 3600))
+_limites_por_destinatario: Dict[str, Tuple[int, int]] = {}
+
+
 EMAIL_ENABLED = bool(MAIL_SERVER and MAIL_FROM)
 if not EMAIL_ENABLED:
     logger.warning("Env não configurado para envio de email (MAIL_SERVER or MAIL_FROM faltando). Emails estarão desabilitados.")
 
-conf = None
-fm = None
-if EMAIL_ENABLED:
-    conf = ConnectionConfig(
-        MAIL_USERNAME=MAIL_USERNAME,
-        MAIL_PASSWORD=MAIL_PASSWORD,
-        MAIL_FROM=MAIL_FROM,
-        MAIL_PORT=MAIL_PORT,
-        MAIL_SERVER=MAIL_SERVER,
-        MAIL_STARTTLS=MAIL_STARTTLS,
-        MAIL_SSL_TLS=MAIL_SSL_TLS,
-        USE_CREDENTIALS=USE_CREDENTIALS,
-        VALIDATE_CERTS=VALIDATE_CERTS,
-    )
-    try:
-        fm = FastMail(conf)
-    except Exception:
-        logger.exception("Erro ao configurar FastMail. Emails estarão desabilitados.")
-        fm = None
-        EMAIL_ENABLED = False
         
 def destinatario_valido(dest: Union[str, List[str]]) -> List[str]:
     
@@ -67,34 +71,282 @@ def destinatario_valido(dest: Union[str, List[str]]) -> List[str]:
     return dests
 
 
-async def enviar_mensagem_async(message: MessageSchema):
-    global fm
-    if not EMAIL_ENABLED or fm is None:
-        logger.warning("Tentativa de envio ignorada: email desabilitado.")
-        return
-    try:
-        await fm.send_message(message)
-    except Exception:
-        logger.exception("Erro ao enviar email.")
-        
-        
-def enviar_email(destinatario: Union[str, List[str]], assunto: str, corpo: str, background_tasks: BackgroundTasks) -> bool:
-    if not EMAIL_ENABLED:
-        logger.warning("Envio não agendado: email desabilitado por configuração.")
-        return False
+def _linha_outbox(destinatario: Union[str, List[str]], assunto: str, corpo: str, chave: Optional[str] = None, enviar_em: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
     try:
         recipients = destinatario_valido(destinatario)
     except ValueError as e:
         logger.warning("Erro ao validar destinatários: %s", e)
+        return None
+    return {
+        "destinatarios": ",".join(recipients),
+        "assunto": assunto or "",
+        "corpo": corpo or "",
+        "chave": chave,
+        "proxima_tentativa": enviar_em or datetime.utcnow(),
+    }
+
+
+def enfileirar_email(db: Session, destinatario: Union[str, List[str]], assunto: str, corpo: str, chave: Optional[str] = None, enviar_em: Optional[datetime] = None) -> Optional[models.EmailOutbox]:
+    # só adiciona na sessão: o email é gravado no mesmo commit de quem chamou
+    if not EMAIL_ENABLED:
+        logger.warning("Envio não agendado: email desabilitado por configuração.")
+        return None
+    linha = _linha_outbox(destinatario, assunto, corpo, chave=chave, enviar_em=enviar_em)
+    if linha is None:
+        return None
+    email = models.EmailOutbox(**linha)
+    db.add(email)
+    return email
+
+
+def enfileirar_emails(db: Session, emails: Iterable[Dict[str, Any]]) -> int:
+    # vários emails num INSERT só (executemany), no mesmo commit de quem chamou
+    if not EMAIL_ENABLED:
+        logger.warning("Envio não agendado: email desabilitado por configuração.")
+        return 0
+    linhas = [linha for linha in (_linha_outbox(**e) for e in emails) if linha is not None]
+    if linhas:
+        db.execute(insert(models.EmailOutbox), linhas)
+    return len(linhas)
+
+        
+def enviar_email(destinatario: Union[str, List[str]], assunto: str, corpo: str, background_tasks: Optional[BackgroundTasks] = None) -> bool:
+    db = SessionLocal()
+    try:
+        if enfileirar_email(db, destinatario, assunto, corpo) is None:
+            return False
+        db.commit()
+    except Exception:
+        db.rollback()
+        logger.exception("Erro ao gravar email na fila.")
         return False
-    
-    
-    message = MessageSchema(
-        subject=assunto or "",
-        recipients=recipients,
-        body=corpo or "",
-        subtype=MessageType.html
-    )
-    background_tasks.add_task(enviar_mensagem_async, message)
+    finally:
+        db.close()
+    # acorda o despachante depois da resposta (senão ele pega na próxima varredura)
+    if background_tasks is not None:
+        background_tasks.add_task(despachante.acordar)
+    else:
+        despachante.acordar()
     return True
-    
\ No newline at end of file
+
+
+def limitar_por_destinatario(prefixo_chave: str, limite: int, janela: int) -> None:
+    _limites_por_destinatario[prefixo_chave] = (limite, janela)
+
+
+def _adiamento(email: models.EmailOutbox) -> int:
+    # conta a cota só na hora do envio: edições desfeitas (rollback) e emails
+    # coalescidos não gastam nada; acima do limite o email é adiado, não descartado,
+    # e a checagem recusada não conta (o adiado não gasta cota a cada nova tentativa)
+    if not email.chave:
+        return 0
+    for prefixo, (limite, janela) in _limites_por_destinatario.items():
+        if email.chave.startswith(prefixo):
+            chave = f"email:{prefixo}{email.destinatarios.strip().lower()}"
+            permitido, retry = auth.consumir_limite(chave, limite, janela, devolver_se_negado=True)
+            return 0 if permitido else max(1, retry)
+    return 0
+
+
+def _adiamentos(lote: List[models.EmailOutbox]) -> List[int]:
+    return [_adiamento(email) for email in lote]
+
+
+def _montar_mensagem(email: models.EmailOutbox) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = MAIL_FROM
+    msg["To"] = email.destinatarios
+    msg["Subject"] = email.assunto
+    msg.set_content(email.corpo, subtype="html")
+    return msg
+
+
+def _backoff(tentativas: int) -> timedelta:
+    atraso = min(EMAIL_BACKOFF_MAX, EMAIL_BACKOFF_BASE * (2 ** max(0, tentativas - 1)))
+    # jitter para falhas em massa não voltarem todas juntas
+    return timedelta(seconds=atraso * random.uniform(1.0, 1.25))
+
+
+def _falha_permanente(erro: Exception) -> bool:
+    # 5xx do servidor para esta mensagem (destinatário, remetente, conteúdo): reenviar não adianta.
+    # autenticação/conexão com 5xx é problema de configuração e vale para a fila toda: segue no backoff
+    if isinstance(erro, aiosmtplib.SMTPRecipientsRefused):
+        return bool(erro.recipients) and all(500 <= r.code < 600 for r in erro.recipients)
+    if isinstance(erro, (aiosmtplib.SMTPRecipientRefused, aiosmtplib.SMTPSenderRefused, aiosmtplib.SMTPDataError)):
+        return 500 <= erro.code < 600
+    return False
+
+
+class DespachanteEmail:
+    # lê a outbox em lotes e envia por uma conexão SMTP reaproveitada
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._evento: Optional[asyncio.Event] = None
+        self._tarefa: Optional[asyncio.Task] = None
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+        self._ultimo_uso = 0.0
+
+    def iniciar(self) -> None:
+        if self._tarefa is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._evento = asyncio.Event()
+        self._tarefa = asyncio.create_task(self._rodar())
+
+    async def parar(self) -> None:
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except asyncio.CancelledError:
+                pass
+            self._tarefa = None
+        await self._fechar()
+
+    def acordar(self) -> None:
+        # pode ser chamado de threads do threadpool
+        if self._loop is not None and self._evento is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._evento.set)
+            except RuntimeError:
+                pass
+
+    async def _rodar(self) -> None:
+        while True:
+            try:
+                processados = await self.processar_lote()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Erro no despachante de emails")
+                processados = 0
+            if processados >= EMAIL_LOTE:
+                continue  # ainda há fila
+            if self._smtp is not None and self._loop.time() - self._ultimo_uso > EMAIL_SMTP_OCIOSO:
+                await self._fechar()
+            try:
+                await asyncio.wait_for(self._evento.wait(), EMAIL_INTERVALO)
+            except asyncio.TimeoutError:
+                pass
+            self._evento.clear()
+
+    async def _conexao(self) -> aiosmtplib.SMTP:
+        if self._smtp is not None and self._smtp.is_connected:
+            return self._smtp
+        smtp = aiosmtplib.SMTP(
+            hostname=MAIL_SERVER,
+            port=MAIL_PORT,
+            username=MAIL_USERNAME if USE_CREDENTIALS and MAIL_USERNAME else None,
+            password=MAIL_PASSWORD if USE_CREDENTIALS and MAIL_USERNAME else None,
+            use_tls=MAIL_SSL_TLS,
+            start_tls=False if MAIL_SSL_TLS else MAIL_STARTTLS,
+            validate_certs=VALIDATE_CERTS,
+            timeout=MAIL_TIMEOUT,
+        )
+        await smtp.connect()
+        self._smtp = smtp
+        return smtp
+
+    async def _fechar(self) -> None:
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None and smtp.is_connected:
+            try:
+                await smtp.quit()
+            except Exception:
+                smtp.close()
+
+    async def _enviar(self, msg: EmailMessage) -> None:
+        # uma reconexão por mensagem: o servidor pode ter derrubado a conexão ociosa
+        for tentativa in (1, 2):
+            try:
+                smtp = await self._conexao()
+                await smtp.send_message(msg)
+                self._ultimo_uso = self._loop.time()
+                return
+            except (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError, ConnectionError):
+                await self._fechar()
+                if tentativa == 2:
+                    raise
+
+    async def _reservar(self, Sessao) -> List[models.EmailOutbox]:
+        agora = datetime.utcnow()
+        lease = agora + timedelta(seconds=EMAIL_LEASE)
+        devidos = (models.EmailOutbox.status.in_(("PENDENTE", "ENVIANDO")), models.EmailOutbox.proxima_tentativa <= agora)
+        async with Sessao() as db:
+            ids = (await db.execute(
+                select(models.EmailOutbox.id).where(*devidos)
+                .order_by(models.EmailOutbox.proxima_tentativa, models.EmailOutbox.id)
+                .limit(EMAIL_LOTE)
+            )).scalars().all()
+            if not ids:
+                return []
+            # posse do lote: ENVIANDO com prazo; se o processo cair, o lote volta a ficar devido
+            await db.execute(
+                update(models.EmailOutbox)
+                .where(models.EmailOutbox.id.in_(ids), *devidos)
+                .values(status="ENVIANDO", proxima_tentativa=lease)
+            )
+            await db.commit()
+            return (await db.execute(
+                select(models.EmailOutbox)
+                .where(models.EmailOutbox.id.in_(ids), models.EmailOutbox.status == "ENVIANDO", models.EmailOutbox.proxima_tentativa == lease)
+                .order_by(models.EmailOutbox.id)
+            )).scalars().all()
+
+    async def processar_lote(self) -> int:
+        Sessao = obter_async_sessionmaker()
+        lote = await self._reservar(Sessao)
+        if not lote:
+            return 0
+        resultados: List[Tuple[models.EmailOutbox, Optional[str], bool]] = []
+        adiados: List[Tuple[models.EmailOutbox, int]] = []
+        # o limitador é síncrono (Redis bloqueia): fora do event loop, uma ida por lote
+        esperas = await asyncio.to_thread(_adiamentos, lote)
+        for email, espera in zip(lote, esperas):
+            if espera:
+                adiados.append((email, espera))
+                continue
+            try:
+                await self._enviar(_montar_mensagem(email))
+                resultados.append((email, None, False))
+            except Exception as e:
+                resultados.append((email, f"{type(e).__name__}: {e}"[:2000], _falha_permanente(e)))
+
+        agora = datetime.utcnow()
+        async with Sessao() as db:
+            for email, espera in adiados:
+                email = await db.merge(email, load=False)
+                email.status = "PENDENTE"
+                email.proxima_tentativa = agora + timedelta(seconds=espera)
+                logger.info("Limite de emails para %s atingido; envio adiado em %ss", email.destinatarios, espera)
+            for email, erro, permanente in resultados:
+                email = await db.merge(email, load=False)
+                if erro is None:
+                    email.status = "ENVIADO"
+                    email.enviado_em = agora
+                    email.ultimo_erro = None
+                    continue
+                email.tentativas = (email.tentativas or 0) + 1
+                email.ultimo_erro = erro
+                if permanente or email.tentativas >= EMAIL_MAX_TENTATIVAS:
+                    email.status = "FALHOU"
+                    logger.error("Email %s descartado após %s tentativas: %s", email.id, email.tentativas, erro)
+                else:
+                    email.status = "PENDENTE"
+                    email.proxima_tentativa = agora + _backoff(email.tentativas)
+                    logger.warning("Falha ao enviar email %s (tentativa %s): %s", email.id, email.tentativas, erro)
+            await db.commit()
+        return len(lote)
+
+
+despachante = DespachanteEmail()
+
+
+def iniciar_despachante() -> None:
+    if EMAIL_ENABLED and EMAIL_DESPACHANTE:
+        despachante.iniciar()
+
+
+async def parar_despachante() -> None:
+    await despachante.parar()
@@ -7,22 +7,32 @@ from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from starlette.responses import JSONResponse, StreamingResponse 
+from starlette.background import BackgroundTask
 import os
 import uuid
 import shutil
 import io
 import traceback
 import re
+import json
+import itertools
 
 
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import or_, and_
-
-from . import models, schemas, crud
-from .database import get_db, engine, Base
-from .auth import criar_token_acesso, verificar_token, pode_tentar_login, registra_erro_login, limpa_tentativas
-from .mail_utils import enviar_email
-from .pdf_utils import ficha_to_pdf_bytes
+from typing import Optional, Union
+
+from . import models, schemas, crud, search_utils, rastreio_cache
+from .limite_utils import LimiteMiddleware
+from . import metricas_utils, consultas_utils
+from .consultas_utils import orcamento_queries
+from . import export_utils, import_utils
+from .database import get_db, get_async_db, aplicar_migracoes
+from .auth import criar_token_acesso, criar_token_refresh, claims_admin, verificar_token, verificar_contexto, consumir_token_refresh, revogar_token_refresh, ContextoAuth, pode_tentar_login, registra_erro_login, limpa_tentativas
+from .mail_utils import enviar_email, iniciar_despachante, parar_despachante
+from .senha_utils import VerificacaoSobrecarregada
+from .pdf_utils import ficha_to_pdf_bytes, PdfSobrecarregado, contexto_ficha, renderizar_lote, zip_stream, mesclar_pdfs, ler_em_pedacos, PDF_LOTE_MAX
 from dateutil.relativedelta import relativedelta
 from collections import defaultdict
 from datetime import datetime, timedelta
@@ -45,6 +55,32 @@ if APP_ENV == "production" and any(o == "*" for o in ALLOWED_ORIGINS):
 
 app = FastAPI()
 
+# vagas do threadpool usado pelos endpoints síncronos (padrão do anyio: 40)
+THREADPOOL_TOKENS = int(os.getenv("THREADPOOL_TOKENS", "0"))
+
+@app.on_event("startup")
+async def configurar_threadpool():
+    if THREADPOOL_TOKENS > 0:
+        import anyio
+        anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_TOKENS
+
+
+# fila de emails: o despachante envia o que ficou na outbox (inclusive de antes de um restart)
+@app.on_event("startup")
+async def iniciar_fila_emails():
+    iniciar_despachante()
+
+
+@app.on_event("shutdown")
+async def parar_fila_emails():
+    await parar_despachante()
+
+# só em desenvolvimento/testes (CONSULTAS_DETECTOR): conta queries por requisição e aponta N+1
+app.add_middleware(consultas_utils.DetectorN1Middleware)
+
+# antes do CORS: as respostas 429 também recebem os cabeçalhos de CORS
+app.add_middleware(LimiteMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
@@ -53,13 +89,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# por fora de tudo: a latência medida inclui limite e CORS
+app.add_middleware(metricas_utils.MetricasMiddleware, app_rotas=app)
+
 BASE_DIR = os.path.dirname(__file__)
 STATIC_DIR = os.path.join(BASE_DIR, 'static')
 os.makedirs(STATIC_DIR, exist_ok=True)
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 if APP_ENV != "production" and os.getenv("INIT_DB", "false").lower() in ("1", "true", "yes"):
-    Base.metadata.create_all(bind=engine)
+    aplicar_migracoes()
 
 
 
@@ -68,7 +107,7 @@ if APP_ENV != "production" and os.getenv("INIT_DB", "false").lower() in ("1", "t
 @app.exception_handler(StarletteHTTPException)
 async def http_exception_handler(request: Request, exc: StarletteHTTPException):
     logger.warning("HTTP exception: %s %s", exc.status_code, exc.detail)
-    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail or "Erro HTTP inesperado."})
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail or "Erro HTTP inesperado."}, headers=getattr(exc, "headers", None))
 
 
 @app.exception_handler(RequestValidationError)
@@ -99,7 +138,10 @@ def login_admin(payload: schemas.AdminLogin, request: Request, db: Session = Dep
     if not pode_tentar_login(email, ip):
         raise HTTPException(status_code=429, detail="Muitas tentativas de login. Tente novamente mais tarde.")
     
-    admin = crud.autenticar_admin(db, email, senha)
+    try:
+        admin = crud.autenticar_admin(db, email, senha)
+    except VerificacaoSobrecarregada as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "2"})
     if not admin:
         registra_erro_login(email, ip)
         raise HTTPException(status_code=401, detail="Email ou senha invalidos")
@@ -111,7 +153,7 @@ def login_admin(payload: schemas.AdminLogin, request: Request, db: Session = Dep
         logger.exception("Erro ao registrar log de acesso")
         
     limpa_tentativas(email, ip)
-    access_token = criar_token_acesso({"sub": str(admin.id)})
+    access_token = criar_token_acesso(claims_admin(admin))
     
     USE_COOKIE_BACKEND = os.getenv("USE_COOKIE_BACKEND", "false").lower() in ("1", "true", "yes")
     if USE_COOKIE_BACKEND and response is not None:
@@ -130,7 +172,27 @@ def login_admin(payload: schemas.AdminLogin, request: Request, db: Session = Dep
         )
         return {"token_type": "cookie"}
     
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": access_token, "refresh_token": criar_token_refresh(admin.id), "token_type": "bearer"}
+
+
+@app.post('/admin/refresh')
+def refresh_token(payload: schemas.TokenRefresh, db: Session = Depends(get_db)):
+    admin_id = consumir_token_refresh(db, payload.refresh_token)
+    admin = db.get(models.Admin, admin_id)
+    if not admin:
+        raise HTTPException(status_code=401, detail="Token invalido ou expirado", headers={"WWW-Authenticate": "Bearer"})
+    # claims (email/foto) são relidos do banco a cada renovação
+    return {
+        "access_token": criar_token_acesso(claims_admin(admin)),
+        "refresh_token": criar_token_refresh(admin.id),
+        "token_type": "bearer",
+    }
+
+
+@app.post('/admin/logout', status_code=204)
+def logout(payload: schemas.TokenRefresh, db: Session = Depends(get_db)):
+    revogar_token_refresh(db, payload.refresh_token)
+    return Response(status_code=204)
 
 
 #Cliente
@@ -141,57 +203,61 @@ def criar_cliente(cliente: schemas.ClienteCreate, db: Session = Depends(get_db),
 
 
 @app.get("/clientes")
-def listar_clientes(q: str = "", page: int = 1, page_size: int = 12, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
+@orcamento_queries(2)
+async def listar_clientes(q: str = "", page: int = 1, page_size: int = 12, cursor: Optional[str] = None, include_total: bool = True, db: AsyncSession = Depends(get_async_db), admin_id: int = Security(verificar_token)):
     page = max(1, page)
     page_size = max(1, min(100, page_size))
-    
-    
-    query = db.query(models.Cliente).filter(models.Cliente.admin_id == admin_id)
-    if q:
-        like = f"%{q}%"
-        query = query.filter(
-            or_(models.Cliente.nome.ilike(like),
-                models.Cliente.telefone.ilike(like)))
-        
-    total = query.count()
-    items = query.order_by(models.Cliente.id.desc()).offset((page - 1) * page_size).limit(page_size).all()
-    return {"items": jsonable_encoder(items), "total": total}
+
+    try:
+        items, total, next_cursor = await db.run_sync(crud.pagina_clientes, admin_id, q, page, page_size, cursor, include_total)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": jsonable_encoder(items), "total": total, "next_cursor": next_cursor}
 
 
 
 @app.get("/clientes/search")
-def buscar_clientes(q: str, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
+@orcamento_queries(1)
+async def buscar_clientes(q: str, db: AsyncSession = Depends(get_async_db), admin_id: int = Security(verificar_token)):
     if not q or len(q.strip()) < 2:
         return []
-    like = f"%{q.strip()}%"
-    resultados = ( 
-            db.query(models.Cliente)
-            .filter(
-                and_(
-                    models.Cliente.admin_id == admin_id,
-                    or_(
-                        models.Cliente.nome.ilike(like), 
-                        models.Cliente.telefone.ilike(like)
-                        )
-                    )
-            )
-            .order_by(models.Cliente.nome.asc())
-            .limit(10)  
-            .all()
-    )
+    resultados = await db.run_sync(crud.buscar_clientes_por_termo, admin_id, q, 10)
     return jsonable_encoder(resultados)
 
 
+def _resposta_export(colunas, linhas, formato: schemas.FormatoExportEnum, base: str):
+    if formato == schemas.FormatoExportEnum.XLSX:
+        arquivo = export_utils.xlsx_arquivo(colunas, linhas, base)
+        return StreamingResponse(
+            ler_em_pedacos(arquivo),
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers={"Content-Disposition": f'attachment; filename="{export_utils.nome_arquivo(base, "xlsx")}"'},
+        )
+    return StreamingResponse(
+        export_utils.csv_stream(colunas, linhas),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{export_utils.nome_arquivo(base, "csv")}"'},
+    )
+
+
+@app.get("/clientes/export")
+def exportar_clientes(q: str = "", formato: schemas.FormatoExportEnum = schemas.FormatoExportEnum.CSV, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
+    # mesmos filtros de GET /clientes, sem paginação
+    query = db.query(models.Cliente).filter(models.Cliente.admin_id == admin_id)
+    if q:
+        query = search_utils.filtrar_clientes(db, query, q, ranquear=False)
+    query = query.order_by(models.Cliente.id)
+    linhas = export_utils.linhas(query, export_utils.COLUNAS_CLIENTES)
+    return _resposta_export(export_utils.COLUNAS_CLIENTES, linhas, formato, "clientes")
+
+
 @app.get('/clientes/{cliente_id}')
-def cliente_detalhe(cliente_id: int, limit: int = 10, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
-    cliente = crud.buscar_cliente_por_id(db, cliente_id, admin_id=admin_id)
+@orcamento_queries(2)
+async def cliente_detalhe(cliente_id: int, limit: int = 10, db: AsyncSession = Depends(get_async_db), admin_id: int = Security(verificar_token)):
+    cliente = await db.run_sync(crud.buscar_cliente_por_id, cliente_id, admin_id=admin_id)
     if not cliente:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
-    fichas = (db.query(models.Ficha)
-              .filter(models.Ficha.cliente_id == cliente_id)
-              .order_by(models.Ficha.id.desc())
-              .limit(limit)
-              .all())
+    fichas = await db.run_sync(crud.listar_fichas_do_cliente, cliente_id, limit)
     return {'cliente': jsonable_encoder(cliente), 'fichas': jsonable_encoder(fichas)}
 
 
@@ -210,49 +276,55 @@ def atualizar_cliente_endpoint(cliente_id: int, payload: schemas.ClienteUpdate,
 
 
 @app.get('/clientes/{cliente_id}/fichas')
-def historico_fichas_cliente(cliente_id: int, page: int = 1, page_size: int = 12, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
+@orcamento_queries(3)
+async def historico_fichas_cliente(cliente_id: int, page: int = 1, page_size: int = 12, db: AsyncSession = Depends(get_async_db), admin_id: int = Security(verificar_token)):
     
     page = max(1, page)
     page_size = max(1, min(100, page_size))
     
-    cliente = crud.buscar_cliente_por_id(db, cliente_id, admin_id=admin_id)
+    cliente = await db.run_sync(crud.buscar_cliente_por_id, cliente_id, admin_id=admin_id)
     if not cliente:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
-        
-    
-    query = db.query(models.Ficha).filter(models.Ficha.cliente_id == cliente_id)
-    total = query.count()
-    items = (
-        query.order_by(models.Ficha.id.desc())
-        .offset((page - 1) * page_size)
-        .limit(page_size)
-        .all())
+
+    items, total = await db.run_sync(crud.pagina_fichas_do_cliente, cliente_id, page, page_size)
     return {"items": jsonable_encoder(items), "total": total}
 
 
 
 @app.get('/rastreio/{codigo}')
-def rastreio_publico(codigo: str, db: Session = Depends(get_db)):
-    ficha = crud.buscar_ficha_por_codigo(db, codigo)
-    if not ficha:
-        raise HTTPException(status_code=404, detail="Ficha não encontrada")
-    
-    
-    return {
-        "codigo_rastreio": getattr(ficha, "codigo_rastreio", None),
-        "status": getattr(ficha, "status", None),
-        "defeito": getattr(ficha, "defeito", None),
-        "previsao_entrega": getattr(ficha, "previsao_entrega", None),
-        "observacao_publica": getattr(ficha, "observacao_publica", None),
-        "cliente_em": ficha.data_criacao.isoformat() if getattr(ficha, "data_criacao", None) else None,
-    }
+@orcamento_queries(1)
+async def rastreio_publico(codigo: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    # limite por IP fica no LimiteMiddleware (classe "rastreio")
+    codigo = (codigo or "").strip()
+
+    # cache antes do banco: repetições não abrem conexão
+    entrada = rastreio_cache.obter(codigo)
+    if entrada is None:
+        ficha = await crud.buscar_rastreio_publico_async(db, codigo)
+        if not ficha:
+            raise HTTPException(status_code=404, detail="Ficha não encontrada")
+        payload = {
+            "codigo_rastreio": ficha.codigo_rastreio,
+            "status": ficha.status,
+            "defeito": ficha.defeito,
+            "previsao_entrega": ficha.previsao_entrega,
+            "observacao_publica": ficha.observacao_publica,
+            "cliente_em": ficha.data_criacao.isoformat() if ficha.data_criacao else None,
+        }
+        entrada = rastreio_cache.salvar(codigo, payload)
+
+    headers = {"ETag": entrada["etag"], "Cache-Control": "no-cache"}
+    inm = request.headers.get("if-none-match") or ""
+    if entrada["etag"] in [t.strip() for t in inm.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=entrada["payload"], headers=headers)
 
     
 
 #Ficha
 
 @app.post('/fichas/{cliente_id}')
-async def criar_ficha(
+def criar_ficha(
     cliente_id: int, 
     ficha: schemas.FichaCreate, 
     background_tasks: BackgroundTasks,
@@ -276,42 +348,15 @@ async def criar_ficha(
 
 
 @app.get('/fichas')
-def listar_fichas(q: str = "", status: str = "", data_ini: str = "", data_fim: str = "", page: int = 1, page_size: int = 12, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
+@orcamento_queries(2)
+async def listar_fichas(q: str = "", status: str = "", data_ini: str = "", data_fim: str = "", page: int = 1, page_size: int = 12, cursor: Optional[str] = None, include_total: bool = True, db: AsyncSession = Depends(get_async_db), admin_id: int = Security(verificar_token)):
     page = max(1, page)
     page_size = max(1, min(100, page_size))
-    
-    query = db.query(models.Ficha, models.Cliente.nome.label("cliente")).join(models.Cliente, models.Ficha.cliente_id == models.Cliente.id).filter(models.Cliente.admin_id == admin_id)
 
-    if q:
-        like = f"%{q}%"
-        query = query.filter(
-            or_(
-                models.Ficha.codigo_rastreio.ilike(like),
-                models.Cliente.nome.ilike(like),   
-                models.Ficha.marca.ilike(like),
-                models.Ficha.modelo.ilike(like),                                
-            )
-        )
-            
-    if status:
-        query = query.filter(models.Ficha.status.ilike(f"%{status}%"))
-        
-    if data_ini:
-        try:
-            dt = datetime.fromisoformat(data_ini)
-            query = query.filter(models.Ficha.data_criacao >= dt)
-        except ValueError:
-            pass
-        
-    if data_fim:
-        try:
-            dt = datetime.fromisoformat(data_fim)
-            query = query.filter(models.Ficha.data_criacao < dt)
-        except ValueError:
-            pass
-            
-    total = query.count()
-    rows = query.order_by(models.Ficha.id.desc()).offset((page - 1) * page_size).limit(page_size).all()
+    try:
+        rows, total, next_cursor = await db.run_sync(crud.pagina_fichas, admin_id, q, status, data_ini, data_fim, page, page_size, cursor, include_total)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
      
     items = [
         {           
@@ -334,13 +379,24 @@ def listar_fichas(q: str = "", status: str = "", data_ini: str = "", data_fim: s
         for f, cliente_nome in rows
     
     ]
-    return {"items": items, "total": total}
+    return {"items": items, "total": total, "next_cursor": next_cursor}
+
 
 
+@app.get('/fichas/export')
+def exportar_fichas(q: str = "", status: str = "", data_ini: str = "", data_fim: str = "", formato: schemas.FormatoExportEnum = schemas.FormatoExportEnum.CSV, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
+    # mesmos filtros de GET /fichas, sem paginação
+    query = crud.query_ficha_escopo(db, admin_id, models.Ficha, models.Cliente)
+    query = crud.aplicar_filtros_fichas(db, query, q=q, status=status, data_ini=data_ini, data_fim=data_fim, ranquear=False)
+    query = query.order_by(models.Ficha.id)
+    linhas = export_utils.linhas(query, export_utils.COLUNAS_FICHAS)
+    return _resposta_export(export_utils.COLUNAS_FICHAS, linhas, formato, "fichas")
+
 
 @app.get('/fichas/codigo/{codigo}')
-def buscar_ficha(codigo: str, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
-    ficha = crud.buscar_ficha_por_codigo(db, codigo, admin_id=admin_id)
+@orcamento_queries(1)
+async def buscar_ficha(codigo: str, db: AsyncSession = Depends(get_async_db), admin_id: int = Security(verificar_token)):
+    ficha = await db.run_sync(crud.buscar_ficha_por_codigo, codigo, admin_id=admin_id)
     if not ficha:
         raise HTTPException(status_code=404, detail="Ficha não encontrada")
     return jsonable_encoder(ficha)
@@ -357,8 +413,9 @@ def criar_log(ficha_id: int, log: schemas.LogCreate, db: Session = Depends(get_d
 
 
 @app.get("/fichas/{ficha_id}/logs")
-def listar_logs(ficha_id: int, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
-    return crud.listar_logs_por_ficha(db, ficha_id, admin_id=admin_id)
+@orcamento_queries(1)
+async def listar_logs(ficha_id: int, db: AsyncSession = Depends(get_async_db), admin_id: int = Security(verificar_token)):
+    return jsonable_encoder(await db.run_sync(crud.listar_logs_por_ficha, ficha_id, admin_id=admin_id))
 
 
 
@@ -367,52 +424,54 @@ def listar_logs(ficha_id: int, db: Session = Depends(get_db), admin_id: int = Se
 @app.put('/fichas/{ficha_id}')
 def atualizar_ficha_endpoint(ficha_id: int, payload: schemas.FichaUpdate, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
     dados =payload.dict(exclude_unset=True)
-    atualizando = crud.atualizar_ficha(db, ficha_id, dados, admin_id=admin_id)
+    versao = dados.pop("versao", None)
+    try:
+        atualizando = crud.atualizar_ficha(db, ficha_id, dados, admin_id=admin_id, versao=versao)
+    except crud.ConflitoVersao as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if not atualizando:
         raise HTTPException(status_code=404, detail="Ficha não encontrada")
     return jsonable_encoder(atualizando)
 
 
 
+def _query_fichas_lote(db: Session, admin_id: int, payload: Union[schemas.FichaLoteUpdate, schemas.FichaPdfLote]):
+    # ids ou filtro: o mesmo escopo de dono de GET/PUT /fichas/{id}
+    query = crud.query_ficha_escopo(db, admin_id, models.Ficha, models.Cliente)
+    if payload.ids:
+        return query.filter(models.Ficha.id.in_(payload.ids))
+    # sem ids e sem filtro seria a base inteira do admin: exige escolher algo
+    if not any((v or "").strip() for v in (payload.q, payload.status, payload.data_ini, payload.data_fim)):
+        raise HTTPException(status_code=400, detail="Informe os ids das fichas ou ao menos um filtro.")
+    return crud.aplicar_filtros_fichas(db, query, q=payload.q, status=payload.status, data_ini=payload.data_ini, data_fim=payload.data_fim, ranquear=False)
+
+
+@app.patch('/fichas/bulk')
+@orcamento_queries(6)
+def atualizar_fichas_lote(payload: schemas.FichaLoteUpdate, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
+    query = _query_fichas_lote(db, admin_id, payload)
+    try:
+        return crud.atualizar_fichas_em_lote(db, query, payload.dados.dict(exclude_unset=True), admin_id, ids=payload.ids, limite=schemas.LOTE_ATUALIZACAO_MAX)
+    except crud.LoteGrandeDemais as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 
 @app.get('/fichas/{ficha_id}/pdf')
 def ficha_pdf(ficha_id: int, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
-    ficha = db.query(models.Ficha).filter(models.Ficha.id == ficha_id).first()
-    if not ficha:
-        raise HTTPException(status_code=404, detail="Ficha não encontrada")
-    cliente = db.query(models.Cliente).filter(models.Cliente.id == ficha.cliente_id).first()
-    if cliente and cliente.admin_id is not None and cliente.admin_id != admin_id:
+    encontrado = crud.buscar_ficha_com_cliente(db, ficha_id, admin_id=admin_id)
+    if not encontrado:
         raise HTTPException(status_code=404, detail="Ficha não encontrada")
+    ficha, cliente = encontrado
     
-    cliente_data = {
-        "id": getattr(cliente, "id", None),
-        "nome": getattr(cliente, "nome", "") or "",
-        "telefone": getattr(cliente, "telefone", "") or "",
-        "email": getattr(cliente, "email", "") or "",
-        "endereco": getattr(cliente, "endereco", "") or "",
-        "numero": getattr(cliente, "numero", "") or "",
-        "bairro": getattr(cliente, "bairro", "") or "",
-    }
-
-    context = {
-        "ficha": {
-            "id": ficha.id,
-            "categoria": ficha.categoria or "",
-            "marca": ficha.marca or "",
-            "modelo": ficha.modelo or "",
-            "serial": ficha.serial or "",
-            "descricao": ficha.descricao or "",
-            "defeito": getattr(ficha, "defeito", "") or "",
-            "acessorios": getattr(ficha, "acessorios", "") or "",
-            "codigo_rastreio": ficha.codigo_rastreio or "",
-        },
-        "cliente": cliente_data,
-        "base_url": os.getenv("BASE_URL", "http://localhost:3000"),
-    }
+    context = contexto_ficha(ficha, cliente)
 
     wkpath = os.getenv("WKHTMLTOPDF_PATH")
     try:
         pdf_bytes = ficha_to_pdf_bytes(context, wkhtmltopdf_path=wkpath)
+    except PdfSobrecarregado as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail="Erro ao gerar o PDF da ficha.")
@@ -432,51 +491,133 @@ def ficha_pdf(ficha_id: int, db: Session = Depends(get_db), admin_id: int = Secu
     )
     
     
+@app.post('/fichas/pdf/batch')
+def fichas_pdf_lote(payload: schemas.FichaPdfLote, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
+
+    query = _query_fichas_lote(db, admin_id, payload)
+    rows = query.order_by(models.Ficha.id.desc()).limit(PDF_LOTE_MAX + 1).all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="Nenhuma ficha encontrada")
+    if len(rows) > PDF_LOTE_MAX:
+        raise HTTPException(status_code=413, detail=f"Máximo de {PDF_LOTE_MAX} fichas por lote. Refine o filtro.")
+
+    contextos = [contexto_ficha(f, c) for f, c in rows]
+    wkpath = os.getenv("WKHTMLTOPDF_PATH")
+
+    try:
+        crud.registrar_log_acesso(db, admin_id, "gerar_pdf_lote", f"{len(contextos)} fichas ({payload.formato.value})")
+    except Exception:
+        db.rollback()
+
+    lote = renderizar_lote(contextos, wkhtmltopdf_path=wkpath)
+
+    if payload.formato == schemas.FormatoLoteEnum.ZIP:
+        # o primeiro PDF sai antes dos cabeçalhos: sem vaga nem depois das tentativas -> 503
+        # (depois que o ZIP começou, falhas só podem ir para o erros.txt)
+        primeiro = next(lote)
+        if isinstance(primeiro[1], PdfSobrecarregado):
+            lote.close()
+            raise HTTPException(status_code=503, detail=str(primeiro[1]), headers={"Retry-After": "5"})
+
+        def _itens():
+            erros = []
+            for context, resultado in itertools.chain([primeiro], lote):
+                ficha_id = context["ficha"]["id"]
+                if isinstance(resultado, Exception):
+                    erros.append(f"ficha {ficha_id}: {resultado}")
+                    continue
+                yield f"ficha_{ficha_id}.pdf", resultado
+            if erros:
+                yield "erros.txt", "\n".join(erros).encode("utf-8")
+
+        corpo = zip_stream(_itens())
+        return StreamingResponse(
+            corpo,
+            media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="fichas.zip"'},
+            # roda também quando o cliente desconecta: fecha o lote e cancela o que falta
+            background=BackgroundTask(corpo.close),
+        )
+
+    def _pdfs():
+        # um PDF por vez vai direto para o writer (sem lista com o lote inteiro em memória)
+        for context, resultado in lote:
+            if isinstance(resultado, PdfSobrecarregado):
+                raise HTTPException(status_code=503, detail=str(resultado), headers={"Retry-After": "5"})
+            if isinstance(resultado, Exception):
+                raise HTTPException(status_code=500, detail=f"Erro ao gerar o PDF da ficha {context['ficha']['id']}.")
+            yield resultado
+
+    try:
+        saida = mesclar_pdfs(_pdfs())
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Erro ao mesclar PDFs do lote")
+        raise HTTPException(status_code=500, detail="Erro ao gerar o PDF do lote.")
+    finally:
+        lote.close()
+    return StreamingResponse(
+        ler_em_pedacos(saida),
+        media_type="application/pdf",
+        headers={"Content-Disposition": 'attachment; filename="fichas.pdf"'},
+    )
+
+
 @app.get('/fichas/{ficha_id}/detail')
-def ficha_detail(ficha_id: int, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
-    ficha = db.query(models.Ficha).filter(models.Ficha.id == ficha_id).first()
-    if not ficha:
+@orcamento_queries(2)
+async def ficha_detail(ficha_id: int, db: AsyncSession = Depends(get_async_db), admin_id: int = Security(verificar_token)):
+    encontrado = await db.run_sync(crud.buscar_ficha_com_cliente, ficha_id, admin_id=admin_id)
+    if not encontrado:
         raise HTTPException(status_code=404, detail="Ficha não encontrada")
-    cliente = db.query(models.Cliente).filter(models.Cliente.id == ficha.cliente_id).first()
-    if cliente and cliente.admin_id is not None and cliente.admin_id != admin_id:
-        raise HTTPException(status_code=404, detail="Ficha não encontrada")
-    logs = db.query(models.LogAtualizacao).filter(models.LogAtualizacao.ficha_id == ficha_id).order_by(models.LogAtualizacao.data.desc()).all()
+    ficha, cliente = encontrado
+    logs = await db.run_sync(crud.listar_logs_por_ficha, ficha_id)
     return {'ficha': jsonable_encoder(ficha), 'cliente': jsonable_encoder(cliente), 'logs': jsonable_encoder(logs)}
     
 
 @app.get('/minhas-fichas')
-def minhas_fichas(page: int = 1, page_size: int = 20, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
-   
-    all_items = crud.listar_fichas_para_admin(db, admin_id, limit=1000)
-    # paginação simples em memória (pode mudar para query paginada no DB)
-    start = (max(1, page) - 1) * max(1, page_size)
-    end = start + max(1, page_size)
-    items_page = all_items[start:end]
-    return {"items": jsonable_encoder(items_page), "total": len(all_items)}
+@orcamento_queries(2)
+async def minhas_fichas(page: int = 1, page_size: int = 20, cursor: Optional[str] = None, include_total: bool = True, db: AsyncSession = Depends(get_async_db), admin_id: int = Security(verificar_token)):
+    page = max(1, page)
+    page_size = max(1, min(100, page_size))
+
+    try:
+        items, total, next_cursor = await db.run_sync(crud.pagina_fichas_do_admin, admin_id, page, page_size, cursor, include_total)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": jsonable_encoder(items), "total": total, "next_cursor": next_cursor}
 
 
 @app.get('/fichas/estatisticas')  
-def fichas_estatisticas(limit_months: int = 6, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
+@orcamento_queries(1)
+async def fichas_estatisticas(limit_months: int = 6, por_status: bool = False, db: AsyncSession = Depends(get_async_db), admin_id: int = Security(verificar_token)):
     
-    rows = (
-        db.query(models.Ficha).join(models.Cliente, models.Ficha.cliente_id == models.Cliente.id).filter(models.Cliente.admin_id == admin_id).all()
-    )
+    limit_months = max(1, min(120, limit_months))
+    now = datetime.utcnow()
+    # primeiro dia do mês mais antigo da janela
+    inicio = (now + relativedelta(months=-(limit_months - 1))).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
     counts = defaultdict(int)
-    for r in rows:
-        dt = getattr(r, "data_criacao", None)
-        if not dt:
-            continue
-        key = dt.strftime("%Y-%m")
-        counts[key] += 1
+    status_counts = defaultdict(dict)
+    for row in await crud.contar_fichas_por_mes_async(db, admin_id, inicio, por_status=por_status):
+        if por_status:
+            key, st, total = row
+            status_counts[key][st or ""] = int(total)
+        else:
+            key, total = row
+        if key:
+            counts[key] += int(total)
 
-    now = datetime.utcnow()
     out = []
     for i in range(limit_months - 1, -1, -1):
         target = now + relativedelta(months=-i)
         key = target.strftime("%Y-%m")
         label = target.strftime("%b %Y")
        
-        out.append({"mes": label, "key": key, "total": int(counts.get(key, 0))})
+        item = {"mes": label, "key": key, "total": int(counts.get(key, 0))}
+        if por_status:
+            item["por_status"] = status_counts.get(key, {})
+        out.append(item)
     return out
 
 
@@ -484,11 +625,15 @@ def fichas_estatisticas(limit_months: int = 6, db: Session = Depends(get_db), ad
 
 
 @app.get("/logs")
-def listar_logs_acesso(page: int = 1, page_size: int = 20, db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
-    
-    query = db.query(models.LogAcesso).filter(models.LogAcesso.admin_id == admin_id)
-    total = query.count()
-    data = query.order_by(models.LogAcesso.id.desc()).offset((page - 1) * page_size).limit(page_size).all()
+@orcamento_queries(2)
+async def listar_logs_acesso(page: int = 1, page_size: int = 20, cursor: Optional[str] = None, include_total: bool = True, db: AsyncSession = Depends(get_async_db), admin_id: int = Security(verificar_token)):
+    page = max(1, page)
+    page_size = max(1, min(100, page_size))
+
+    try:
+        data, total, next_cursor = await db.run_sync(crud.pagina_logs_acesso, admin_id, page, page_size, cursor, include_total)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     items = []
     
     for l in data:
@@ -508,13 +653,46 @@ def listar_logs_acesso(page: int = 1, page_size: int = 20, db: Session = Depends
                 "data": l.data.isoformat() if getattr(l, "data", None) else None,
             }
         )
-    return {"items": items, "total": total}
+    return {"items": items, "total": total, "next_cursor": next_cursor}
 # ...existing code...
 
     
 
 
 
+#Métricas
+
+@app.get('/metrics', include_in_schema=False)
+def metricas(request: Request):
+    if not metricas_utils.METRICAS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if metricas_utils.METRICAS_TOKEN and request.headers.get("authorization") != f"Bearer {metricas_utils.METRICAS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    return Response(metricas_utils.exportar(), media_type="text/plain; version=0.0.4")
+
+
+#Importação
+
+@app.post('/import')
+def importar_dados(arquivo: UploadFile = File(...), db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
+    # CSV/XLSX com colunas de cliente (+ ficha opcional); resposta em NDJSON, um evento por lote
+    eventos = import_utils.importar(db, admin_id, arquivo.file, arquivo.filename)
+    try:
+        primeiro = next(eventos)
+    except import_utils.ArquivoInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def _ndjson():
+        ultimo = None
+        for evento in itertools.chain([primeiro], eventos):
+            ultimo = evento
+            yield json.dumps(evento, default=str, ensure_ascii=False) + "\n"
+        if ultimo:
+            crud.registrar_log_acesso(db, admin_id, "importacao", f"{arquivo.filename}: {ultimo.get('clientes', 0)} clientes, {ultimo.get('fichas', 0)} fichas, {ultimo.get('erros', 0)} erros")
+
+    return StreamingResponse(_ndjson(), media_type="application/x-ndjson")
+
+
 @app.post('/upload-foto')
 def upload_foto(foto: UploadFile = File(...), db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
     
@@ -567,12 +745,15 @@ def upload_foto(foto: UploadFile = File(...), db: Session = Depends(get_db), adm
     admin.foto_perfil = caminho_rel
     db.add(admin)
     db.commit()       
-    return {"foto_perfil": caminho_rel}
+    # token novo com a foto atualizada no claim
+    return {"foto_perfil": caminho_rel, "access_token": criar_token_acesso(claims_admin(admin))}
 
 
 @app.get('/usuario/me')
-def usuario_me(db: Session = Depends(get_db), admin_id: int = Security(verificar_token)):
-    admin = db.query(models.Admin).filter(models.Admin.id == admin_id).first()
+async def usuario_me(db: AsyncSession = Depends(get_async_db), ctx: ContextoAuth = Security(verificar_contexto)):
+    if ctx.tem_foto:
+        return {"foto_perfil": ctx.foto_perfil}
+    admin = await db.get(models.Admin, ctx.admin_id)
     return {"foto_perfil": getattr(admin, "foto_perfil", None)}
 
 
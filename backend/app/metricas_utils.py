@@ -0,0 +1,253 @@
+import os
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger(__name__)
+
+
+APP_ENV = os.getenv("APP_ENV", "development").lower()
+
+# desligado por padrão: /metrics expõe rotas, latências e volume de uso
+METRICAS_ENABLED = os.getenv("METRICAS_ENABLED", "false").lower() in ("1", "true", "yes")
+# se definido, /metrics exige "Authorization: Bearer <METRICAS_TOKEN>"
+METRICAS_TOKEN = os.getenv("METRICAS_TOKEN", "")
+if APP_ENV == "production" and METRICAS_ENABLED and not METRICAS_TOKEN:
+    raise ValueError("Em produção, METRICAS_ENABLED exige METRICAS_TOKEN")
+# requisições acima disso (ms) vão para o log com a contagem de queries; 0 desliga
+METRICAS_LENTO_MS = float(os.getenv("METRICAS_LENTO_MS", "1000"))
+
+_BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+_BUCKETS_QUERIES = (1, 2, 3, 5, 10, 20, 50, 100)
+_BUCKETS_PDF = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+# Formato texto do Prometheus sem dependência extra (métricas por processo: com vários
+# workers, cada um expõe as suas e o Prometheus agrega)
+
+def _rotulos(nomes: Sequence[str], valores: Sequence[str]) -> str:
+    if not nomes:
+        return ""
+    pares = []
+    for nome, valor in zip(nomes, valores):
+        valor = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pares.append(f'{nome}="{valor}"')
+    return "{" + ",".join(pares) + "}"
+
+
+def _num(v: float) -> str:
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+class Histograma:
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Sequence[str] = (), buckets: Sequence[float] = _BUCKETS_LATENCIA):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        # rótulos -> [contagem por bucket..., soma, total]
+        self.series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observar(self, valor: float, *rotulos: str) -> None:
+        # bucket "le": primeiro limite >= valor (acima do último, só entra no +Inf)
+        i = bisect.bisect_left(self.buckets, valor)
+        with self.lock:
+            serie = self.series.get(rotulos)
+            if serie is None:
+                serie = self.series[rotulos] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exportar(self) -> Iterable[str]:
+        yield f"# HELP {self.nome} {self.ajuda}"
+        yield f"# TYPE {self.nome} histogram"
+        with self.lock:
+            series = [(k, list(v)) for k, v in self.series.items()]
+        nomes = self.rotulos + ("le",)
+        for rotulos, serie in series:
+            acumulado = 0
+            for limite, qtd in zip(self.buckets, serie):
+                acumulado += qtd
+                yield f"{self.nome}_bucket{_rotulos(nomes, rotulos + (_num(limite),))} {acumulado}"
+            yield f"{self.nome}_bucket{_rotulos(nomes, rotulos + ('+Inf',))} {serie[-1]}"
+            yield f"{self.nome}_sum{_rotulos(self.rotulos, rotulos)} {_num(serie[-2])}"
+            yield f"{self.nome}_count{_rotulos(self.rotulos, rotulos)} {serie[-1]}"
+
+
+class Gauge:
+    # valor calculado na hora da coleta: funcao() -> {(rótulos...): valor}
+    tipo = "gauge"
+
+    def __init__(self, nome: str, ajuda: str, funcao: Callable[[], Dict[Tuple[str, ...], float]], rotulos: Sequence[str] = ()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.funcao = funcao
+        self.rotulos = tuple(rotulos)
+
+    def exportar(self) -> Iterable[str]:
+        try:
+            valores = self.funcao()
+        except Exception:
+            logger.warning("Falha ao coletar a métrica %s", self.nome, exc_info=True)
+            return
+        yield f"# HELP {self.nome} {self.ajuda}"
+        yield f"# TYPE {self.nome} {self.tipo}"
+        for rotulos, valor in valores.items():
+            yield f"{self.nome}{_rotulos(self.rotulos, rotulos)} {_num(valor)}"
+
+
+class Contador(Gauge):
+    # contador monotônico mantido por outro módulo (ex. hits do cache), lido na coleta;
+    # como counter o Prometheus aplica rate() e trata o reinício do processo
+    tipo = "counter"
+
+
+REQUISICOES = Histograma("http_request_duration_seconds", "Latência das requisições HTTP.", ("method", "route", "status"))
+QUERIES = Histograma("http_request_db_queries", "Queries SQL por requisição.", ("route",), _BUCKETS_QUERIES)
+TEMPO_DB = Histograma("http_request_db_seconds", "Tempo em queries SQL por requisição.", ("route",))
+PDF = Histograma("pdf_render_seconds", "Tempo do ficha_to_pdf_bytes.", ("motor", "cache"), _BUCKETS_PDF)
+
+_metricas: List = [REQUISICOES, QUERIES, TEMPO_DB, PDF]
+
+
+def registrar(metrica) -> None:
+    _metricas.append(metrica)
+
+
+def exportar() -> str:
+    linhas: List[str] = []
+    for metrica in _metricas:
+        linhas.extend(metrica.exportar())
+    return "\n".join(linhas) + "\n"
+
+
+# Queries por requisição: os eventos do engine somam no contador da requisição atual.
+# O contextvars é copiado para a thread dos endpoints síncronos, e a lista é a mesma.
+
+_consultas: contextvars.ContextVar[Optional[List[float]]] = contextvars.ContextVar("consultas_requisicao", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _antes_query(conn, cursor, statement, parameters, context, executemany):
+    if _consultas.get() is not None:
+        conn.info.setdefault("metricas_inicio", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _depois_query(conn, cursor, statement, parameters, context, executemany):
+    atual = _consultas.get()
+    if atual is None:
+        return
+    inicios = conn.info.get("metricas_inicio")
+    if inicios:
+        atual[1] += time.perf_counter() - inicios.pop()
+    atual[0] += 1
+
+
+# rota = caminho do template ("/fichas/{ficha_id}"), não o caminho real: cardinalidade fixa
+_rotas_por_endpoint: Dict[Callable, str] = {}
+
+
+def _rota(app, scope) -> str:
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "sem_rota"
+    rota = _rotas_por_endpoint.get(endpoint)
+    if rota is None:
+        for r in getattr(app, "routes", []):
+            if getattr(r, "endpoint", None) is endpoint:
+                rota = r.path
+                break
+        else:
+            rota = getattr(endpoint, "__name__", "sem_rota")
+        _rotas_por_endpoint[endpoint] = rota
+    return rota
+
+
+class MetricasMiddleware:
+    # ASGI puro, como o LimiteMiddleware; mede até o fim do corpo (inclui streaming)
+
+    def __init__(self, app, app_rotas=None):
+        self.app = app
+        self.app_rotas = app_rotas
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICAS_ENABLED or scope["path"] == "/metrics":
+            return await self.app(scope, receive, send)
+        inicio = time.perf_counter()
+        consultas = [0, 0.0]
+        token = _consultas.set(consultas)
+        status = [500]
+
+        async def _send(mensagem):
+            if mensagem["type"] == "http.response.start":
+                status[0] = mensagem["status"]
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _consultas.reset(token)
+            duracao = time.perf_counter() - inicio
+            rota = _rota(self.app_rotas, scope)
+            REQUISICOES.observar(duracao, scope["method"], rota, str(status[0]))
+            QUERIES.observar(consultas[0], rota)
+            TEMPO_DB.observar(consultas[1], rota)
+            if METRICAS_LENTO_MS and duracao * 1000 >= METRICAS_LENTO_MS:
+                logger.warning(
+                    "Requisição lenta: %s %s -> %s em %.0fms (%d queries, %.0fms no banco)",
+                    scope["method"], scope["path"], status[0], duracao * 1000, consultas[0], consultas[1] * 1000,
+                )
+
+
+# Gauges coletados na hora do scrape
+
+def _fila_emails() -> Dict[Tuple[str, ...], float]:
+    from sqlalchemy import func, select
+    from . import models
+    from .database import SessionLocal
+
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(models.EmailOutbox.status, func.count())
+            .where(models.EmailOutbox.status != "ENVIADO")
+            .group_by(models.EmailOutbox.status)
+        ).all()
+    valores = {(s,): 0 for s in ("PENDENTE", "ENVIANDO", "FALHOU")}
+    valores.update({(status,): qtd for status, qtd in rows})
+    return valores
+
+
+def _cache_qr() -> Dict[Tuple[str, ...], float]:
+    from .pdf_utils import qr_cache_info
+
+    info = qr_cache_info()
+    return {(campo,): info[campo] for campo in ("tamanho", "max") if info[campo] is not None}
+
+
+def _consultas_cache_qr() -> Dict[Tuple[str, ...], float]:
+    from .pdf_utils import qr_cache_info
+
+    info = qr_cache_info()
+    return {
+        ("memoria", "hit"): info["hits"],
+        ("memoria", "miss"): info["misses"],
+        ("disco", "hit"): info["disco_hits"],
+        ("disco", "miss"): info["disco_misses"],
+    }
+
+
+registrar(Gauge("email_outbox_fila", "Emails na outbox por status (sem os já enviados).", _fila_emails, ("status",)))
+registrar(Gauge("qr_cache", "Cache de QR codes em memória (itens e capacidade).", _cache_qr, ("campo",)))
+registrar(Contador("qr_cache_lookups_total", "Consultas ao cache de QR codes por camada e resultado.", _consultas_cache_qr, ("camada", "resultado")))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Float
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Float, Index, JSON
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -35,6 +35,10 @@ class Cliente(Base):
 
     fichas = relationship("Ficha", back_populates="cliente")
     admin = relationship("Admin", back_populates="clientes")
+
+    __table_args__ = (
+        Index("ix_clientes_admin_id_id", admin_id, id.desc()),
+    )
     
 #Ficha
 
@@ -56,6 +60,8 @@ class Ficha(Base):
     acessorios = Column(Text, nullable=True)
     previsao_entrega = Column(String(128), nullable=True)
     valor = Column(Float, nullable=True)
+    # controle de concorrência otimista: UPDATE ... WHERE versao = <lida>
+    versao = Column(Integer, nullable=False, default=1, server_default="1")
     
     
     cliente_id = Column(Integer, ForeignKey("clientes.id", ondelete="CASCADE"), nullable=False)
@@ -63,6 +69,14 @@ class Ficha(Base):
 
     logs = relationship("LogAtualizacao", back_populates="ficha", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_fichas_cliente_id_id", cliente_id, id.desc()),
+        Index("ix_fichas_cliente_id_data_criacao", cliente_id, data_criacao),
+        Index("ix_fichas_status", status),
+        Index("ix_fichas_data_criacao", data_criacao),
+    )
+    __mapper_args__ = {"version_id_col": versao}
+
 
 #Log de Atualização
 
@@ -72,9 +86,15 @@ class LogAtualizacao(Base):
     id = Column(Integer, primary_key=True, index=True)
     status = Column(String(128), nullable=False, default="")
     descricao = Column(Text, nullable=True)
+    # diff das edições: {"campo": {"old": ..., "new": ...}}
+    mudancas = Column(JSON, nullable=True)
     data = Column(DateTime, default=datetime.utcnow, nullable=False)
     ficha_id = Column(Integer, ForeignKey("fichas.id", ondelete="CASCADE"), nullable=False)
     ficha = relationship("Ficha", back_populates='logs')
+
+    __table_args__ = (
+        Index("ix_logs_ficha_id_data", ficha_id, data.desc()),
+    )
     
     
 class LogAcesso(Base):
@@ -85,5 +105,42 @@ class LogAcesso(Base):
     detalhe = Column(String(1024), nullable=True)
     data = Column(DateTime, default=datetime.utcnow, nullable=False)
 
+    __table_args__ = (
+        Index("ix_logs_acesso_admin_id_id", admin_id, id.desc()),
+    )
+
+
+#Fila de emails (outbox)
+
+class EmailOutbox(Base):
+    __tablename__ = "emails_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    destinatarios = Column(Text, nullable=False)  # separados por vírgula
+    assunto = Column(String(512), nullable=False, default="")
+    corpo = Column(Text, nullable=False, default="")
+    # PENDENTE -> ENVIANDO -> ENVIADO; FALHOU = esgotou as tentativas ou recusa permanente 5xx (dead letter)
+    status = Column(String(32), nullable=False, default="PENDENTE")
+    tentativas = Column(Integer, nullable=False, default=0)
+    proxima_tentativa = Column(DateTime, nullable=False, default=datetime.utcnow)
+    ultimo_erro = Column(Text, nullable=True)
+    criado_em = Column(DateTime, default=datetime.utcnow, nullable=False)
+    enviado_em = Column(DateTime, nullable=True)
+    # agrupa emails que se substituem (ex.: status_ficha:<id>)
+    chave = Column(String(128), nullable=True)
+
+    __table_args__ = (
+        Index("ix_emails_outbox_status_proxima", status, proxima_tentativa),
+        Index("ix_emails_outbox_chave_status", chave, status),
+    )
+
+
+#Refresh tokens já usados (rotação / logout)
+
+class RefreshUsado(Base):
+    __tablename__ = "refresh_usados"
 
-    
\ No newline at end of file
+    # jti do refresh; a PK faz o "primeiro uso" atômico entre workers
+    jti = Column(String(64), primary_key=True)
+    # exp do token: depois disso a assinatura já recusa e a linha pode ser apagada
+    expira_em = Column(DateTime, nullable=False, index=True)
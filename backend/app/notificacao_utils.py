@@ -0,0 +1,118 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from sqlalchemy import case, update
+from sqlalchemy.orm import Session
+
+from . import models
+from .schemas import StatusEnum
+from .mail_utils import enfileirar_emails, limitar_por_destinatario
+
+
+logger = logging.getLogger(__name__)
+
+
+NOTIFICAR_STATUS = os.getenv("NOTIFICAR_STATUS", "true").lower() in ("1", "true", "yes")
+# mudanças seguidas na mesma ficha dentro desse intervalo viram um único email
+NOTIFICACAO_DEBOUNCE = int(os.getenv("NOTIFICACAO_DEBOUNCE", "120"))  # em segundos
+# emails de status por destinatário por hora; acima disso o envio é adiado, não descartado
+NOTIFICACAO_LIMITE_POR_HORA = int(os.getenv("NOTIFICACAO_LIMITE_POR_HORA", "5"))
+limitar_por_destinatario("status_ficha:", NOTIFICACAO_LIMITE_POR_HORA, 3600)
+BASE_URL = os.getenv("BASE_URL", "http://localhost:3000").rstrip("/")
+
+ROTULOS_STATUS = {
+    StatusEnum.ABERTA: "Aberta",
+    StatusEnum.EM_ANALISE: "Em análise",
+    StatusEnum.AGUARDANDO_PECA: "Aguardando peça",
+    StatusEnum.EM_REPARO: "Em reparo",
+    StatusEnum.FINALIZADA: "Finalizada",
+    StatusEnum.ENTREGUE: "Entregue",
+    StatusEnum.CANCELADA: "Cancelada",
+}
+
+env = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), "templates")),
+    autoescape=select_autoescape(["html", "xml"]),
+)
+
+
+def rotulo_status(status) -> str:
+    try:
+        return ROTULOS_STATUS[StatusEnum(status)]
+    except ValueError:
+        return str(status or "")
+
+
+def _renderizar(ficha: models.Ficha, cliente: models.Cliente) -> Tuple[str, str]:
+    status = rotulo_status(ficha.status)
+    corpo = env.get_template("email_status.html").render(
+        cliente_nome=cliente.nome,
+        equipamento=" ".join(p for p in (ficha.marca, ficha.modelo) if p),
+        status=status,
+        previsao_entrega=ficha.previsao_entrega,
+        observacao_publica=ficha.observacao_publica,
+        codigo_rastreio=ficha.codigo_rastreio,
+        rastreio_url=f"{BASE_URL}/rastreio/{ficha.codigo_rastreio}",
+    )
+    return f"Ficha {ficha.codigo_rastreio}: {status}", corpo
+
+
+def notificar_status_ficha(db: Session, ficha: models.Ficha, cliente: Optional[models.Cliente]) -> int:
+    return notificar_status_fichas(db, [(ficha, cliente)])
+
+
+def notificar_status_fichas(db: Session, pares: Iterable[Tuple[models.Ficha, Optional[models.Cliente]]]) -> int:
+    # só adiciona/atualiza na sessão; quem chamou faz o commit junto com as fichas.
+    # lote inteiro em 1 SELECT + 1 UPDATE para os emails ainda pendentes + 1 INSERT para os novos;
+    # devolve quantos emails foram agendados/atualizados
+    if not NOTIFICAR_STATUS:
+        return 0
+    envio = datetime.utcnow() + timedelta(seconds=NOTIFICACAO_DEBOUNCE)
+    novos: Dict[str, Tuple[models.Cliente, str, str]] = {}
+    for ficha, cliente in pares:
+        if cliente is None or not getattr(cliente, "email", None):
+            continue
+        assunto, corpo = _renderizar(ficha, cliente)
+        novos[f"status_ficha:{ficha.id}"] = (cliente, assunto, corpo)
+    if not novos:
+        return 0
+
+    # ainda há um email destas fichas esperando: reaproveita com o status mais recente
+    pendentes: Dict[str, models.EmailOutbox] = {}
+    for email in (
+        db.query(models.EmailOutbox)
+        .filter(models.EmailOutbox.chave.in_(list(novos)), models.EmailOutbox.status == "PENDENTE")
+        .order_by(models.EmailOutbox.id)
+    ):
+        pendentes[email.chave] = email  # o mais recente de cada chave
+    atualizados = 0
+    if pendentes:
+        por_id = {e.id: e for e in pendentes.values()}
+        atual = {e.id: novos[e.chave] for e in pendentes.values()}
+        Outbox = models.EmailOutbox
+        # um UPDATE só: CASE por id com o conteúdo de cada email
+        ids = db.execute(
+            update(Outbox)
+            .where(Outbox.id.in_(list(atual)), Outbox.status == "PENDENTE")
+            .values(
+                assunto=case({i: assunto for i, (_, assunto, _) in atual.items()}, value=Outbox.id),
+                corpo=case({i: corpo for i, (_, _, corpo) in atual.items()}, value=Outbox.id),
+                destinatarios=case({i: cliente.email for i, (cliente, _, _) in atual.items()}, value=Outbox.id),
+                proxima_tentativa=case({e.id: max(envio, e.proxima_tentativa) for e in pendentes.values()}, value=Outbox.id),
+            )
+            .returning(Outbox.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        # os que não voltaram foram pegos pelo despachante nesse meio tempo: seguem como email novo
+        for i in ids:
+            del novos[por_id[i].chave]
+        atualizados = len(ids)
+
+    # o limite por destinatário é aplicado pelo despachante, na hora do envio
+    return atualizados + enfileirar_emails(db, [
+        {"destinatario": cliente.email, "assunto": assunto, "corpo": corpo, "chave": chave, "enviar_em": envio}
+        for chave, (cliente, assunto, corpo) in novos.items()
+    ])
@@ -0,0 +1,128 @@
+import os
+import glob
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+PDF_CACHE_ENABLED = os.getenv("PDF_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "sistema_ficha_pdf_cache")
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_MB", "100")) * 1024 * 1024
+
+# campos que aparecem no PDF (templates/ficha.html); mudanças neles invalidam o cache
+CAMPOS_PDF_FICHA = {"id", "categoria", "marca", "modelo", "serial", "descricao", "defeito", "acessorios", "codigo_rastreio"}
+CAMPOS_PDF_CLIENTE = {"nome", "telefone", "email", "endereco", "numero", "bairro"}
+
+
+def chave_pdf(context: Dict, extra: Optional[Dict] = None) -> str:
+    # hash do contexto já sanitizado + o que mais influencia a renderização
+    payload = {"context": context, "extra": extra or {}}
+    raw = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+class PdfCache:
+    # cache em disco com despejo LRU por tamanho total (mtime = último acesso)
+
+    def __init__(self, diretorio: str, max_bytes: int):
+        self.diretorio = diretorio
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _nome(self, chave: str, ficha_id=None, cliente_id=None) -> str:
+        return os.path.join(self.diretorio, f"c{cliente_id}_f{ficha_id}_{chave}.pdf")
+
+    def get(self, chave: str, ficha_id=None, cliente_id=None) -> Optional[bytes]:
+        # caminho exato (mesmos ids do put): um open por hit; glob só na invalidação/despejo
+        caminho = self._nome(chave, ficha_id, cliente_id)
+        try:
+            with open(caminho, "rb") as f:
+                data = f.read()
+            os.utime(caminho, None)
+            return data
+        except OSError:
+            return None
+
+    def put(self, chave: str, data: bytes, ficha_id=None, cliente_id=None) -> None:
+        if not data or len(data) > self.max_bytes:
+            return
+        with self._lock:
+            try:
+                os.makedirs(self.diretorio, exist_ok=True)
+                # a ficha mudou -> versões antigas dela não servem mais
+                if ficha_id is not None:
+                    self._remover(f"c*_f{ficha_id}_*.pdf")
+                destino = self._nome(chave, ficha_id, cliente_id)
+                fd, tmp = tempfile.mkstemp(dir=self.diretorio, suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, destino)
+                self._despejar()
+            except OSError:
+                logger.exception("Erro ao gravar PDF no cache (não crítico)")
+
+    def _despejar(self) -> None:
+        arquivos = []
+        total = 0
+        for caminho in glob.glob(os.path.join(self.diretorio, "*.pdf")):
+            try:
+                st = os.stat(caminho)
+            except OSError:
+                continue
+            arquivos.append((st.st_mtime, st.st_size, caminho))
+            total += st.st_size
+        arquivos.sort()
+        while total > self.max_bytes and arquivos:
+            _, tamanho, caminho = arquivos.pop(0)
+            try:
+                os.remove(caminho)
+                total -= tamanho
+            except OSError:
+                pass
+
+    def _remover(self, padrao: str) -> int:
+        removidos = 0
+        for caminho in glob.glob(os.path.join(self.diretorio, padrao)):
+            try:
+                os.remove(caminho)
+                removidos += 1
+            except OSError:
+                pass
+        return removidos
+
+    def invalidar_ficha(self, ficha_id: int) -> int:
+        with self._lock:
+            return self._remover(f"c*_f{ficha_id}_*.pdf")
+
+    def invalidar_cliente(self, cliente_id: int) -> int:
+        with self._lock:
+            return self._remover(f"c{cliente_id}_f*_*.pdf")
+
+    def limpar(self) -> int:
+        with self._lock:
+            return self._remover("*.pdf")
+
+
+pdf_cache = PdfCache(PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES)
+
+
+def invalidar_pdf_ficha(ficha_id: int, campos=None) -> None:
+    if not PDF_CACHE_ENABLED:
+        return
+    if campos is not None and not (set(campos) & CAMPOS_PDF_FICHA):
+        return
+    pdf_cache.invalidar_ficha(ficha_id)
+
+
+def invalidar_pdf_cliente(cliente_id: int, campos=None) -> None:
+    if not PDF_CACHE_ENABLED:
+        return
+    if campos is not None and not (set(campos) & CAMPOS_PDF_CLIENTE):
+        return
+    pdf_cache.invalidar_cliente(cliente_id)
@@ -1,14 +1,27 @@
 import os
 import io
+import abc
 import uuid
 import shutil
 import base64
+import hashlib
+import functools
 import logging
-from typing import Dict
+import zipfile
+import tempfile
+import threading
+import time
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from typing import Dict, Optional, Iterable, Iterator, List, Tuple, Union
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 import pdfkit
 import qrcode
 from PIL import Image
+from .pdf_cache import pdf_cache, chave_pdf, PDF_CACHE_ENABLED
+from . import metricas_utils
 
 
 logger =  logging.getLogger(__name__)
@@ -22,22 +35,117 @@ env = Environment(
 
 ALLOW_LOCAL_FILE_ACCESS = os.getenv('PDF_ALLOW_LOCAL_FILE_ACCESS', 'true').lower() in ('1', 'true', 'yes')
 
+# motor padrão: 'wkhtmltopdf' (template HTML) ou 'reportlab' (em processo, sem fork)
+PDF_ENGINE = os.getenv('PDF_ENGINE', 'wkhtmltopdf').strip().lower()
+# quantos PDFs podem ser gerados ao mesmo tempo neste processo
+PDF_MAX_CONCORRENCIA = max(1, int(os.getenv('PDF_MAX_CONCORRENCIA', str(os.cpu_count() or 2))))
+# quantas requisições podem esperar por uma vaga; além disso responde 503
+PDF_FILA_MAX = max(0, int(os.getenv('PDF_FILA_MAX', '16')))
+PDF_FILA_TIMEOUT = float(os.getenv('PDF_FILA_TIMEOUT', '10'))
+# >0: renderiza num pool de processos persistente (workers reaproveitados)
+PDF_PROCESSOS = max(0, int(os.getenv('PDF_PROCESSOS', '0')))
+# tempo máximo esperando um PDF do pool (segundos)
+PDF_RENDER_TIMEOUT = float(os.getenv('PDF_RENDER_TIMEOUT', '30'))
+# exportação em lote
+PDF_LOTE_MAX = max(1, int(os.getenv('PDF_LOTE_MAX', '200')))
+PDF_LOTE_WORKERS = max(1, int(os.getenv('PDF_LOTE_WORKERS', '2')))
+# tentativas por ficha do lote quando não há vaga (PdfSobrecarregado)
+PDF_LOTE_TENTATIVAS = max(1, int(os.getenv('PDF_LOTE_TENTATIVAS', '3')))
+
+
+def _hash_template(nome: str = 'ficha.html') -> str:
+    try:
+        with open(os.path.join(TEMPLATE_DIR, nome), 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return ""
+
+# entra na chave do cache: mudar o template invalida os PDFs gerados
+TEMPLATE_HASH = _hash_template()
+
 def render_ficha_html(context: Dict) -> str:
     tpl = env.get_template('ficha.html')
     return tpl.render(**context)
 
-def _generate_qr_data_uri(text: str, size: int = 200) -> str:
-    qr = qrcode.QRCode(box_size=4, border=1)
+# cache de QR codes: a URL de rastreio de uma ficha nunca muda
+QR_CACHE_MAX = max(1, int(os.getenv('QR_CACHE_MAX', '2048')))
+QR_CACHE_DIR = os.getenv('QR_CACHE_DIR', '').strip()
+
+_qr_disco = {"hits": 0, "misses": 0}
+_qr_disco_lock = threading.Lock()
+
+
+def _render_qr_png(text: str, size: int) -> bytes:
+    qr = qrcode.QRCode(border=1)
     qr.add_data(text)
     qr.make(fit=True)
-    img = qr.make_image(fill_color='black', back_color='white').convert('RGB')
-    img = img.resize((size, size), Image.LANCZOS)
+    # desenha já no tamanho final (box_size inteiro) em vez de redimensionar com LANCZOS
+    modulos = qr.modules_count + 2 * qr.border
+    # menor que 1px por módulo o recorte cortava o código: sai no mínimo com 1px por módulo
+    lado = max(size, modulos)
+    qr.box_size = max(1, lado // modulos)
+    img = qr.make_image(fill_color='black', back_color='white').get_image()
+    if img.size != (lado, lado):
+        # completa a sobra com margem branca (centralizado)
+        fundo = Image.new(img.mode, (lado, lado), 'white')
+        offset = ((lado - img.size[0]) // 2, (lado - img.size[1]) // 2)
+        fundo.paste(img, offset)
+        img = fundo
     buf = io.BytesIO()
-    img.save(buf, format='PNG')
-    b64 = base64.b64encode(buf.getvalue()).decode('ascii')
+    img.save(buf, format='PNG', optimize=False)
+    return buf.getvalue()
+
+
+def _caminho_qr_disco(text: str, size: int) -> str:
+    nome = hashlib.sha256(f"{size}:{text}".encode('utf-8')).hexdigest()
+    return os.path.join(QR_CACHE_DIR, f"{nome}.png")
+
+
+def _qr_png(text: str, size: int) -> bytes:
+    if not QR_CACHE_DIR:
+        return _render_qr_png(text, size)
+    caminho = _caminho_qr_disco(text, size)
+    try:
+        with open(caminho, 'rb') as f:
+            png = f.read()
+        with _qr_disco_lock:
+            _qr_disco["hits"] += 1
+        return png
+    except OSError:
+        with _qr_disco_lock:
+            _qr_disco["misses"] += 1
+    png = _render_qr_png(text, size)
+    try:
+        os.makedirs(QR_CACHE_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=QR_CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(png)
+        os.replace(tmp, caminho)
+    except OSError:
+        logger.warning("Não foi possível gravar QR code no cache em disco (não crítico)")
+    return png
+
+
+@functools.lru_cache(maxsize=QR_CACHE_MAX)
+def _generate_qr_data_uri(text: str, size: int = 200) -> str:
+    b64 = base64.b64encode(_qr_png(text, size)).decode('ascii')
     return f"data:image/png;base64,{b64}"
 
 
+def qr_cache_info() -> Dict[str, int]:
+    info = _generate_qr_data_uri.cache_info()
+    with _qr_disco_lock:
+        disco_hits, disco_misses = _qr_disco["hits"], _qr_disco["misses"]
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "tamanho": info.currsize,
+        "max": info.maxsize,
+        "disco_hits": disco_hits,
+        "disco_misses": disco_misses,
+    }
+
+
 def _sanitize_context(context: Dict, max_field_len: int = 8000) -> Dict:
     out = dict(context or {})
     ficha = dict(out.get("ficha", {}) or {})
@@ -47,56 +155,451 @@ def _sanitize_context(context: Dict, max_field_len: int = 8000) -> Dict:
     out['ficha'] = ficha
     return out
 
-def ficha_to_pdf_bytes(context: Dict, wkhtmltopdf_path: str = None) -> bytes:
-    
-    wk = wkhtmltopdf_path or os.getenv('WKHTMLTOPDF_PATH') or shutil.which('wkhtmltopdf')
-    if not wk:
-        raise RuntimeError("wkhtmltopdf não encontrado. Defina WKHTMLTOPDF_PATH ou instale wkhtmltopdf no PATH.")
-    if not os.path.isfile(wk):
-        wk = shutil.which(wk) or wk
-    if not os.path.isfile(wk):
-        raise RuntimeError(f"wkhtmltopdf não encontrado no caminho especificado: {wk}")
+class PdfSobrecarregado(RuntimeError):
+    pass
 
-    context = _sanitize_context(context, max_field_len=int(os.getenv("PDF_MAX_FIELD_LEN", "8000")))
 
+def contexto_ficha(ficha, cliente, base_url: Optional[str] = None) -> Dict:
+    cliente_data = {
+        "id": getattr(cliente, "id", None),
+        "nome": getattr(cliente, "nome", "") or "",
+        "telefone": getattr(cliente, "telefone", "") or "",
+        "email": getattr(cliente, "email", "") or "",
+        "endereco": getattr(cliente, "endereco", "") or "",
+        "numero": getattr(cliente, "numero", "") or "",
+        "bairro": getattr(cliente, "bairro", "") or "",
+    }
 
-    try:
-        codigo = context.get('ficha', {}).get('codigo_rastreio', '') or ""
-        base_url = context.get('base_url', os.getenv('BASE_URL', 'http://localhost:3000')).rstrip('/')
-        rastreio_url = f"{base_url}/rastreio/{codigo}"
-        context = dict(context)
-        context['ficha'] = dict(context.get('ficha', {}))
-        # chave usada no template é 'qr_data_uri'
-        context['ficha']['qr_data_uri'] = _generate_qr_data_uri(rastreio_url, size=int(os.getenv('QR_CODE_SIZE', '220')))
-    except Exception:
-        # não falhar a geração do PDF por causa do QR
-        logger.exception("Erro ao gerar QR code para PDF")
-        context.setdefault('ficha', {})['qr_data_uri'] = None
-
-    html = render_ficha_html(context)
-    options = {
-        "dpi": "300",
-        "page-size": "A4",
-        "margin-top": "8mm",
-        "margin-bottom": "8mm",
-        "margin-left": "8mm",
-        "margin-right": "8mm",
-        "no-outline": None,
-        "quiet": None,
-        "disable-javascript": None,
-        "no-stop-slow-scripts": None,
+    return {
+        "ficha": {
+            "id": ficha.id,
+            "categoria": ficha.categoria or "",
+            "marca": ficha.marca or "",
+            "modelo": ficha.modelo or "",
+            "serial": ficha.serial or "",
+            "descricao": ficha.descricao or "",
+            "defeito": getattr(ficha, "defeito", "") or "",
+            "acessorios": getattr(ficha, "acessorios", "") or "",
+            "codigo_rastreio": ficha.codigo_rastreio or "",
+        },
+        "cliente": cliente_data,
+        "base_url": base_url or os.getenv("BASE_URL", "http://localhost:3000"),
     }
+
+
+def ficha_to_pdf_bytes(context: Dict, wkhtmltopdf_path: str = None, motor: Optional[str] = None) -> bytes:
+
+    context = _sanitize_context(context, max_field_len=int(os.getenv("PDF_MAX_FIELD_LEN", "8000")))
+    qr_size = int(os.getenv('QR_CODE_SIZE', '220'))
+    nome_motor = (motor or PDF_ENGINE).strip().lower()
+
+    inicio = time.perf_counter()
+    chave = None
+    ficha_id = (context.get('ficha') or {}).get('id')
+    cliente_id = (context.get('cliente') or {}).get('id')
+    if PDF_CACHE_ENABLED:
+        chave = chave_pdf(context, extra={"template": TEMPLATE_HASH, "qr_size": qr_size, "local_files": ALLOW_LOCAL_FILE_ACCESS, "motor": nome_motor})
+        cached = pdf_cache.get(chave, ficha_id=ficha_id, cliente_id=cliente_id)
+        if cached:
+            metricas_utils.PDF.observar(time.perf_counter() - inicio, nome_motor, "hit")
+            return cached
+
+    pdf_bytes = _renderizar_pdf(context, qr_size, wkhtmltopdf_path, motor=nome_motor)
+    metricas_utils.PDF.observar(time.perf_counter() - inicio, nome_motor, "miss")
+    if chave:
+        pdf_cache.put(chave, pdf_bytes, ficha_id=ficha_id, cliente_id=cliente_id)
+    return pdf_bytes
+
+
+def _rastreio_url(context: Dict) -> str:
+    codigo = (context.get('ficha') or {}).get('codigo_rastreio', '') or ""
+    base_url = (context.get('base_url') or os.getenv('BASE_URL', 'http://localhost:3000')).rstrip('/')
+    return f"{base_url}/rastreio/{codigo}"
+
+
+#Motores de PDF
+
+class MotorPdf(abc.ABC):
+    nome = ""
+    # renderiza no próprio processo (CPU sob o GIL): com PDF_PROCESSOS vai para o pool
+    em_processo = True
+
+    @abc.abstractmethod
+    def renderizar(self, context: Dict, qr_size: int, wkhtmltopdf_path: str = None) -> bytes:
+        ...
+
+    def aquecer(self) -> None:
+        # chamado uma vez em cada worker do pool, antes do primeiro PDF
+        pass
+
+
+class MotorWkhtmltopdf(MotorPdf):
+    nome = "wkhtmltopdf"
+    # já renderiza num processo externo (um fork por PDF): o pool só somaria IPC
+    em_processo = False
+
+    def renderizar(self, context: Dict, qr_size: int, wkhtmltopdf_path: str = None) -> bytes:
+    
+        wk = wkhtmltopdf_path or os.getenv('WKHTMLTOPDF_PATH') or shutil.which('wkhtmltopdf')
+        if not wk:
+            raise RuntimeError("wkhtmltopdf não encontrado. Defina WKHTMLTOPDF_PATH ou instale wkhtmltopdf no PATH.")
+        if not os.path.isfile(wk):
+            wk = shutil.which(wk) or wk
+        if not os.path.isfile(wk):
+            raise RuntimeError(f"wkhtmltopdf não encontrado no caminho especificado: {wk}")
+
+
+        try:
+            context = dict(context)
+            context['ficha'] = dict(context.get('ficha', {}))
+            # chave usada no template é 'qr_data_uri'
+            context['ficha']['qr_data_uri'] = _generate_qr_data_uri(_rastreio_url(context), size=qr_size)
+        except Exception:
+            # não falhar a geração do PDF por causa do QR
+            logger.exception("Erro ao gerar QR code para PDF")
+            context.setdefault('ficha', {})['qr_data_uri'] = None
+
+        html = render_ficha_html(context)
+        options = {
+            "dpi": "300",
+            "page-size": "A4",
+            "margin-top": "8mm",
+            "margin-bottom": "8mm",
+            "margin-left": "8mm",
+            "margin-right": "8mm",
+            "no-outline": None,
+            "quiet": None,
+            "disable-javascript": None,
+            "no-stop-slow-scripts": None,
+        }
     
-    if ALLOW_LOCAL_FILE_ACCESS:
-        options["enable-local-file-access"] = None
+        if ALLOW_LOCAL_FILE_ACCESS:
+            options["enable-local-file-access"] = None
     
+        try:
+            config = pdfkit.configuration(wkhtmltopdf=wk)
+            pdf_bytes = pdfkit.from_string(html, False, options=options, configuration=config)
+            if not pdf_bytes:
+                raise RuntimeError("wkhtmltopdf retornou resultado vazio. Verifique instalação/WKHTMLTOPDF_PATH.")
+            return pdf_bytes
+        except Exception:
+            logger.exception("Erro ao gerar PDF com wkhtmltopdf")
+            raise RuntimeError("Erro ao gerar PDF. Verifique logs do servidor para mais detalhes.")
+
+
+class MotorReportLab(MotorPdf):
+    # desenha a mesma ficha (via cliente / via admin) direto com ReportLab, sem processo externo
+    nome = "reportlab"
+
+    def aquecer(self) -> None:
+        # importa o ReportLab e carrega as fontes base antes do primeiro PDF do worker
+        self.renderizar({"ficha": {}, "cliente": {}}, 220)
+
+    def renderizar(self, context: Dict, qr_size: int, wkhtmltopdf_path: str = None) -> bytes:
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.units import mm
+        from reportlab.pdfgen import canvas
+
+        ficha = context.get('ficha') or {}
+        cliente = context.get('cliente') or {}
+        url = _rastreio_url(context)
+
+        try:
+            buf = io.BytesIO()
+            c = canvas.Canvas(buf, pagesize=A4, pageCompression=1)
+            c.setTitle(f"Ficha {ficha.get('id', '')}")
+            largura, altura = A4
+            margem = 8 * mm
+            meio = altura / 2
+
+            self._via(c, "Ficha - Cliente", altura - margem, margem, largura - 2 * margem, ficha, cliente, url)
+            self._via(c, "Ficha - Admin", meio - margem, margem, largura - 2 * margem, ficha, cliente, url)
+
+            # linha de corte entre as vias
+            c.setDash(4, 3)
+            c.setStrokeColorRGB(0.73, 0.73, 0.73)
+            c.line(margem, meio, largura - margem, meio)
+            c.setDash()
+
+            c.showPage()
+            c.save()
+            return buf.getvalue()
+        except Exception:
+            logger.exception("Erro ao gerar PDF com ReportLab")
+            raise RuntimeError("Erro ao gerar PDF. Verifique logs do servidor para mais detalhes.")
+
+    def _via(self, c, titulo: str, topo: float, x: float, largura: float, ficha: Dict, cliente: Dict, url: str) -> None:
+        from reportlab.lib.units import mm
+        from reportlab.lib.utils import simpleSplit
+
+        y = topo - 14
+        c.setFillColorRGB(0.07, 0.07, 0.07)
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(x, y, titulo)
+        y -= 20
+        c.setFont("Helvetica-Bold", 16)
+        c.drawString(x, y, f"Código: {ficha.get('codigo_rastreio') or ''}")
+        y -= 20
+
+        endereco = f"{cliente.get('endereco') or '-'} {cliente.get('numero') or ''} {cliente.get('bairro') or ''}".strip()
+        y = self._linhas(c, x, y, largura, [
+            ("Nome", cliente.get('nome') or ''),
+            ("Telefone", cliente.get('telefone') or '-'),
+            ("Endereço", endereco),
+        ])
+
+        c.setStrokeColorRGB(0.87, 0.87, 0.87)
+        c.line(x, y + 4, x + largura, y + 4)
+        y -= 10
+
+        lado_qr = 30 * mm
+        topo_equip = y
+        y = self._linhas(c, x, y, largura - lado_qr - 6 * mm, [
+            ("Categoria", ficha.get('categoria') or '-'),
+            ("Marca", ficha.get('marca') or '-'),
+            ("Modelo", ficha.get('modelo') or '-'),
+            ("Serial", ficha.get('serial') or '-'),
+            ("Defeito", ficha.get('defeito') or ficha.get('descricao') or '-'),
+            ("Acessórios", ficha.get('acessorios') or '-'),
+        ])
+
+        try:
+            qr_x = x + largura - lado_qr
+            self._qr(c, url, qr_x, topo_equip - lado_qr + 8, lado_qr)
+            c.setFont("Helvetica", 8)
+            c.setFillColorRGB(0.33, 0.33, 0.33)
+            c.drawCentredString(qr_x + lado_qr / 2, topo_equip - lado_qr - 2, "Escaneie para ver rastreio")
+        except Exception:
+            # não falhar a geração do PDF por causa do QR
+            logger.exception("Erro ao gerar QR code para PDF")
+        y = min(y, topo_equip - lado_qr - 10)
+
+        c.setFont("Helvetica", 9)
+        c.setFillColorRGB(0.27, 0.27, 0.27)
+        for linha in simpleSplit(f"Imprimir e entregar ao cliente. Consulte em: {url}", "Helvetica", 9, largura):
+            y -= 11
+            c.drawString(x, y, linha)
+
+    def _qr(self, c, texto: str, x: float, y: float, lado: float) -> None:
+        # desenha a matriz do QR em vetor, juntando módulos escuros consecutivos de cada linha
+        qr = qrcode.QRCode(border=1)
+        qr.add_data(texto)
+        qr.make(fit=True)
+        matriz = qr.get_matrix()
+        passo = lado / len(matriz)
+        c.setFillColorRGB(0, 0, 0)
+        for i, linha in enumerate(matriz):
+            topo = y + lado - (i + 1) * passo
+            j = 0
+            while j < len(linha):
+                if not linha[j]:
+                    j += 1
+                    continue
+                inicio = j
+                while j < len(linha) and linha[j]:
+                    j += 1
+                c.rect(x + inicio * passo, topo, (j - inicio) * passo, passo, stroke=0, fill=1)
+
+    def _linhas(self, c, x: float, y: float, largura: float, campos) -> float:
+        from reportlab.lib.units import mm
+        from reportlab.lib.utils import simpleSplit
+
+        largura_label = 30 * mm
+        for label, valor in campos:
+            c.setFillColorRGB(0.27, 0.27, 0.27)
+            c.setFont("Helvetica-Bold", 10)
+            c.drawString(x, y, label)
+            c.setFillColorRGB(0.07, 0.07, 0.07)
+            c.setFont("Helvetica", 10)
+            linhas = simpleSplit(str(valor), "Helvetica", 10, largura - largura_label) or [""]
+            for linha in linhas[:6]:
+                c.drawString(x + largura_label, y, linha)
+                y -= 13
+            y -= 3
+        return y
+
+
+MOTORES = {
+    MotorWkhtmltopdf.nome: MotorWkhtmltopdf,
+    MotorReportLab.nome: MotorReportLab,
+}
+
+_motores: Dict[str, MotorPdf] = {}
+
+
+def obter_motor(nome: Optional[str] = None) -> MotorPdf:
+    nome = (nome or PDF_ENGINE).strip().lower()
+    if nome not in MOTORES:
+        raise RuntimeError(f"Motor de PDF desconhecido: {nome}. Use um de: {', '.join(MOTORES)}")
+    if nome not in _motores:
+        _motores[nome] = MOTORES[nome]()
+    return _motores[nome]
+
+
+#Limite de concorrência / pool
+
+_vagas = threading.BoundedSemaphore(PDF_MAX_CONCORRENCIA)
+_fila_lock = threading.Lock()
+_aguardando = 0
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _iniciar_worker(nome: str) -> None:
+    # o worker vive enquanto o pool existir: o motor criado e aquecido aqui é reaproveitado
     try:
-        config = pdfkit.configuration(wkhtmltopdf=wk)
-        pdf_bytes = pdfkit.from_string(html, False, options=options, configuration=config)
-        if not pdf_bytes:
-            raise RuntimeError("wkhtmltopdf retornou resultado vazio. Verifique instalação/WKHTMLTOPDF_PATH.")
-        return pdf_bytes
+        obter_motor(nome).aquecer()
     except Exception:
-        logger.exception("Erro ao gerar PDF com wkhtmltopdf")
-        raise RuntimeError("Erro ao gerar PDF. Verifique logs do servidor para mais detalhes.")
-       
\ No newline at end of file
+        logger.exception("Erro ao aquecer o motor de PDF %s no worker", nome)
+
+
+def _renderizar_no_worker(nome: str, context: Dict, qr_size: int, wkhtmltopdf_path: str = None) -> bytes:
+    # roda dentro do processo do pool; o motor fica em cache no worker
+    return obter_motor(nome).renderizar(context, qr_size, wkhtmltopdf_path)
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _executor
+    with _fila_lock:
+        if _executor is None:
+            # spawn: fork de um processo com threads (uvicorn, despachante) pode herdar locks presos
+            _executor = ProcessPoolExecutor(
+                max_workers=PDF_PROCESSOS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_iniciar_worker,
+                initargs=(PDF_ENGINE,),
+            )
+        return _executor
+
+
+def _renderizar_pdf(context: Dict, qr_size: int, wkhtmltopdf_path: str = None, motor: Optional[str] = None) -> bytes:
+    global _aguardando
+    nome = (motor or PDF_ENGINE).strip().lower()
+
+    # backpressure: fila limitada e espera com timeout por uma vaga
+    if not _vagas.acquire(blocking=False):
+        with _fila_lock:
+            if _aguardando >= PDF_FILA_MAX:
+                raise PdfSobrecarregado("Muitos PDFs em geração. Tente novamente em instantes.")
+            _aguardando += 1
+        try:
+            conseguiu = _vagas.acquire(timeout=PDF_FILA_TIMEOUT)
+        finally:
+            with _fila_lock:
+                _aguardando -= 1
+        if not conseguiu:
+            raise PdfSobrecarregado("Muitos PDFs em geração. Tente novamente em instantes.")
+    liberar = True
+    try:
+        motor_pdf = obter_motor(nome)
+        if PDF_PROCESSOS > 0 and motor_pdf.em_processo:
+            futuro = _pool().submit(_renderizar_no_worker, nome, context, qr_size, wkhtmltopdf_path)
+            # a vaga volta quando o worker termina, não quando desistimos de esperar:
+            # um PDF travado continua ocupando a vaga e o pool não acumula trabalho
+            futuro.add_done_callback(lambda _: _vagas.release())
+            liberar = False
+            try:
+                return futuro.result(timeout=PDF_RENDER_TIMEOUT)
+            except FuturesTimeout:
+                futuro.cancel()
+                raise PdfSobrecarregado("Geração do PDF demorou demais. Tente novamente em instantes.")
+        return motor_pdf.renderizar(context, qr_size, wkhtmltopdf_path)
+    finally:
+        if liberar:
+            _vagas.release()
+
+
+#Lote
+
+def renderizar_lote(contextos: List[Dict], wkhtmltopdf_path: str = None, motor: Optional[str] = None,
+                    workers: Optional[int] = None) -> Iterator[Tuple[Dict, Union[bytes, Exception]]]:
+    # renderiza em paralelo (limitado) e devolve na ordem de entrada, conforme ficam prontos.
+    # Janela deslizante: no máximo `n` PDFs em andamento ou prontos esperando o consumidor
+    # (ex.map submeteria o lote inteiro de uma vez). Fechar o gerador (cliente desconectou)
+    # cancela o que ainda não começou.
+    def _um(context: Dict):
+        for tentativa in range(1, PDF_LOTE_TENTATIVAS + 1):
+            try:
+                return ficha_to_pdf_bytes(context, wkhtmltopdf_path=wkhtmltopdf_path, motor=motor)
+            except PdfSobrecarregado as e:
+                if tentativa == PDF_LOTE_TENTATIVAS:
+                    return e
+                time.sleep(0.5 * tentativa)
+            except Exception as e:
+                logger.warning("Falha ao gerar PDF da ficha %s no lote: %s", (context.get('ficha') or {}).get('id'), e)
+                return e
+
+    n = max(1, min(workers or PDF_LOTE_WORKERS, PDF_MAX_CONCORRENCIA))
+    restantes = iter(contextos)
+    pendentes: deque = deque()
+    ex = ThreadPoolExecutor(max_workers=n)
+    try:
+        for context in itertools.islice(restantes, n):
+            pendentes.append((context, ex.submit(_um, context)))
+        while pendentes:
+            context, futuro = pendentes.popleft()
+            resultado = futuro.result()
+            proximo = next(restantes, None)
+            if proximo is not None:
+                pendentes.append((proximo, ex.submit(_um, proximo)))
+            yield context, resultado
+    finally:
+        for _, futuro in pendentes:
+            futuro.cancel()
+        ex.shutdown(wait=False)
+
+
+class _Pedacos(io.RawIOBase):
+    # destino não-seekable para o zipfile: acumula bytes até serem drenados pelo stream
+    def __init__(self):
+        self._buf = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._buf += b
+        return len(b)
+
+    def drenar(self) -> bytes:
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+
+def zip_stream(itens: Iterable[Tuple[str, bytes]]) -> Iterator[bytes]:
+    destino = _Pedacos()
+    # PDFs já são comprimidos: ZIP_STORED evita gastar CPU à toa
+    with zipfile.ZipFile(destino, "w", compression=zipfile.ZIP_STORED) as zf:
+        for nome, data in itens:
+            zf.writestr(nome, data)
+            pedaco = destino.drenar()
+            if pedaco:
+                yield pedaco
+    pedaco = destino.drenar()
+    if pedaco:
+        yield pedaco
+
+
+def mesclar_pdfs(pdfs: Iterable[bytes]):
+    from pypdf import PdfReader, PdfWriter
+
+    writer = PdfWriter()
+    for data in pdfs:
+        for pagina in PdfReader(io.BytesIO(data)).pages:
+            writer.add_page(pagina)
+    # acima de 8MB o arquivo vai para o disco
+    saida = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    writer.write(saida)
+    saida.seek(0)
+    return saida
+
+
+def ler_em_pedacos(arquivo, tamanho: int = 64 * 1024) -> Iterator[bytes]:
+    try:
+        while True:
+            pedaco = arquivo.read(tamanho)
+            if not pedaco:
+                break
+            yield pedaco
+    finally:
+        arquivo.close()
@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from . import auth
+
+
+logger = logging.getLogger(__name__)
+
+
+RASTREIO_CACHE_TTL = int(os.getenv("RASTREIO_CACHE_TTL", "30"))  # em segundos
+RASTREIO_CACHE_MAX = int(os.getenv("RASTREIO_CACHE_MAX", "10000"))
+# sem Redis o cache é a memória de cada processo e invalidar() só limpa a do worker que
+# gravou a mudança: os outros serviriam o status antigo por até RASTREIO_CACHE_TTL.
+# Por isso, com mais de um worker (WEB_CONCURRENCY, o mesmo que o uvicorn lê) e sem
+# Redis, o cache em memória fica desligado e toda consulta vai ao banco.
+WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+# campos da resposta pública; mudança em qualquer um invalida a entrada
+CAMPOS_RASTREIO = {"codigo_rastreio", "status", "defeito", "previsao_entrega", "observacao_publica", "data_criacao"}
+
+
+def calcular_etag(payload: Dict) -> str:
+    raw = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return 'W/"' + hashlib.sha1(raw).hexdigest()[:20] + '"'
+
+
+class _LRUComTTL:
+    # fallback em memória (por processo) quando não há Redis
+
+    def __init__(self, max_itens: int, ttl: int):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._dados: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, k: str) -> Optional[str]:
+        with self._lock:
+            item = self._dados.get(k)
+            if item is None:
+                return None
+            expira, valor = item
+            if expira < time.monotonic():
+                del self._dados[k]
+                return None
+            self._dados.move_to_end(k)
+            return valor
+
+    def setex(self, k: str, ttl: int, valor: str) -> None:
+        with self._lock:
+            self._dados[k] = (time.monotonic() + ttl, valor)
+            self._dados.move_to_end(k)
+            while len(self._dados) > self.max_itens:
+                self._dados.popitem(last=False)
+
+    def delete(self, k: str) -> None:
+        with self._lock:
+            self._dados.pop(k, None)
+
+
+_local = _LRUComTTL(RASTREIO_CACHE_MAX, RASTREIO_CACHE_TTL)
+
+
+def _backend():
+    if auth.REDIS_DISPONIVEL:
+        return auth.redis_client
+    return _local if WORKERS == 1 else None
+
+
+def _chave(codigo: str) -> str:
+    return f"rastreio:{(codigo or '').strip()}"
+
+
+def obter(codigo: str) -> Optional[Dict]:
+    backend = _backend()
+    if RASTREIO_CACHE_TTL <= 0 or backend is None:
+        return None
+    try:
+        raw = backend.get(_chave(codigo))
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        logger.warning("Erro ao ler cache de rastreio: %s", e)
+        return None
+
+
+def salvar(codigo: str, payload: Dict) -> Dict:
+    # devolve {"etag": ..., "payload": ...} para a resposta
+    entrada = {"etag": calcular_etag(payload), "payload": payload}
+    backend = _backend()
+    if RASTREIO_CACHE_TTL > 0 and backend is not None:
+        try:
+            backend.setex(_chave(codigo), RASTREIO_CACHE_TTL, json.dumps(entrada, default=str))
+        except Exception as e:
+            logger.warning("Erro ao gravar cache de rastreio: %s", e)
+    return entrada
+
+
+def invalidar(*codigos: str) -> None:
+    backend = _backend()
+    if backend is None:
+        return
+    for codigo in codigos:
+        if not codigo:
+            continue
+        try:
+            backend.delete(_chave(codigo))
+        except Exception as e:
+            logger.warning("Erro ao invalidar cache de rastreio: %s", e)
+
+
+def invalidar_se_mudou(codigos, campos) -> None:
+    if set(campos) & CAMPOS_RASTREIO:
+        invalidar(*codigos)
@@ -1,8 +1,10 @@
 from enum import Enum
-from pydantic import BaseModel, EmailStr, constr, validator
-from typing import Optional
+from pydantic import BaseModel, EmailStr, conlist, constr, validator
+from typing import Optional, List, Dict, Any
 from datetime import datetime
+import os
 import re
+from .pdf_utils import PDF_LOTE_MAX
 
 class StatusEnum(str, Enum):
     ABERTA = "ABERTA"
@@ -35,6 +37,10 @@ class AdminLogin(BaseModel):
     class Config:
         orm_mode = True
 
+
+class TokenRefresh(BaseModel):
+    refresh_token: str
+
 # Cliente
 class ClienteBase(BaseModel):
     nome: constr(strip_whitespace=True, min_length=1, max_length=255)
@@ -102,6 +108,7 @@ class FichaOut(FichaBase):
     data_criacao: datetime
     observacao_publica: Optional[str] = None
     observacao_privada: Optional[str] = None
+    versao: Optional[int] = None
     cliente: ClienteOut
     
     class Config:
@@ -122,10 +129,41 @@ class FichaUpdate(BaseModel):
     valor: Optional[float] = None
     defeito: Optional[str] = None
     acessorios: Optional[str] = None
+    # versão lida pelo cliente; se a ficha mudou desde então a edição é recusada (409)
+    versao: Optional[int] = None
     class Config:
         orm_mode = True
         use_enum_values = True
 
+class FormatoLoteEnum(str, Enum):
+    PDF = "pdf"
+    ZIP = "zip"
+
+class FormatoExportEnum(str, Enum):
+    CSV = "csv"
+    XLSX = "xlsx"
+
+# máximo de fichas por PATCH /fichas/bulk
+LOTE_ATUALIZACAO_MAX = max(1, int(os.getenv("LOTE_ATUALIZACAO_MAX", "500")))
+
+class FichaPdfLote(BaseModel):
+    # ids explícitos ou os mesmos filtros de GET /fichas; lista acima do teto é 422
+    ids: Optional[conlist(int, max_items=PDF_LOTE_MAX)] = None
+    q: Optional[str] = ""
+    status: Optional[str] = ""
+    data_ini: Optional[str] = ""
+    data_fim: Optional[str] = ""
+    formato: FormatoLoteEnum = FormatoLoteEnum.PDF
+
+class FichaLoteUpdate(BaseModel):
+    # ids explícitos ou os mesmos filtros de GET /fichas; lista acima do teto é 422
+    ids: Optional[conlist(int, max_items=LOTE_ATUALIZACAO_MAX)] = None
+    q: Optional[str] = ""
+    status: Optional[str] = ""
+    data_ini: Optional[str] = ""
+    data_fim: Optional[str] = ""
+    dados: FichaUpdate
+
 # Log
 class LogBase(BaseModel):
     status: Optional[str] = ""
@@ -138,6 +176,7 @@ class LogOut(LogBase):
     id: int
     data: datetime
     ficha_id: int
+    mudancas: Optional[Dict[str, Any]] = None
     
     class Config:
         orm_mode = True
\ No newline at end of file
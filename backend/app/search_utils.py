@@ -0,0 +1,141 @@
+from typing import Dict, List
+from sqlalchemy import text, func, or_, select, union, union_all, literal_column
+from sqlalchemy.orm import Session
+from . import models
+from .consultas_utils import ignorar_queries
+
+
+# colunas pesquisáveis pela caixa de busca (tabela -> colunas); índices na migração 0003
+COLUNAS_BUSCA: Dict[str, List[str]] = {
+    "fichas": ["codigo_rastreio", "marca", "modelo"],
+    "clientes": ["nome", "telefone"],
+}
+
+# trigramas só ajudam a partir de 3 caracteres; abaixo disso usa ILIKE puro
+MIN_TERMO_TRIGRAMA = 3
+
+_fts_por_engine: Dict[str, bool] = {}
+
+
+def _fts_disponivel(db: Session) -> bool:
+    bind = db.get_bind()
+    chave = str(bind.url)
+    if chave not in _fts_por_engine:
+        try:
+            nomes = {f"{t}_fts" for t in COLUNAS_BUSCA}
+            # sondagem única por engine: fora do orçamento de queries da requisição
+            with ignorar_queries():
+                rows = db.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars().all()
+            _fts_por_engine[chave] = nomes.issubset(set(rows))
+        except Exception:
+            _fts_por_engine[chave] = False
+    return _fts_por_engine[chave]
+
+
+def _frase_fts(termo: str) -> str:
+    # termo como frase literal do FTS5 (sem operadores)
+    return '"' + termo.replace('"', '""') + '"'
+
+
+def _match_fts(tabela: str, termo: str):
+    fts = f"{tabela}_fts"
+    return (
+        select(literal_column("rowid").label("id"), literal_column(f"bm25({fts})").label("rank"))
+        .select_from(text(fts))
+        .where(text(f"{fts} MATCH :termo_{tabela}").bindparams(**{f"termo_{tabela}": _frase_fts(termo)}))
+    )
+
+
+def _usar_fts(db: Session, termo: str) -> bool:
+    return (
+        db.get_bind().dialect.name == "sqlite"
+        and len(termo) >= MIN_TERMO_TRIGRAMA
+        and _fts_disponivel(db)
+    )
+
+
+def filtrar_fichas(db: Session, query, termo: str, ranquear: bool = True):
+    # a query precisa já ter o join com clientes (models.Cliente)
+    termo = (termo or "").strip()
+    if not termo:
+        return query
+    dialeto = db.get_bind().dialect.name
+
+    if _usar_fts(db, termo):
+        # ids das fichas que casam por conta própria ou pelo cliente, com o melhor rank;
+        # o join interno deixa o SQLite partir dos acertos do FTS (outer join + OR varria
+        # o resultado materializado uma vez por ficha)
+        clientes = _match_fts("clientes", termo).subquery()
+        acertos = union_all(
+            _match_fts("fichas", termo),
+            select(models.Ficha.id, clientes.c.rank).join(clientes, clientes.c.id == models.Ficha.cliente_id),
+        ).subquery()
+        ranking = select(acertos.c.id, func.min(acertos.c.rank).label("rank")).group_by(acertos.c.id).subquery()
+        query = query.join(ranking, ranking.c.id == models.Ficha.id)
+        if ranquear:
+            # bm25 é negativo: menor = mais relevante
+            query = query.order_by(ranking.c.rank.asc())
+        return query
+
+    like = f"%{termo}%"
+    if dialeto == "postgresql":
+        # OR entre colunas de fichas e clientes impede o planner de usar os índices GIN
+        # (vira seq scan do join); a UNION casa cada tabela pelo seu índice e junta os ids
+        ids = union(
+            select(models.Ficha.id).where(
+                or_(
+                    models.Ficha.codigo_rastreio.ilike(like),
+                    models.Ficha.marca.ilike(like),
+                    models.Ficha.modelo.ilike(like),
+                )
+            ),
+            select(models.Ficha.id)
+            .join(models.Cliente, models.Ficha.cliente_id == models.Cliente.id)
+            .where(models.Cliente.nome.ilike(like)),
+        )
+        query = query.filter(models.Ficha.id.in_(ids))
+    else:
+        query = query.filter(
+            or_(
+                models.Ficha.codigo_rastreio.ilike(like),
+                models.Cliente.nome.ilike(like),
+                models.Ficha.marca.ilike(like),
+                models.Ficha.modelo.ilike(like),
+            )
+        )
+    if ranquear and dialeto == "postgresql":
+        # ILIKE usa os índices GIN (gin_trgm_ops); a similaridade ordena o resultado
+        query = query.order_by(
+            func.greatest(
+                func.word_similarity(termo, models.Ficha.codigo_rastreio),
+                func.word_similarity(termo, models.Cliente.nome),
+                func.word_similarity(termo, models.Ficha.marca),
+                func.word_similarity(termo, models.Ficha.modelo),
+            ).desc()
+        )
+    return query
+
+
+def filtrar_clientes(db: Session, query, termo: str, ranquear: bool = True):
+    termo = (termo or "").strip()
+    if not termo:
+        return query
+    dialeto = db.get_bind().dialect.name
+
+    if _usar_fts(db, termo):
+        clientes = _match_fts("clientes", termo).subquery()
+        query = query.join(clientes, clientes.c.id == models.Cliente.id)
+        if ranquear:
+            query = query.order_by(clientes.c.rank.asc())
+        return query
+
+    like = f"%{termo}%"
+    query = query.filter(or_(models.Cliente.nome.ilike(like), models.Cliente.telefone.ilike(like)))
+    if ranquear and dialeto == "postgresql":
+        query = query.order_by(
+            func.greatest(
+                func.word_similarity(termo, models.Cliente.nome),
+                func.word_similarity(termo, models.Cliente.telefone),
+            ).desc()
+        )
+    return query
@@ -0,0 +1,95 @@
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from typing import Optional, Tuple
+
+import bcrypt as _bcrypt
+from passlib.context import CryptContext
+
+
+logger = logging.getLogger(__name__)
+
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# min_rounds faz needs_update() apontar hashes com custo abaixo do atual
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS)
+
+# processos dedicados ao bcrypt (0 = verifica na própria thread da requisição)
+SENHA_PROCESSOS = max(0, int(os.getenv("SENHA_PROCESSOS", "2")))
+# verificações em andamento + na fila; acima disso o login responde 503
+SENHA_FILA_MAX = max(1, int(os.getenv("SENHA_FILA_MAX", "32")))
+SENHA_TIMEOUT = float(os.getenv("SENHA_TIMEOUT", "10"))
+
+
+class VerificacaoSobrecarregada(RuntimeError):
+    pass
+
+
+def _verificar(password: str, stored: str) -> Tuple[bool, Optional[str]]:
+    # caminho único: bcrypt trunca em 72 bytes, então truncamos antes (bcrypt>=4.1 recusa senhas maiores)
+    pw = (password or "").encode("utf-8")[:72]
+    try:
+        ok = _bcrypt.checkpw(pw, (stored or "").encode("utf-8"))
+    except ValueError:
+        # hash inválido/corrompido
+        return False, None
+    if not ok:
+        return False, None
+    novo_hash = None
+    try:
+        if pwd_context.needs_update(stored):
+            novo_hash = _bcrypt.hashpw(pw, _bcrypt.gensalt(BCRYPT_ROUNDS)).decode("ascii")
+    except Exception:
+        logger.warning("Falha ao checar necessidade de rehash (não crítico)")
+    return True, novo_hash
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+_em_andamento = 0
+
+
+def _pool() -> ProcessPoolExecutor:
+    # chamado com _lock
+    global _executor
+    if _executor is None:
+        # spawn: fork de um processo com threads (uvicorn, despachante) pode herdar locks presos
+        _executor = ProcessPoolExecutor(max_workers=SENHA_PROCESSOS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def _liberar(_futuro=None) -> None:
+    global _em_andamento
+    with _lock:
+        _em_andamento -= 1
+
+
+def verificar_senha(password: str, stored: str) -> Tuple[bool, Optional[str]]:
+    # devolve (senha_ok, novo_hash_ou_None)
+    global _em_andamento
+    with _lock:
+        if _em_andamento >= SENHA_FILA_MAX:
+            raise VerificacaoSobrecarregada("Muitas tentativas de login simultâneas. Tente novamente em instantes.")
+        _em_andamento += 1
+    if SENHA_PROCESSOS <= 0:
+        try:
+            return _verificar(password, stored)
+        finally:
+            _liberar()
+    try:
+        with _lock:
+            futuro = _pool().submit(_verificar, password, stored)
+    except Exception:
+        _liberar()
+        raise
+    # a vaga só volta quando o worker termina: um timeout não abre espaço para mais
+    # trabalho enquanto o bcrypt anterior ainda ocupa o processo
+    futuro.add_done_callback(_liberar)
+    try:
+        return futuro.result(timeout=SENHA_TIMEOUT)
+    except FuturesTimeout:
+        futuro.cancel()
+        raise VerificacaoSobrecarregada("Verificação de senha demorou demais. Tente novamente em instantes.")
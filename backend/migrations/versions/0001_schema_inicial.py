@@ -0,0 +1,95 @@
+"""schema inicial
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+
+Bancos criados antes das migrações (via Base.metadata.create_all) já têm
+este schema: rode `alembic stamp 0001` antes do primeiro `alembic upgrade head`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "admins",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("email", sa.String(255), nullable=False),
+        sa.Column("hashed_password", sa.String(255), nullable=False),
+        sa.Column("criado_em", sa.DateTime(), nullable=False),
+        sa.Column("foto_perfil", sa.String(512), nullable=True),
+    )
+    op.create_index("ix_admins_id", "admins", ["id"])
+    op.create_index("ix_admins_email", "admins", ["email"], unique=True)
+
+    op.create_table(
+        "clientes",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("nome", sa.String(255), nullable=False),
+        sa.Column("telefone", sa.String(64), nullable=False),
+        sa.Column("email", sa.String(255)),
+        sa.Column("endereco", sa.String(512)),
+        sa.Column("numero", sa.String(64)),
+        sa.Column("bairro", sa.String(255)),
+        sa.Column("criado_em", sa.DateTime(), nullable=False),
+        sa.Column("admin_id", sa.Integer(), sa.ForeignKey("admins.id", ondelete="SET NULL"), nullable=True),
+    )
+    op.create_index("ix_clientes_id", "clientes", ["id"])
+    op.create_index("ix_clientes_admin_id", "clientes", ["admin_id"])
+
+    op.create_table(
+        "fichas",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("descricao", sa.Text(), nullable=False),
+        sa.Column("status", sa.String(64)),
+        sa.Column("categoria", sa.String(128), nullable=False),
+        sa.Column("marca", sa.String(128), nullable=False),
+        sa.Column("modelo", sa.String(128), nullable=False),
+        sa.Column("serial", sa.String(128), nullable=True),
+        sa.Column("codigo_rastreio", sa.String(128), nullable=False),
+        sa.Column("data_criacao", sa.DateTime()),
+        sa.Column("observacao_publica", sa.Text()),
+        sa.Column("observacao_privada", sa.Text()),
+        sa.Column("defeito", sa.Text(), nullable=False),
+        sa.Column("acessorios", sa.Text(), nullable=True),
+        sa.Column("previsao_entrega", sa.String(128), nullable=True),
+        sa.Column("valor", sa.Float(), nullable=True),
+        sa.Column("cliente_id", sa.Integer(), sa.ForeignKey("clientes.id", ondelete="CASCADE"), nullable=False),
+    )
+    op.create_index("ix_fichas_id", "fichas", ["id"])
+    op.create_index("ix_fichas_codigo_rastreio", "fichas", ["codigo_rastreio"], unique=True)
+
+    op.create_table(
+        "logs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("status", sa.String(128), nullable=False),
+        sa.Column("descricao", sa.Text(), nullable=True),
+        sa.Column("data", sa.DateTime(), nullable=False),
+        sa.Column("ficha_id", sa.Integer(), sa.ForeignKey("fichas.id", ondelete="CASCADE"), nullable=False),
+    )
+    op.create_index("ix_logs_id", "logs", ["id"])
+
+    op.create_table(
+        "logs_acesso",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("admin_id", sa.Integer(), nullable=False),
+        sa.Column("acao", sa.String(128), nullable=False),
+        sa.Column("detalhe", sa.String(1024), nullable=True),
+        sa.Column("data", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_logs_acesso_id", "logs_acesso", ["id"])
+
+
+def downgrade() -> None:
+    op.drop_table("logs_acesso")
+    op.drop_table("logs")
+    op.drop_table("fichas")
+    op.drop_table("clientes")
+    op.drop_table("admins")
@@ -0,0 +1,39 @@
+"""índices compostos para os filtros mais usados
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # listagem de clientes do admin ordenada por id desc
+    op.create_index("ix_clientes_admin_id_id", "clientes", ["admin_id", sa.text("id DESC")])
+    # fichas do cliente (join de dono) ordenadas por id desc / janela por data
+    op.create_index("ix_fichas_cliente_id_id", "fichas", ["cliente_id", sa.text("id DESC")])
+    op.create_index("ix_fichas_cliente_id_data_criacao", "fichas", ["cliente_id", "data_criacao"])
+    op.create_index("ix_fichas_status", "fichas", ["status"])
+    op.create_index("ix_fichas_data_criacao", "fichas", ["data_criacao"])
+    # histórico da ficha ordenado por data desc
+    op.create_index("ix_logs_ficha_id_data", "logs", ["ficha_id", sa.text("data DESC")])
+    # logs de acesso do admin ordenados por id desc
+    op.create_index("ix_logs_acesso_admin_id_id", "logs_acesso", ["admin_id", sa.text("id DESC")])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_logs_acesso_admin_id_id", table_name="logs_acesso")
+    op.drop_index("ix_logs_ficha_id_data", table_name="logs")
+    op.drop_index("ix_fichas_data_criacao", table_name="fichas")
+    op.drop_index("ix_fichas_status", table_name="fichas")
+    op.drop_index("ix_fichas_cliente_id_data_criacao", table_name="fichas")
+    op.drop_index("ix_fichas_cliente_id_id", table_name="fichas")
+    op.drop_index("ix_clientes_admin_id_id", table_name="clientes")
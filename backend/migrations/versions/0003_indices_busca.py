@@ -0,0 +1,75 @@
+"""índices de busca (pg_trgm no Postgres, FTS5 no SQLite)
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+# DDL congelada nesta revisão (não importa o app: mudanças futuras na busca viram nova migração)
+COLUNAS = {
+    "fichas": ["codigo_rastreio", "marca", "modelo"],
+    "clientes": ["nome", "telefone"],
+}
+
+
+def _ddl_postgres():
+    stmts = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"]
+    for tabela, colunas in COLUNAS.items():
+        for col in colunas:
+            stmts.append(f"CREATE INDEX IF NOT EXISTS ix_{tabela}_{col}_trgm ON {tabela} USING gin ({col} gin_trgm_ops)")
+    return stmts
+
+
+def _ddl_sqlite():
+    stmts = []
+    for tabela, colunas in COLUNAS.items():
+        fts = f"{tabela}_fts"
+        cols = ", ".join(colunas)
+        new_cols = ", ".join(f"new.{c}" for c in colunas)
+        old_cols = ", ".join(f"old.{c}" for c in colunas)
+        stmts += [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{tabela}', content_rowid='id', tokenize='trigram')",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {tabela} BEGIN "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {tabela} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {tabela} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END",
+            f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+        ]
+    return stmts
+
+
+def upgrade() -> None:
+    dialeto = op.get_bind().dialect.name
+    if dialeto == "postgresql":
+        stmts = _ddl_postgres()
+    elif dialeto == "sqlite":
+        stmts = _ddl_sqlite()
+    else:
+        stmts = []
+    for stmt in stmts:
+        op.execute(stmt)
+
+
+def downgrade() -> None:
+    dialeto = op.get_bind().dialect.name
+    for tabela, colunas in COLUNAS.items():
+        if dialeto == "postgresql":
+            for col in colunas:
+                op.execute(f"DROP INDEX IF EXISTS ix_{tabela}_{col}_trgm")
+        elif dialeto == "sqlite":
+            fts = f"{tabela}_fts"
+            for sufixo in ("ai", "ad", "au"):
+                op.execute(f"DROP TRIGGER IF EXISTS {fts}_{sufixo}")
+            op.execute(f"DROP TABLE IF EXISTS {fts}")
@@ -0,0 +1,40 @@
+"""fila persistente de emails (outbox)
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "emails_outbox",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("destinatarios", sa.Text(), nullable=False),
+        sa.Column("assunto", sa.String(length=512), nullable=False),
+        sa.Column("corpo", sa.Text(), nullable=False),
+        sa.Column("status", sa.String(length=32), nullable=False),
+        sa.Column("tentativas", sa.Integer(), nullable=False),
+        sa.Column("proxima_tentativa", sa.DateTime(), nullable=False),
+        sa.Column("ultimo_erro", sa.Text(), nullable=True),
+        sa.Column("criado_em", sa.DateTime(), nullable=False),
+        sa.Column("enviado_em", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_emails_outbox_id", "emails_outbox", ["id"])
+    op.create_index("ix_emails_outbox_status_proxima", "emails_outbox", ["status", "proxima_tentativa"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_emails_outbox_status_proxima", table_name="emails_outbox")
+    op.drop_index("ix_emails_outbox_id", table_name="emails_outbox")
+    op.drop_table("emails_outbox")
@@ -0,0 +1,25 @@
+"""chave de agrupamento na outbox de emails
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("emails_outbox", sa.Column("chave", sa.String(length=128), nullable=True))
+    op.create_index("ix_emails_outbox_chave_status", "emails_outbox", ["chave", "status"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_emails_outbox_chave_status", table_name="emails_outbox")
+    op.drop_column("emails_outbox", "chave")
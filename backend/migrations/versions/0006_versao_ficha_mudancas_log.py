@@ -0,0 +1,26 @@
+"""versão da ficha (concorrência otimista) e diff em JSON no histórico
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("fichas", sa.Column("versao", sa.Integer(), nullable=False, server_default="1"))
+    op.add_column("logs", sa.Column("mudancas", sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    # DROP COLUMN direto (sem recriar a tabela) preserva os triggers de busca do SQLite
+    op.drop_column("logs", "mudancas")
+    op.drop_column("fichas", "versao")
@@ -0,0 +1,30 @@
+"""refresh tokens já usados (uso único persistente, vale entre workers)
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "refresh_usados",
+        sa.Column("jti", sa.String(length=64), nullable=False),
+        sa.Column("expira_em", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("jti"),
+    )
+    op.create_index("ix_refresh_usados_expira_em", "refresh_usados", ["expira_em"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_refresh_usados_expira_em", table_name="refresh_usados")
+    op.drop_table("refresh_usados")
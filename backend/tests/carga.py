@@ -0,0 +1,77 @@
+# Teste de carga simples: N clientes concorrentes batendo numa rota por alguns segundos.
+#
+# Contra um servidor rodando (uvicorn app.main:app):
+#
+#     python tests/carga.py --url http://localhost:8000 --token <jwt> --rotas /fichas /clientes
+#
+# Mostra requisições/s, p50/p95 e erros para 50, 200 e 1000 clientes (--clientes muda).
+# O gerador de carga é um processo Python só: em 1000 clientes ele mesmo passa a pesar,
+# então compare rotas e builds entre si, não com números absolutos de outras ferramentas.
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+
+async def medir(url: str, rota: str, clientes: int, duracao: float = 5.0, headers: Optional[Dict] = None) -> Dict:
+    latencias: List[float] = []
+    erros = 0
+    limites = httpx.Limits(max_connections=clientes, max_keepalive_connections=clientes)
+    async with httpx.AsyncClient(base_url=url, headers=headers or {}, limits=limites, timeout=60) as http:
+        fim = time.perf_counter() + duracao
+
+        async def _cliente():
+            nonlocal erros
+            while time.perf_counter() < fim:
+                inicio = time.perf_counter()
+                try:
+                    r = await http.get(rota)
+                    ok = r.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencias.append(time.perf_counter() - inicio)
+                else:
+                    erros += 1
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(_cliente() for _ in range(clientes)))
+        total = time.perf_counter() - inicio
+
+    ordenadas = sorted(latencias)
+    return {
+        "rota": rota,
+        "clientes": clientes,
+        "rps": len(latencias) / total,
+        "p50_ms": statistics.median(ordenadas) * 1000 if ordenadas else None,
+        "p95_ms": ordenadas[int(len(ordenadas) * 0.95) - 1] * 1000 if ordenadas else None,
+        "erros": erros,
+    }
+
+
+def formatar(resultado: Dict) -> str:
+    p50 = f"{resultado['p50_ms']:.0f}" if resultado["p50_ms"] is not None else "-"
+    p95 = f"{resultado['p95_ms']:.0f}" if resultado["p95_ms"] is not None else "-"
+    return (f"{resultado['rota']:<32} {resultado['clientes']:>5} clientes  {resultado['rps']:>8.1f} req/s  "
+            f"p50 {p50:>6}ms  p95 {p95:>6}ms  erros {resultado['erros']}")
+
+
+async def _principal(args) -> None:
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    for rota in args.rotas:
+        for clientes in args.clientes:
+            print(formatar(await medir(args.url, rota, clientes, args.duracao, headers)), flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Requisições/s por rota com N clientes concorrentes.")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", default="")
+    parser.add_argument("--rotas", nargs="+", default=["/fichas", "/clientes", "/minhas-fichas"])
+    parser.add_argument("--clientes", nargs="+", type=int, default=[50, 200, 1000])
+    parser.add_argument("--duracao", type=float, default=10.0)
+    asyncio.run(_principal(parser.parse_args()))
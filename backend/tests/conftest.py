@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# ambiente de teste definido antes de importar o app (as configurações são lidas no import)
+_TMP = tempfile.mkdtemp(prefix="fichas_testes_")
+os.environ.update({
+    "APP_ENV": "test",
+    "DATABASE_URL": f"sqlite:///{os.path.join(_TMP, 'testes.sqlite')}",
+    "INIT_DB": "true",
+    "SECRET_KEY": "chave-dos-testes",
+    "REDIS_PORT": "1",  # sem Redis: limitador e caches em memória
+    "BCRYPT_ROUNDS": "4",
+    "SENHA_PROCESSOS": "0",
+    "PDF_ENGINE": "reportlab",
+    "PDF_CACHE_DIR": os.path.join(_TMP, "pdf_cache"),
+    "RATE_LIMIT_ENABLED": "false",
+    "CONSULTAS_DETECTOR": "true",
+    "CONSULTAS_ESTRITO": "true",
+    "EMAIL_DESPACHANTE": "false",
+    "METRICAS_ENABLED": "true",
+    "METRICAS_LENTO_MS": "0",
+})
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import auth, models, rastreio_cache  # noqa: E402
+from app.auth import claims_admin, criar_token_acesso  # noqa: E402
+from app.database import Base, SessionLocal, engine  # noqa: E402
+from app.main import app  # noqa: E402
+from app.senha_utils import pwd_context  # noqa: E402
+
+
+SENHA = "Admin12345"
+
+
+def pytest_sessionfinish(session, exitstatus):
+    engine.dispose()
+    shutil.rmtree(_TMP, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def _estado_limpo():
+    # cada teste começa com banco vazio, limitador zerado e cache de rastreio vazio
+    yield
+    with engine.begin() as conn:
+        for tabela in reversed(Base.metadata.sorted_tables):
+            conn.execute(tabela.delete())
+    auth.limitador = auth._LimitadorMemoria(auth.LIMITE_MEMORIA_MAX_CHAVES)
+    rastreio_cache._local = rastreio_cache._LRUComTTL(rastreio_cache.RASTREIO_CACHE_MAX, rastreio_cache.RASTREIO_CACHE_TTL)
+
+
+@pytest.fixture
+def db():
+    sessao = SessionLocal()
+    try:
+        yield sessao
+    finally:
+        sessao.close()
+
+
+@pytest.fixture
+def client():
+    # sem "with": não dispara o startup (despachante de email fica desligado)
+    return TestClient(app)
+
+
+def criar_admin(db, email: str) -> models.Admin:
+    admin = models.Admin(email=email, hashed_password=pwd_context.hash(SENHA))
+    db.add(admin)
+    db.commit()
+    return admin
+
+
+def headers_de(admin) -> dict:
+    return {"Authorization": f"Bearer {criar_token_acesso(claims_admin(admin))}"}
+
+
+@pytest.fixture
+def admin(db):
+    return criar_admin(db, "a@a.com")
+
+
+@pytest.fixture
+def outro_admin(db):
+    return criar_admin(db, "b@b.com")
+
+
+@pytest.fixture
+def headers(admin):
+    return headers_de(admin)
+
+
+def semear(db, admin, clientes: int = 5, fichas_por_cliente: int = 3, prefixo: str = "C"):
+    # clientes com fichas em meses diferentes; códigos {prefixo}{i}X{j}
+    criados = []
+    for i in range(clientes):
+        cliente = models.Cliente(nome=f"Cliente {prefixo}{i}", telefone="11999999999", email=f"{prefixo.lower()}{i}@x.com", admin_id=admin.id)
+        db.add(cliente)
+        db.flush()
+        for j in range(fichas_por_cliente):
+            db.add(models.Ficha(
+                descricao="d", categoria="cel", marca="Samsung" if j else "Apple", modelo=f"M{j}",
+                codigo_rastreio=f"{prefixo}{i}X{j}", defeito="tela", cliente_id=cliente.id,
+                status="ABERTA" if j else "EM_REPARO", data_criacao=datetime.utcnow() - timedelta(days=40 * j),
+            ))
+        criados.append(cliente)
+    db.commit()
+    return criados
+
+
+@pytest.fixture
+def dados(db, admin, outro_admin):
+    # 5 clientes do admin principal e 2 de outro admin (para checar isolamento)
+    semear(db, outro_admin, clientes=2, prefixo="O")
+    return semear(db, admin)
+
+
+class ContadorSQL:
+    # conta statements em qualquer engine (sync e async), inclusive os da thread do TestClient
+
+    def __init__(self):
+        self.total = 0
+
+    def __call__(self, *args):
+        self.total += 1
+
+    def medir(self, func, *args, **kwargs):
+        self.total = 0
+        resultado = func(*args, **kwargs)
+        return resultado, self.total
+
+
+@pytest.fixture
+def contador_sql():
+    contador = ContadorSQL()
+    event.listen(Engine, "before_cursor_execute", contador)
+    try:
+        yield contador
+    finally:
+        event.remove(Engine, "before_cursor_execute", contador)
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app import auth, models
+from conftest import SENHA
+
+
+def _login(client, admin):
+    r = client.post("/admin/login", json={"email": admin.email, "password": SENHA})
+    assert r.status_code == 200
+    return r.json()
+
+
+def test_refresh_e_de_uso_unico(client, admin):
+    tokens = _login(client, admin)
+    r = client.post("/admin/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert r.status_code == 200
+    novos = r.json()
+    assert novos["refresh_token"] != tokens["refresh_token"]
+    assert client.get("/usuario/me", headers={"Authorization": f"Bearer {novos['access_token']}"}).status_code == 200
+
+    # o refresh antigo já foi trocado: reapresentar (vazado ou repetido) é recusado
+    r = client.post("/admin/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert r.status_code == 401
+    # o novo continua valendo uma vez
+    assert client.post("/admin/refresh", json={"refresh_token": novos["refresh_token"]}).status_code == 200
+
+
+def test_logout_revoga_o_refresh(client, admin):
+    tokens = _login(client, admin)
+    assert client.post("/admin/logout", json={"refresh_token": tokens["refresh_token"]}).status_code == 204
+    assert client.post("/admin/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 401
+
+
+def test_refresh_recusa_token_de_acesso_e_sem_jti(client, admin):
+    tokens = _login(client, admin)
+    assert client.post("/admin/refresh", json={"refresh_token": tokens["access_token"]}).status_code == 401
+    sem_jti = auth.jwt.encode({"sub": str(admin.id), "typ": "refresh", "exp": 9999999999}, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+    assert client.post("/admin/refresh", json={"refresh_token": sem_jti}).status_code == 401
+
+
+def test_refresh_recusa_quando_nao_da_para_registrar_o_uso(client, admin, monkeypatch):
+    tokens = _login(client, admin)
+
+    def _fora(self, *args, **kwargs):
+        raise OperationalError("INSERT", {}, Exception("banco fora"))
+
+    monkeypatch.setattr(Session, "commit", _fora)
+    assert client.post("/admin/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 401
+
+
+def test_refresh_usado_nao_volta_depois_de_lotar_o_limitador(client, db, admin, monkeypatch):
+    # limitador pequeno: em memória ele despeja chaves por LRU, e cada worker tem o seu
+    monkeypatch.setattr(auth, "limitador", auth._LimitadorMemoria(32, particoes=4))
+    tokens = _login(client, admin)
+    assert client.post("/admin/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 200
+
+    for i in range(1000):
+        auth.limitador.incr(f"ip:{i}", 60)
+    assert client.post("/admin/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 401
+    # outro processo (limitador vazio) também recusa: o registro está no banco
+    monkeypatch.setattr(auth, "limitador", auth._LimitadorMemoria(auth.LIMITE_MEMORIA_MAX_CHAVES))
+    assert client.post("/admin/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 401
+
+
+def test_jti_expirado_e_apagado_no_proximo_uso(client, db, admin):
+    db.add(models.RefreshUsado(jti="velho", expira_em=datetime.utcnow() - timedelta(seconds=1)))
+    db.commit()
+    tokens = _login(client, admin)
+    assert client.post("/admin/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 200
+    db.expire_all()
+    assert [r.jti for r in db.query(models.RefreshUsado)] == [auth.jwt.get_unverified_claims(tokens["refresh_token"])["jti"]]
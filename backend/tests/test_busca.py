@@ -0,0 +1,103 @@
+import time
+
+import pytest
+from sqlalchemy import create_mock_engine, insert, text
+from sqlalchemy.dialects import postgresql
+
+from app import models, search_utils
+from conftest import semear
+
+
+def _fichas(db, admin, termo):
+    query = (
+        db.query(models.Ficha)
+        .join(models.Cliente, models.Ficha.cliente_id == models.Cliente.id)
+        .filter(models.Cliente.admin_id == admin.id)
+    )
+    return search_utils.filtrar_fichas(db, query, termo)
+
+
+def _sem_fts(monkeypatch):
+    monkeypatch.setattr(search_utils, "_usar_fts", lambda db, termo: False)
+
+
+@pytest.mark.parametrize("termo", ["Apple", "sams", "Cliente C3", "C1X", "m2", "nada-disso"])
+def test_fts_e_ilike_retornam_as_mesmas_fichas(db, admin, dados, monkeypatch, termo):
+    fts = {f.id for f in _fichas(db, admin, termo).all()}
+    _sem_fts(monkeypatch)
+    ilike = {f.id for f in _fichas(db, admin, termo).all()}
+    assert fts == ilike
+
+
+def test_busca_de_clientes_ranqueada(client, headers, dados):
+    r = client.get("/clientes/search?q=C3", headers=headers)
+    assert r.status_code == 200
+    assert [c["nome"] for c in r.json()] == ["Cliente C3"]
+    r = client.get("/clientes?q=cliente c", headers=headers)
+    assert r.json()["total"] == 5
+
+
+def test_sqlite_usa_o_indice_fts(db, admin, dados):
+    stmt = _fichas(db, admin, "Samsung").statement
+    sql = str(stmt.compile(db.get_bind(), compile_kwargs={"literal_binds": True}))
+    plano = " ".join(str(row[-1]) for row in db.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+    assert "fichas_fts VIRTUAL TABLE INDEX" in plano
+    assert "clientes_fts VIRTUAL TABLE INDEX" in plano
+    # parte dos acertos do FTS e busca as fichas pela chave (nada de varrer fichas inteira)
+    assert "SCAN fichas " not in plano + " "
+    assert "LEFT-JOIN" not in plano
+
+
+class _PostgresFalso:
+    # só o dialeto importa para montar a query; nada é executado
+
+    def __init__(self, db):
+        self.db = db
+        self.bind = create_mock_engine("postgresql://", lambda *a, **kw: None)
+
+    def get_bind(self):
+        return self.bind
+
+    def query(self, *entidades):
+        return self.db.query(*entidades)
+
+
+def test_postgres_separa_fichas_e_clientes_numa_union(db, admin):
+    pg = _PostgresFalso(db)
+    query = _fichas(pg, admin, "samsung")
+    sql = str(query.statement.compile(dialect=postgresql.dialect()))
+    assert "UNION" in sql
+    # cada lado da UNION filtra uma tabela só (os índices GIN de cada uma podem ser usados)
+    uniao = sql[sql.index("IN (") : sql.index("ORDER BY")]
+    lado_fichas, lado_clientes = uniao.split("UNION")
+    assert "clientes.nome" not in lado_fichas
+    assert "fichas.marca" not in lado_clientes
+
+
+@pytest.mark.benchmark
+def test_benchmark_fts_contra_ilike(db, admin, monkeypatch):
+    clientes = semear(db, admin, clientes=200, fichas_por_cliente=1)
+    lote = [
+        {
+            "descricao": "d", "categoria": "cel", "marca": ("Apple", "Samsung", "Motorola", "Xiaomi")[i % 4],
+            "modelo": f"Modelo {i}", "codigo_rastreio": f"B{i:07d}", "defeito": "tela",
+            "cliente_id": clientes[i % len(clientes)].id, "status": "ABERTA",
+        }
+        for i in range(50_000)
+    ]
+    db.execute(insert(models.Ficha), lote)
+    db.commit()
+
+    def medir(termo, repeticoes=20):
+        inicio = time.perf_counter()
+        for _ in range(repeticoes):
+            _fichas(db, admin, termo).limit(20).all()
+        return (time.perf_counter() - inicio) / repeticoes * 1000
+
+    termos = ["B0031", "Modelo 4999", "Cliente C17"]
+    fts = {t: medir(t) for t in termos}
+    _sem_fts(monkeypatch)
+    ilike = {t: medir(t) for t in termos}
+    for t in termos:
+        print(f"\n{t!r}: FTS {fts[t]:.2f}ms  ILIKE {ilike[t]:.2f}ms")
+    assert sum(fts.values()) < sum(ilike.values())
@@ -0,0 +1,58 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+from fastapi import Depends, Security
+from fastapi.encoders import jsonable_encoder
+
+from app import crud
+from app.auth import verificar_token
+from app.database import get_db
+from app.main import app
+from carga import formatar, medir
+from conftest import semear
+
+
+@pytest.fixture
+def servidor():
+    # uvicorn de verdade numa thread (o TestClient serializa as requisições)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        porta = s.getsockname()[1]
+    config = uvicorn.Config(app, host="127.0.0.1", port=porta, log_level="warning", lifespan="off", backlog=2048)
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    yield f"http://127.0.0.1:{porta}"
+    server.should_exit = True
+    thread.join(10)
+
+
+@pytest.fixture
+def rota_sync():
+    # a mesma listagem no formato antigo (def + Session no threadpool), para comparar
+    @app.get("/_carga/fichas-sync")
+    def _fichas_sync(db=Depends(get_db), admin_id: int = Security(verificar_token)):
+        rows, total, _ = crud.pagina_fichas(db, admin_id)
+        return {"items": jsonable_encoder([f for f, _ in rows]), "total": total}
+
+    yield "/_carga/fichas-sync"
+    app.router.routes[:] = [r for r in app.router.routes if getattr(r, "path", "") != "/_carga/fichas-sync"]
+
+
+@pytest.mark.benchmark
+def test_carga_async_contra_sync(servidor, rota_sync, db, admin, headers):
+    semear(db, admin, clientes=200, fichas_por_cliente=3)
+    resultados = []
+    for rota in ("/fichas", rota_sync):
+        for clientes in (50, 200, 1000):
+            resultado = asyncio.run(medir(servidor, rota, clientes, duracao=3, headers=headers))
+            print("\n" + formatar(resultado), end="")
+            resultados.append(resultado)
+    print()
+    assert all(r["rps"] > 0 for r in resultados)
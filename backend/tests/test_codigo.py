@@ -0,0 +1,96 @@
+import multiprocessing as mp
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import codigo_utils, crud, models, schemas
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _no_no_filho():
+    return os.getpid(), codigo_utils.NO_PROCESSO, codigo_utils._gerador.no
+
+
+def _gerar(no: int, quantidade: int):
+    # roda num processo novo (spawn), como um worker com CODIGO_NO próprio
+    codigo_utils._gerador = codigo_utils._Gerador(no)
+    return codigo_utils.novos_codigos(quantidade)
+
+
+def test_codigos_unicos_entre_threads():
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        lotes = list(ex.map(lambda _: codigo_utils.novos_codigos(5000), range(8)))
+    codigos = [c for lote in lotes for c in lote]
+    assert len(set(codigos)) == len(codigos) == 40000
+    assert all(len(c) == codigo_utils.TAMANHO_CODIGO and set(c) <= set(codigo_utils._ALFABETO) for c in codigos)
+
+
+def test_codigos_unicos_entre_processos():
+    with mp.get_context("spawn").Pool(4) as pool:
+        lotes = pool.starmap(_gerar, [(no, 20000) for no in range(4)])
+    codigos = [c for lote in lotes for c in lote]
+    assert len(set(codigos)) == len(codigos) == 80000
+
+
+def test_permutacao_e_reversivel_e_nao_revela_a_ordem():
+    valores = [codigo_utils._gerador.proximo() for _ in range(100)]
+    assert [codigo_utils.despermutar(codigo_utils.permutar(v)) for v in valores] == valores
+    codigos = [codigo_utils.codificar(codigo_utils.permutar(v)) for v in valores]
+    assert codigos != sorted(codigos)
+
+
+def test_producao_exige_chave_e_no():
+    env = {k: v for k, v in os.environ.items() if not k.startswith("CODIGO_")}
+    env["APP_ENV"] = "production"
+
+    def _subir(**extra):
+        return subprocess.run([sys.executable, "-c", "import app.codigo_utils"], env={**env, **extra}, cwd=BACKEND, capture_output=True, text=True)
+
+    for faltando in ({}, {"CODIGO_NO": "3"}, {"CODIGO_CHAVE": "segredo"}):
+        r = _subir(**faltando)
+        assert r.returncode != 0 and "CODIGO_CHAVE e CODIGO_NO" in r.stderr
+    assert _subir(CODIGO_NO="3", CODIGO_CHAVE="segredo").returncode == 0
+    assert "entre 0 e 1023" in _subir(CODIGO_NO="5000", CODIGO_CHAVE="segredo").stderr
+
+
+def test_workers_com_o_mesmo_codigo_no_tem_nos_diferentes():
+    # fork (gunicorn --preload): o filho recalcula o nó com o próprio pid
+    with mp.get_context("fork").Pool(2) as pool:
+        resultados = pool.starmap(_no_no_filho, [()] * 2)
+    for pid, no, no_gerador in resultados:
+        assert no == no_gerador == (codigo_utils.BASE_NO + pid) % 1024
+
+    # spawn (uvicorn --workers): cada worker importa de novo, com o mesmo CODIGO_NO
+    env = dict(os.environ, CODIGO_NO="7")
+    comando = [sys.executable, "-c", "import os; from app import codigo_utils as c; print(os.getpid(), c.NO_PROCESSO)"]
+    for _ in range(2):
+        pid, no = map(int, subprocess.run(comando, env=env, cwd=BACKEND, capture_output=True, text=True, check=True).stdout.split())
+        assert no == (7 + pid) % 1024
+
+
+def _ficha_nova():
+    return schemas.FichaCreate(descricao="d", categoria="cel", marca="Samsung", modelo="M", defeito="tela")
+
+
+def test_criar_ficha_troca_o_codigo_que_colide(db, admin, dados, monkeypatch):
+    # nó repetido entre processos: o código gerado já existe no banco e o UNIQUE recusa
+    existente = db.query(models.Ficha).first().codigo_rastreio
+    gerados = iter([existente, existente, "NOVOCODIGO01"])
+    monkeypatch.setattr(codigo_utils, "novo_codigo", lambda: next(gerados))
+
+    ficha = crud.criar_ficha(db, _ficha_nova(), dados[0].id, admin_id=admin.id)
+    assert ficha.codigo_rastreio == "NOVOCODIGO01"
+    assert db.query(models.Ficha).filter_by(codigo_rastreio=existente).count() == 1
+
+
+def test_criar_ficha_desiste_depois_das_tentativas(db, admin, dados, monkeypatch):
+    existente = db.query(models.Ficha).first().codigo_rastreio
+    monkeypatch.setattr(codigo_utils, "novo_codigo", lambda: existente)
+    antes = db.query(models.Ficha).count()
+    with pytest.raises(RuntimeError):
+        crud.criar_ficha(db, _ficha_nova(), dados[0].id, admin_id=admin.id)
+    assert db.query(models.Ficha).count() == antes
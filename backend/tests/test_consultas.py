@@ -0,0 +1,87 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy.orm import joinedload
+
+from app import consultas_utils, crud, models
+from app.main import app
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def cenario(client, db, admin, headers, dados):
+    # fichas com histórico e log de acesso, para as listagens não voltarem vazias
+    fichas = crud.query_fichas_do_admin(db, admin.id).order_by(models.Ficha.id).all()
+    for ficha in fichas[:5]:
+        assert client.put(f"/fichas/{ficha.id}", json={"status": "FINALIZADA"}, headers=headers).status_code == 200
+        crud.registrar_log_acesso(db, admin.id, "gerar_pdf", f"Ficha ID: {ficha.id}")
+    ficha = fichas[0]
+    return {"ficha": ficha.id, "cliente": ficha.cliente_id, "codigo": ficha.codigo_rastreio, "ids": [f.id for f in fichas]}
+
+
+# uma requisição por rota com @orcamento_queries; rota nova com orçamento precisa de um caso aqui
+CASOS = {
+    ("GET", "/clientes"): lambda c: ("/clientes?q=Cliente", None),
+    ("GET", "/clientes/search"): lambda c: ("/clientes/search?q=Cliente", None),
+    ("GET", "/clientes/{cliente_id}"): lambda c: (f"/clientes/{c['cliente']}", None),
+    ("GET", "/clientes/{cliente_id}/fichas"): lambda c: (f"/clientes/{c['cliente']}/fichas", None),
+    ("GET", "/rastreio/{codigo}"): lambda c: (f"/rastreio/{c['codigo']}", None),
+    ("GET", "/fichas"): lambda c: ("/fichas?q=Samsung&status=ABERTA", None),
+    ("GET", "/fichas/codigo/{codigo}"): lambda c: (f"/fichas/codigo/{c['codigo']}", None),
+    ("GET", "/fichas/{ficha_id}/logs"): lambda c: (f"/fichas/{c['ficha']}/logs", None),
+    ("GET", "/fichas/{ficha_id}/detail"): lambda c: (f"/fichas/{c['ficha']}/detail", None),
+    ("GET", "/minhas-fichas"): lambda c: ("/minhas-fichas", None),
+    ("GET", "/fichas/estatisticas"): lambda c: ("/fichas/estatisticas?por_status=true", None),
+    ("GET", "/logs"): lambda c: ("/logs", None),
+    ("PATCH", "/fichas/bulk"): lambda c: ("/fichas/bulk", {"ids": c["ids"], "dados": {"status": "ENTREGUE"}}),
+}
+
+
+def _rotas_com_orcamento():
+    return {
+        (metodo, rota.path): rota.endpoint._orcamento_queries
+        for rota in app.routes
+        if hasattr(getattr(rota, "endpoint", None), "_orcamento_queries")
+        for metodo in rota.methods
+    }
+
+
+def test_toda_rota_com_orcamento_tem_caso():
+    assert set(_rotas_com_orcamento()) == set(CASOS)
+
+
+@pytest.mark.parametrize("chave", list(CASOS), ids=lambda k: f"{k[0]} {k[1]}")
+def test_rota_fica_dentro_do_orcamento(client, headers, cenario, chave):
+    orcamento = _rotas_com_orcamento()[chave]
+    url, corpo = CASOS[chave](cenario)
+    r = client.request(chave[0], url, json=corpo, headers=headers)
+    # estrito (conftest): estourar o orçamento já seria 500 com o relatório
+    assert r.status_code == 200, r.text
+    assert 1 <= int(r.headers["x-consultas"]) <= orcamento
+
+
+def test_contar_queries_aponta_n_mais_1(db, dados):
+    db.expunge_all()
+    with pytest.raises(consultas_utils.OrcamentoExcedido) as erro:
+        with consultas_utils.contar_queries(2):
+            for ficha in db.query(models.Ficha).all():
+                ficha.cliente.nome  # lazy load por ficha
+    assert erro.value.relatorio["repetidas"]
+
+    db.expunge_all()
+    with consultas_utils.contar_queries(2) as registro:
+        for ficha in db.query(models.Ficha).options(joinedload(models.Ficha.cliente)).all():
+            ficha.cliente.nome
+    assert registro.total == 1
+
+
+def test_detector_vem_desligado():
+    env = {k: v for k, v in os.environ.items() if not k.startswith("CONSULTAS_")}
+    r = subprocess.run(
+        [sys.executable, "-c", "from app import consultas_utils; print(consultas_utils.CONSULTAS_DETECTOR)"],
+        env=env, cwd=BACKEND, capture_output=True, text=True,
+    )
+    assert r.stdout.strip() == "False", r.stderr
@@ -0,0 +1,163 @@
+import asyncio
+import socket
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from app import auth, mail_utils, models, notificacao_utils
+from conftest import semear
+
+
+class _Servidor:
+    # recusa "recusado@" em definitivo (550) e "ocupado@" temporariamente (451)
+
+    def __init__(self):
+        self.recebidos = []
+        self.sessoes = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("recusado@"):
+            return "550 5.1.1 caixa inexistente"
+        if address.startswith("ocupado@"):
+            return "451 4.3.0 tente mais tarde"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.recebidos.extend(envelope.rcpt_tos)
+        self.sessoes.add(id(session))
+        return "250 OK"
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        porta = s.getsockname()[1]
+    servidor = _Servidor()
+    controller = Controller(servidor, hostname="127.0.0.1", port=porta)
+    controller.start()
+    monkeypatch.setattr(mail_utils, "MAIL_SERVER", "127.0.0.1")
+    monkeypatch.setattr(mail_utils, "MAIL_PORT", porta)
+    monkeypatch.setattr(mail_utils, "MAIL_FROM", "oficina@exemplo.com")
+    monkeypatch.setattr(mail_utils, "MAIL_STARTTLS", False)
+    monkeypatch.setattr(mail_utils, "USE_CREDENTIALS", False)
+    monkeypatch.setattr(mail_utils, "EMAIL_ENABLED", True)
+    yield servidor
+    controller.stop()
+
+
+def _processar(vezes: int = 1):
+    async def _rodar():
+        despachante = mail_utils.DespachanteEmail()
+        despachante._loop = asyncio.get_running_loop()
+        try:
+            for _ in range(vezes):
+                await despachante.processar_lote()
+        finally:
+            await despachante._fechar()
+    asyncio.run(_rodar())
+
+
+def _enfileirar(db, *destinatarios):
+    emails = [mail_utils.enfileirar_email(db, d, "Ficha", "<p>ok</p>") for d in destinatarios]
+    db.commit()
+    return [e.id for e in emails]
+
+
+def test_lote_sai_por_uma_conexao_e_5xx_vai_direto_para_falhou(db, smtp):
+    ok1, recusado, ocupado, ok2 = _enfileirar(db, "a@exemplo.com", "recusado@exemplo.com", "ocupado@exemplo.com", "b@exemplo.com")
+    _processar()
+
+    db.expire_all()
+    por_id = {e.id: e for e in db.query(models.EmailOutbox).all()}
+    assert por_id[ok1].status == por_id[ok2].status == "ENVIADO"
+    assert smtp.recebidos == ["a@exemplo.com", "b@exemplo.com"]
+    assert len(smtp.sessoes) == 1
+    # recusa definitiva: dead letter na primeira tentativa, sem backoff
+    assert por_id[recusado].status == "FALHOU"
+    assert por_id[recusado].tentativas == 1
+    assert "550" in por_id[recusado].ultimo_erro
+    # recusa temporária: volta para a fila com backoff
+    assert por_id[ocupado].status == "PENDENTE"
+    assert por_id[ocupado].tentativas == 1
+    assert por_id[ocupado].proxima_tentativa > por_id[ok1].enviado_em
+
+
+def test_4xx_vira_dead_letter_so_depois_das_tentativas(db, smtp, monkeypatch):
+    monkeypatch.setattr(mail_utils, "EMAIL_MAX_TENTATIVAS", 3)
+    monkeypatch.setattr(mail_utils, "EMAIL_BACKOFF_BASE", 0)
+    (ocupado,) = _enfileirar(db, "ocupado@exemplo.com")
+    _processar(vezes=2)
+    db.expire_all()
+    assert db.get(models.EmailOutbox, ocupado).status == "PENDENTE"
+    _processar()
+    db.expire_all()
+    email = db.get(models.EmailOutbox, ocupado)
+    assert (email.status, email.tentativas) == ("FALHOU", 3)
+
+
+def test_cota_por_destinatario_so_conta_no_envio(db, admin, smtp, monkeypatch):
+    (cliente,) = semear(db, admin, clientes=1)
+    fichas = db.query(models.Ficha).filter_by(cliente_id=cliente.id).all()
+    # edição desfeita (rollback) não gasta a cota do cliente
+    for ficha in fichas:
+        ficha.status = "FINALIZADA"
+        notificacao_utils.notificar_status_ficha(db, ficha, cliente)
+    db.rollback()
+    assert db.query(models.EmailOutbox).count() == 0
+    assert auth.limitador.contar(f"email:status_ficha:{cliente.email}") == 0
+
+    monkeypatch.setitem(mail_utils._limites_por_destinatario, "status_ficha:", (2, 3600))
+    for ficha in fichas:
+        mail_utils.enfileirar_email(db, cliente.email, "Ficha", "<p>ok</p>", chave=f"status_ficha:{ficha.id}")
+    db.commit()
+    _processar()
+
+    db.expire_all()
+    emails = db.query(models.EmailOutbox).order_by(models.EmailOutbox.id).all()
+    assert [e.status for e in emails] == ["ENVIADO", "ENVIADO", "PENDENTE"]
+    # adiado, não é falha: não gasta tentativa
+    assert emails[2].tentativas == 0 and emails[2].proxima_tentativa > emails[1].enviado_em
+    assert smtp.recebidos == [cliente.email, cliente.email]
+
+
+def test_adiado_volta_no_fim_da_janela_sem_gastar_cota(db, admin, smtp, monkeypatch):
+    (cliente,) = semear(db, admin, clientes=1)
+    monkeypatch.setitem(mail_utils._limites_por_destinatario, "status_ficha:", (1, 600))
+    chave_limite = f"email:status_ficha:{cliente.email}"
+    threads = []
+    consumir = auth.consumir_limite
+
+    def _consumir(*args, **kwargs):
+        threads.append(threading.get_ident())
+        return consumir(*args, **kwargs)
+
+    monkeypatch.setattr(auth, "consumir_limite", _consumir)
+    for i in range(2):
+        mail_utils.enfileirar_email(db, cliente.email, "Ficha", "<p>ok</p>", chave=f"status_ficha:{i}")
+    db.commit()
+
+    inicio = datetime.utcnow()
+    _processar()
+    db.expire_all()
+    enviado, adiado = db.query(models.EmailOutbox).order_by(models.EmailOutbox.id).all()
+    assert (enviado.status, adiado.status) == ("ENVIADO", "PENDENTE")
+    # volta quando a janela abre (não no backoff de falha), sem gastar tentativa
+    espera = (adiado.proxima_tentativa - inicio).total_seconds()
+    assert 590 <= espera <= 601 and adiado.tentativas == 0
+    assert auth.limitador.contar(chave_limite) == 1
+
+    # o despachante tenta de novo antes da janela: continua adiado e a cota não sobe
+    for _ in range(3):
+        adiado.proxima_tentativa = datetime.utcnow() - timedelta(seconds=1)
+        db.commit()
+        _processar()
+        db.expire_all()
+        assert adiado.status == "PENDENTE"
+    assert auth.limitador.contar(chave_limite) == 1
+    assert smtp.recebidos == [cliente.email]
+    # a checagem do limitador (I/O bloqueante no Redis) não roda na thread do event loop
+    assert threads and threading.get_ident() not in threads
@@ -0,0 +1,131 @@
+import base64
+
+import pytest
+
+from app import crud, models, schemas
+from conftest import semear
+
+
+def _b64(texto: str) -> str:
+    return base64.urlsafe_b64encode(texto.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _ficha(db, codigo):
+    return db.query(models.Ficha).filter(models.Ficha.codigo_rastreio == codigo).one()
+
+
+def test_buscar_ficha_com_dono_em_uma_query(db, admin, outro_admin, dados, contador_sql):
+    minha = _ficha(db, "C0X1")
+    alheia = _ficha(db, "O0X1")
+
+    ficha, n = contador_sql.medir(crud.buscar_ficha_por_id, db, minha.id, admin_id=admin.id)
+    assert ficha.id == minha.id and n == 1
+
+    ficha, n = contador_sql.medir(crud.buscar_ficha_por_codigo, db, "C0X1", admin_id=admin.id)
+    assert ficha.id == minha.id and n == 1
+
+    row, n = contador_sql.medir(crud.buscar_ficha_com_cliente, db, minha.id, admin_id=admin.id)
+    assert row[1].admin_id == admin.id and n == 1
+
+    assert crud.buscar_ficha_por_id(db, alheia.id, admin_id=admin.id) is None
+    assert crud.buscar_ficha_por_codigo(db, "O0X1", admin_id=admin.id) is None
+
+
+def test_logs_checam_dono_no_mesmo_select(db, admin, dados, contador_sql):
+    minha = _ficha(db, "C1X1")
+    alheia = _ficha(db, "O1X1")
+    crud.criar_log(db, minha.id, schemas.LogCreate(ficha_id=minha.id, descricao="oi"), admin_id=admin.id)
+
+    logs, n = contador_sql.medir(crud.listar_logs_por_ficha, db, minha.id, admin_id=admin.id)
+    assert len(logs) == 1 and n == 1
+    assert crud.listar_logs_por_ficha(db, alheia.id, admin_id=admin.id) == []
+    with pytest.raises(ValueError):
+        crud.criar_log(db, alheia.id, schemas.LogCreate(ficha_id=alheia.id, descricao="x"), admin_id=admin.id)
+
+
+def test_endpoints_de_ficha_nao_vazam_entre_admins(client, headers, db, dados):
+    alheia = _ficha(db, "O0X0")
+    assert client.get(f"/fichas/{alheia.id}/detail", headers=headers).status_code == 404
+    assert client.get(f"/fichas/{alheia.id}/pdf", headers=headers).status_code == 404
+    assert client.get(f"/fichas/{alheia.id}/logs", headers=headers).json() == []
+    assert client.get("/fichas/codigo/O0X0", headers=headers).status_code == 404
+    assert client.put(f"/fichas/{alheia.id}", json={"status": "FINALIZADA"}, headers=headers).status_code == 404
+
+
+def test_detalhe_da_ficha_em_queries_fixas(client, headers, db, dados, contador_sql):
+    minha = _ficha(db, "C2X1")
+    r, n = contador_sql.medir(client.get, f"/fichas/{minha.id}/detail", headers=headers)
+    assert r.status_code == 200
+    # ficha+cliente (1 SELECT com join) + logs
+    assert n == 2
+
+
+@pytest.mark.parametrize("rota", ["/fichas", "/clientes", "/minhas-fichas", "/logs", "/fichas?cursor=", "/fichas?include_total=false"])
+def test_listagem_nao_cresce_com_o_tamanho_da_pagina(client, headers, db, admin, contador_sql, rota):
+    semear(db, admin, clientes=70, fichas_por_cliente=1)
+    for _ in range(70):
+        crud.registrar_log_acesso(db, admin.id, "login", "IP: 127.0.0.1")
+
+    sep = "&" if "?" in rota else "?"
+    medidas = {}
+    for tamanho in (2, 15, 60):
+        r, n = contador_sql.medir(client.get, f"{rota}{sep}page_size={tamanho}", headers=headers)
+        assert r.status_code == 200
+        assert len(r.json()["items"]) == tamanho
+        medidas[tamanho] = n
+    # O(1) em queries: 2, 15 ou 60 itens custam o mesmo número de idas ao banco
+    assert len(set(medidas.values())) == 1, medidas
+    assert medidas[2] <= 2
+
+
+@pytest.fixture
+def listagens(db, admin, outro_admin):
+    semear(db, outro_admin, clientes=3, fichas_por_cliente=1, prefixo="O")
+    semear(db, admin, clientes=13, fichas_por_cliente=2)
+    for i in range(23):
+        crud.registrar_log_acesso(db, admin.id, "login", f"IP: 10.0.0.{i}")
+    esperados = {
+        "/fichas": [f.id for f in crud.query_fichas_do_admin(db, admin.id)],
+        "/clientes": [c.id for c in db.query(models.Cliente).filter_by(admin_id=admin.id)],
+        "/logs": [l.id for l in db.query(models.LogAcesso).filter_by(admin_id=admin.id)],
+    }
+    return {rota: sorted(ids, reverse=True) for rota, ids in esperados.items()}
+
+
+@pytest.mark.parametrize("rota", ["/fichas", "/clientes", "/logs"])
+def test_cursor_percorre_tudo_uma_vez_em_ordem(client, headers, listagens, rota):
+    vistos, cursor, paginas = [], "", 0
+    while cursor is not None:
+        r = client.get(rota, params={"cursor": cursor, "page_size": 5}, headers=headers)
+        assert r.status_code == 200
+        corpo = r.json()
+        vistos += [i["id"] for i in corpo["items"]]
+        cursor = corpo["next_cursor"]
+        paginas += 1
+    assert vistos == listagens[rota]
+    # a última página (cheia ou não) volta sem próximo cursor
+    assert paginas == -(-len(vistos) // 5)
+
+
+@pytest.mark.parametrize("rota", ["/fichas", "/clientes", "/logs"])
+def test_cursor_sem_total_nao_conta(client, headers, listagens, contador_sql, rota):
+    r, sem_total = contador_sql.medir(client.get, rota, params={"cursor": "", "include_total": "false"}, headers=headers)
+    assert r.status_code == 200 and r.json()["total"] is None
+    r, com_total = contador_sql.medir(client.get, rota, params={"cursor": ""}, headers=headers)
+    assert r.json()["total"] == len(listagens[rota])
+    # o COUNT é a única query a mais
+    assert com_total == sem_total + 1
+
+
+@pytest.mark.parametrize("rota", ["/fichas", "/clientes", "/logs"])
+@pytest.mark.parametrize("cursor", [
+    "nao-e-base64!!",
+    crud.codificar_cursor(1)[:-3],
+    _b64('{"id":"abc"}'),
+    _b64("[1]"),
+    _b64('{"id":1e999}'),
+    _b64('{"id":100000000000000000000000}'),  # fora do INTEGER do banco
+])
+def test_cursor_adulterado_e_400(client, headers, listagens, rota, cursor):
+    r = client.get(rota, params={"cursor": cursor}, headers=headers)
+    assert r.status_code == 400
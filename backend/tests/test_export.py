@@ -0,0 +1,100 @@
+import csv
+import io
+
+import pytest
+from openpyxl import load_workbook
+from sqlalchemy.orm import Query
+
+from app import export_utils, models
+
+
+def _csv(resposta):
+    assert resposta.status_code == 200, resposta.text
+    assert resposta.headers["content-type"].startswith("text/csv")
+    assert resposta.content.startswith("﻿".encode("utf-8"))
+    return list(csv.reader(io.StringIO(resposta.content.decode("utf-8-sig")), delimiter=";"))
+
+
+def _xlsx(resposta):
+    assert resposta.status_code == 200, resposta.text
+    planilha = load_workbook(io.BytesIO(resposta.content), read_only=True).active
+    return [list(linha) for linha in planilha.iter_rows(values_only=True)]
+
+
+def test_csv_de_clientes_tem_bom_cabecalho_e_so_os_do_admin(client, headers, dados):
+    linhas = _csv(client.get("/clientes/export", headers=headers))
+    assert linhas[0] == [nome for nome, _ in export_utils.COLUNAS_CLIENTES]
+    assert [l[1] for l in linhas[1:]] == [f"Cliente C{i}" for i in range(5)]
+
+    linhas = _csv(client.get("/clientes/export", params={"q": "Cliente C3"}, headers=headers))
+    assert [l[1] for l in linhas[1:]] == ["Cliente C3"]
+
+
+def test_csv_de_fichas_respeita_filtros_e_dono(client, db, admin, headers, dados):
+    linhas = _csv(client.get("/fichas/export", headers=headers))
+    assert linhas[0] == [nome for nome, _ in export_utils.COLUNAS_FICHAS]
+    codigos = [l[1] for l in linhas[1:]]
+    assert sorted(codigos) == sorted(f"C{i}X{j}" for i in range(5) for j in range(3))
+
+    linhas = _csv(client.get("/fichas/export", params={"status": "em_reparo"}, headers=headers))
+    assert sorted(l[1] for l in linhas[1:]) == [f"C{i}X0" for i in range(5)]
+    assert {l[2] for l in linhas[1:]} == {"EM_REPARO"}
+
+    linhas = _csv(client.get("/fichas/export", params={"q": "Cliente C2"}, headers=headers))
+    assert sorted(l[1] for l in linhas[1:]) == ["C2X0", "C2X1", "C2X2"]
+
+
+def test_xlsx_abre_no_openpyxl_com_as_linhas_esperadas(client, headers, dados):
+    linhas = _xlsx(client.get("/fichas/export", params={"formato": "xlsx", "status": "ABERTA"}, headers=headers))
+    assert linhas[0] == [nome for nome, _ in export_utils.COLUNAS_FICHAS]
+    assert sorted(l[1] for l in linhas[1:]) == sorted(f"C{i}X{j}" for i in range(5) for j in (1, 2))
+    assert {l[3] for l in linhas[1:]} == {f"Cliente C{i}" for i in range(5)}
+
+    linhas = _xlsx(client.get("/clientes/export", params={"formato": "xlsx"}, headers=headers))
+    assert [l[1] for l in linhas[1:]] == [f"Cliente C{i}" for i in range(5)]
+
+
+@pytest.mark.parametrize("nome", ['=HYPERLINK("http://x","y")', "+1+1", "-2+3", "@SUM(A1)", "\tx", "\rx"])
+def test_celula_com_cara_de_formula_vira_texto(client, db, admin, headers, nome):
+    db.add(models.Cliente(nome=nome, telefone="11999999999", admin_id=admin.id))
+    db.commit()
+
+    (linha,) = _csv(client.get("/clientes/export", headers=headers))[1:]
+    assert linha[1] == "'" + nome
+    (linha,) = _xlsx(client.get("/clientes/export", params={"formato": "xlsx"}, headers=headers))[1:]
+    # o XML da planilha normaliza \r em \n na leitura
+    assert linha[1] == ("'" + nome).replace("\r", "\n")
+
+
+def test_linhas_saem_por_yield_per_sem_montar_lista(client, headers, dados, monkeypatch):
+    usados = []
+    yield_per = Query.yield_per
+
+    def _yield_per(self, n):
+        usados.append(n)
+        return yield_per(self, n)
+
+    def _sem_lista(self):
+        raise AssertionError("export não deve materializar o resultado com .all()")
+
+    monkeypatch.setattr(Query, "yield_per", _yield_per)
+    monkeypatch.setattr(Query, "all", _sem_lista)
+    for rota in ("/fichas/export", "/clientes/export"):
+        for formato in ("csv", "xlsx"):
+            assert client.get(rota, params={"formato": formato}, headers=headers).status_code == 200
+    assert usados == [export_utils.EXPORT_YIELD_PER] * 4
+
+
+def test_csv_manda_pedacos_enquanto_le_as_linhas(monkeypatch):
+    monkeypatch.setattr(export_utils, "_CSV_LINHAS_POR_PEDACO", 2)
+    lidas = []
+
+    def _dados():
+        for i in range(5):
+            lidas.append(i)
+            yield [i, f"Cliente {i}"]
+
+    pedacos = export_utils.csv_stream(export_utils.COLUNAS_CLIENTES[:2], _dados())
+    assert next(pedacos).decode("utf-8-sig") == "id;nome\r\n" and lidas == []
+    assert next(pedacos) == b"0;Cliente 0\r\n1;Cliente 1\r\n" and lidas == [0, 1]
+    assert b"".join(pedacos) == b"2;Cliente 2\r\n3;Cliente 3\r\n4;Cliente 4\r\n"
@@ -0,0 +1,141 @@
+import time
+
+import pytest
+
+from app import crud, mail_utils, models, schemas
+from app.pdf_utils import PDF_LOTE_MAX
+from app.database import SessionLocal
+from conftest import semear
+
+
+@pytest.fixture
+def email_ligado(monkeypatch):
+    monkeypatch.setattr(mail_utils, "MAIL_FROM", "oficina@exemplo.com")
+    monkeypatch.setattr(mail_utils, "EMAIL_ENABLED", True)
+
+
+def _ids(db, admin_id):
+    return [f.id for f in crud.query_fichas_do_admin(db, admin_id).order_by(models.Ficha.id)]
+
+
+@pytest.mark.parametrize("rota, metodo, extra", [
+    ("/fichas/bulk", "patch", {"dados": {"status": "FINALIZADA"}}),
+    ("/fichas/pdf/batch", "post", {}),
+])
+@pytest.mark.parametrize("selecao", [{}, {"ids": []}, {"ids": [], "q": " ", "status": ""}])
+def test_lote_sem_ids_nem_filtro_e_recusado(client, headers, dados, rota, metodo, extra, selecao):
+    r = client.request(metodo.upper(), rota, json={**selecao, **extra}, headers=headers)
+    assert r.status_code == 400
+    assert not client.get("/fichas", params={"status": "FINALIZADA"}, headers=headers).json()["items"]
+
+
+def test_bulk_por_ids_respeita_dono_e_grava_historico(client, db, admin, outro_admin, headers, dados):
+    meus = _ids(db, admin.id)[:3]
+    alheio = _ids(db, outro_admin.id)[0]
+    r = client.patch("/fichas/bulk", json={"ids": meus + [alheio], "dados": {"status": "FINALIZADA"}}, headers=headers)
+    assert r.status_code == 200
+    resultado = {i["id"]: i["resultado"] for i in r.json()["itens"]}
+    assert resultado == {**{i: "atualizada" for i in meus}, alheio: "nao_encontrada"}
+
+    db.expire_all()
+    assert {db.get(models.Ficha, i).status for i in meus} == {"FINALIZADA"}
+    assert db.get(models.Ficha, alheio).status != "FINALIZADA"
+    assert db.query(models.LogAtualizacao).filter(models.LogAtualizacao.ficha_id.in_(meus)).count() == 3
+
+
+def test_bulk_nao_sobrescreve_edicao_concorrente(db, admin, dados):
+    ids = _ids(db, admin.id)[:3]
+    # a ficha já lida nesta sessão é editada por outra pessoa antes do UPDATE do lote
+    # (a referência segura os objetos no identity map, com a versão antiga)
+    query = crud.query_ficha_escopo(db, admin.id, models.Ficha, models.Cliente).filter(models.Ficha.id.in_(ids))
+    lidas = query.all()
+    outra = SessionLocal()
+    try:
+        crud.atualizar_ficha(outra, ids[1], {"observacao_publica": "editada no balcão"}, admin_id=admin.id)
+    finally:
+        outra.close()
+
+    resultado = crud.atualizar_fichas_em_lote(db, query, {"status": "CANCELADA"}, admin.id, ids=ids)
+    assert len(lidas) == 3
+    assert {i["id"]: i["resultado"] for i in resultado["itens"]} == {ids[0]: "atualizada", ids[1]: "conflito", ids[2]: "atualizada"}
+    assert resultado["atualizadas"] == 2
+
+    db.expire_all()
+    perdida = db.get(models.Ficha, ids[1])
+    assert perdida.status != "CANCELADA" and perdida.observacao_publica == "editada no balcão"
+    assert db.query(models.LogAtualizacao).filter_by(ficha_id=ids[1], status="CANCELADA").count() == 0
+
+
+def test_notificacoes_do_lote_nao_crescem_com_o_numero_de_fichas(client, db, admin, headers, email_ligado, contador_sql):
+    semear(db, admin, clientes=20, fichas_por_cliente=2)
+    ids = _ids(db, admin.id)
+    # metade já tem email pendente (será reaproveitado), metade gera email novo
+    for i, ficha_id in enumerate(ids):
+        if i % 2:
+            mail_utils.enfileirar_email(db, "antigo@x.com", "antes", "antes", chave=f"status_ficha:{ficha_id}")
+    db.commit()
+
+    def _bulk(lote, status):
+        r = client.patch("/fichas/bulk", json={"ids": lote, "dados": {"status": status}}, headers=headers)
+        assert r.status_code == 200 and r.json()["atualizadas"] == len(lote)
+
+    _, poucas = contador_sql.medir(_bulk, ids[:4], "FINALIZADA")
+    _, muitas = contador_sql.medir(_bulk, ids[4:], "FINALIZADA")
+    assert muitas == poucas
+
+    db.expire_all()
+    emails = db.query(models.EmailOutbox).filter(models.EmailOutbox.status == "PENDENTE").all()
+    assert len(emails) == len(ids)
+    assert {e.chave for e in emails} == {f"status_ficha:{i}" for i in ids}
+    assert all("Finalizada" in e.assunto for e in emails)
+
+
+@pytest.mark.benchmark
+def test_benchmark_bulk_contra_put_por_ficha(client, db, admin, headers, email_ligado):
+    semear(db, admin, clientes=40, fichas_por_cliente=2)
+    ids = _ids(db, admin.id)
+    por_linha, lote = ids[::2], ids[1::2]
+
+    inicio = time.perf_counter()
+    for ficha_id in por_linha:
+        assert client.put(f"/fichas/{ficha_id}", json={"status": "FINALIZADA"}, headers=headers).status_code == 200
+    t_put = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    r = client.patch("/fichas/bulk", json={"ids": lote, "dados": {"status": "FINALIZADA"}}, headers=headers)
+    t_bulk = time.perf_counter() - inicio
+    assert r.json()["atualizadas"] == len(lote)
+
+    print(f"\n{len(por_linha)} PUTs: {len(por_linha) / t_put:.0f} fichas/s; PATCH /fichas/bulk: {len(lote) / t_bulk:.0f} fichas/s")
+    assert t_bulk < t_put
+
+
+@pytest.mark.parametrize("rota, metodo, teto, extra", [
+    ("/fichas/bulk", "patch", schemas.LOTE_ATUALIZACAO_MAX, {"dados": {"status": "FINALIZADA"}}),
+    ("/fichas/pdf/batch", "post", PDF_LOTE_MAX, {}),
+])
+def test_lista_de_ids_acima_do_teto_e_422(client, headers, dados, rota, metodo, teto, extra):
+    ids = list(range(1, teto + 2))
+    r = client.request(metodo.upper(), rota, json={"ids": ids, **extra}, headers=headers)
+    assert r.status_code == 422
+    assert "ids" in r.text
+    # no teto ainda passa pela validação
+    r = client.request(metodo.upper(), rota, json={"ids": ids[:-1], **extra}, headers=headers)
+    assert r.status_code != 422
+
+
+def test_bulk_por_ids_e_por_filtro_tem_o_mesmo_escopo(client, db, admin, outro_admin, headers, dados):
+    # cliente sem admin (admin removido -> SET NULL) entra nos dois caminhos; o de outro admin em nenhum
+    orfao = db.query(models.Cliente).filter_by(admin_id=outro_admin.id).first()
+    orfao.admin_id = None
+    db.commit()
+    escopo = {f.id for f in crud.query_ficha_escopo(db, admin.id)}
+    alheias = {f.id for f in crud.query_fichas_do_admin(db, outro_admin.id)}
+
+    r = client.patch("/fichas/bulk", json={"data_ini": "2000-01-01", "dados": {"status": "EM_REPARO"}}, headers=headers)
+    por_filtro = {i["id"] for i in r.json()["itens"]}
+    r = client.patch("/fichas/bulk", json={"ids": sorted(escopo | alheias), "dados": {"status": "EM_REPARO"}}, headers=headers)
+    por_ids = {i["id"] for i in r.json()["itens"] if i["resultado"] != "nao_encontrada"}
+
+    assert por_filtro == por_ids == escopo
+    assert {f.id for f in db.query(models.Ficha).filter_by(cliente_id=orfao.id)} <= escopo
@@ -0,0 +1,80 @@
+import io
+import json
+import time
+
+import pytest
+
+from app import crud, import_utils, models
+
+CABECALHO = "nome;telefone;email;categoria;marca;modelo;defeito;descricao\n"
+
+
+def _linha(i: int, nome: str = None) -> str:
+    return f"{nome or f'Cliente {i}'};1199999{i:04d};c{i}@x.com;cel;Samsung;M{i};tela;d\n"
+
+
+def _importar(client, headers, conteudo: bytes, nome="dados.csv"):
+    r = client.post("/import", files={"arquivo": (nome, conteudo, "text/csv")}, headers=headers)
+    assert r.status_code == 200, r.text
+    eventos = [json.loads(linha) for linha in r.text.splitlines()]
+    assert eventos[-1]["tipo"] == "fim"
+    return eventos
+
+
+def _erros(eventos):
+    return [e for ev in eventos if ev["tipo"] == "progresso" for e in ev["erros_lote"]]
+
+
+def test_csv_em_cp1252_e_lido_sem_erro(client, db, headers):
+    conteudo = (CABECALHO + _linha(1, "José Araújo") + _linha(2, "Conceição")).encode("cp1252")
+    eventos = _importar(client, headers, conteudo)
+    assert eventos[-1]["fichas"] == 2 and not _erros(eventos)
+    assert {c.nome for c in db.query(models.Cliente)} == {"José Araújo", "Conceição"}
+
+
+def test_linha_com_bytes_invalidos_vira_erro_da_linha(client, db, headers):
+    # UTF-8 com uma linha colada de um arquivo Windows-1252 e outra com byte que nenhuma das duas aceita
+    conteudo = (CABECALHO + _linha(1, "Ana Lúcia")).encode("utf-8")
+    conteudo += _linha(2, "João").encode("cp1252")
+    conteudo += _linha(3).encode("utf-8").replace(b"Samsung", b"Sams\x81ung")
+    conteudo += _linha(4).encode("utf-8")
+    eventos = _importar(client, headers, conteudo)
+
+    assert _erros(eventos) == [{"linha": 4, "erro": "Caracteres inválidos para a codificação do arquivo."}]
+    assert (eventos[-1]["fichas"], eventos[-1]["erros"]) == (3, 1)
+    assert {c.nome for c in db.query(models.Cliente)} == {"Ana Lúcia", "João", "Cliente 4"}
+
+
+def test_lote_desfeito_nao_deixa_cliente_fantasma_no_mapa(client, db, headers, monkeypatch):
+    monkeypatch.setattr(import_utils, "IMPORT_LOTE", 2)
+    original = crud.inserir_fichas_em_lote
+    chamadas = []
+
+    def _falha_no_primeiro(db_, fichas, gerados=None):
+        chamadas.append(1)
+        if len(chamadas) == 1:
+            raise RuntimeError("disco cheio")
+        return original(db_, fichas, gerados)
+
+    monkeypatch.setattr(crud, "inserir_fichas_em_lote", _falha_no_primeiro)
+    # o mesmo cliente nos dois lotes: o primeiro é desfeito, o segundo precisa recriá-lo
+    conteudo = (CABECALHO + _linha(1) + _linha(2) + _linha(1) + _linha(3)).encode("utf-8")
+    eventos = _importar(client, headers, conteudo)
+
+    assert eventos[-1]["erros"] == 2 and eventos[-1]["fichas"] == 2
+    fichas = db.query(models.Ficha).all()
+    assert len(fichas) == 2
+    existentes = {c.id for c in db.query(models.Cliente)}
+    assert {f.cliente_id for f in fichas} <= existentes
+    assert {c.nome for c in db.query(models.Cliente)} == {"Cliente 1", "Cliente 3"}
+
+
+@pytest.mark.benchmark
+def test_benchmark_linhas_por_segundo(client, db, headers):
+    n = 20_000
+    conteudo = (CABECALHO + "".join(_linha(i % 5000, f"Cliente {i % 5000}") for i in range(n))).encode("utf-8")
+    inicio = time.perf_counter()
+    eventos = _importar(client, headers, conteudo)
+    duracao = time.perf_counter() - inicio
+    assert eventos[-1]["fichas"] == n and not _erros(eventos)
+    print(f"\nimportação: {n / duracao:.0f} linhas/s ({n} linhas, {eventos[-1]['clientes']} clientes)")
@@ -0,0 +1,75 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import crud, models, schemas
+from app.database import engine
+from conftest import semear
+
+
+@pytest.fixture
+def planos():
+    # guarda os statements executados e devolve o EXPLAIN QUERY PLAN de cada um
+    capturados = []
+
+    def _ouvir(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            capturados.append((statement, parameters))
+
+    def _planos(func, *args, **kwargs):
+        capturados.clear()
+        event.listen(Engine, "before_cursor_execute", _ouvir)
+        try:
+            resultado = func(*args, **kwargs)
+        finally:
+            event.remove(Engine, "before_cursor_execute", _ouvir)
+        saida = []
+        raw = engine.raw_connection()
+        try:
+            cur = raw.cursor()
+            for statement, parameters in capturados:
+                cur.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+                saida.append(" | ".join(row[-1] for row in cur.fetchall()))
+        finally:
+            raw.close()
+        return resultado, saida
+
+    return _planos
+
+
+@pytest.fixture
+def base(db, admin):
+    clientes = semear(db, admin, clientes=30)
+    for _ in range(5):
+        crud.registrar_log_acesso(db, admin.id, "login", "IP: 127.0.0.1")
+    ficha = db.query(models.Ficha).filter(models.Ficha.cliente_id == clientes[0].id).first()
+    crud.criar_log(db, ficha.id, schemas.LogCreate(ficha_id=ficha.id, descricao="x"), admin_id=admin.id)
+    return clientes[0], ficha
+
+
+@pytest.mark.parametrize("rota, indices", [
+    ("/clientes", ["ix_clientes_admin_id_id"]),
+    ("/clientes/{cliente}/fichas", ["ix_fichas_cliente_id_id"]),
+    ("/fichas/{ficha}/logs", ["ix_logs_ficha_id_data"]),
+    ("/logs", ["ix_logs_acesso_admin_id_id"]),
+    ("/fichas?status=abERTA", ["ix_fichas_status"]),
+])
+def test_rotas_quentes_usam_os_indices_compostos(client, headers, base, planos, rota, indices):
+    cliente, ficha = base
+    r, saida = planos(client.get, rota.format(cliente=cliente.id, ficha=ficha.id), headers=headers)
+    assert r.status_code == 200
+    plano = "\n".join(saida)
+    for indice in indices:
+        assert indice in plano, plano
+    # nenhuma tabela varrida inteira e a ordenação vem do índice (sem B-tree temporária)
+    for linha in saida:
+        assert "SCAN " not in linha, linha
+        assert "TEMP B-TREE FOR ORDER BY" not in linha, linha
+
+
+def test_filtro_de_status_por_igualdade(client, headers, base):
+    r = client.get("/fichas?status=EM_REPARO&page_size=100", headers=headers)
+    assert r.json()["total"] == 30
+    assert {f["status"] for f in r.json()["items"]} == {"EM_REPARO"}
+    # antes era ILIKE '%...%': um pedaço do status não filtra mais
+    assert client.get("/fichas?status=REPARO", headers=headers).json()["total"] == 0
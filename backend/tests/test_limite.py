@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+import pytest
+
+from app import auth, limite_utils
+from conftest import criar_admin, headers_de
+
+
+@pytest.fixture
+def limites(monkeypatch):
+    monkeypatch.setattr(limite_utils, "RATE_LIMIT_ENABLED", True)
+    novos = dict(limite_utils.LIMITES, rastreio=(3, 60), pdf=(2, 60), api=(5, 60))
+    monkeypatch.setattr(limite_utils, "LIMITES", novos)
+    return novos
+
+
+@pytest.mark.parametrize("metodo, caminho, esperado", [
+    ("GET", "/rastreio/ABC", ("rastreio", "ip")),
+    ("GET", "/fichas/10/pdf", ("pdf", "admin")),
+    ("POST", "/fichas/pdf/batch", ("pdf", "admin")),
+    ("PUT", "/fichas/10", ("escrita", "admin")),
+    ("GET", "/fichas", ("api", "admin")),
+    ("POST", "/admin/login", None),
+    ("GET", "/static/x.png", None),
+])
+def test_classes_de_rota(metodo, caminho, esperado):
+    assert limite_utils.classificar(metodo, caminho) == esperado
+
+
+def test_janela_deslizante_em_memoria(monkeypatch):
+    agora = [1000.0]
+    monkeypatch.setattr(auth.time, "monotonic", lambda: agora[0])
+    lim = auth._LimitadorMemoria(100)
+    for i in range(1, 5):
+        assert lim.incr("k", 10)[0] == i
+    # metade da janela seguinte: a anterior pesa 50%
+    agora[0] += 15
+    usados, retry = lim.incr("k", 10)
+    assert usados == pytest.approx(1 + 4 * 0.5) and retry == 5
+    # duas janelas sem uso: zera
+    agora[0] += 25
+    assert lim.contar("k") == 0
+
+
+def test_memoria_respeita_o_teto_de_chaves():
+    lim = auth._LimitadorMemoria(32, particoes=4)
+    for i in range(1000):
+        lim.incr(f"ip:{i}", 60)
+    assert sum(len(dados) for _, dados in lim._particoes) <= 32
+
+
+def test_rastreio_limita_por_ip_com_retry_after(client, limites):
+    respostas = [client.get("/rastreio/NAOEXISTE") for _ in range(4)]
+    assert [r.status_code for r in respostas] == [404, 404, 404, 429]
+    assert int(respostas[-1].headers["retry-after"]) >= 1
+
+
+def test_api_limita_por_admin(client, db, admin, limites):
+    outro = criar_admin(db, "c@c.com")
+    meus, dele = headers_de(admin), headers_de(outro)
+    assert [client.get("/minhas-fichas", headers=meus).status_code for _ in range(6)][-1] == 429
+    # o balde é do admin, não do IP: o outro admin (mesmo IP) continua passando
+    assert client.get("/minhas-fichas", headers=dele).status_code == 200
+    # login tem o próprio limite e não entra na conta
+    assert client.post("/admin/login", json={"email": "x@x.com", "password": "y"}).status_code == 401
+
+
+@pytest.mark.benchmark
+def test_benchmark_custo_do_limitador_abaixo_de_100us(limites, admin, monkeypatch):
+    monkeypatch.setattr(limite_utils, "LIMITES", dict(limites, api=(10**9, 60), rastreio=(10**9, 60)))
+
+    async def _app(scope, receive, send):
+        return None
+
+    async def _send(mensagem):
+        return None
+
+    middleware = limite_utils.LimiteMiddleware(_app)
+    token = headers_de(admin)["Authorization"].encode("latin-1")
+    cenarios = {
+        "rastreio (ip)": {"type": "http", "method": "GET", "path": "/rastreio/ABC", "headers": [], "client": ("10.0.0.1", 1)},
+        "api (admin)": {"type": "http", "method": "GET", "path": "/fichas", "headers": [(b"authorization", token)], "client": ("10.0.0.1", 1)},
+    }
+    n = 20_000
+
+    async def _medir(chamar, scope):
+        inicio = time.perf_counter()
+        for _ in range(n):
+            await chamar(scope, None, _send)
+        return (time.perf_counter() - inicio) / n
+
+    for nome, scope in cenarios.items():
+        base = asyncio.run(_medir(_app, scope))
+        com_limite = asyncio.run(_medir(middleware, scope))
+        custo_us = (com_limite - base) * 1e6
+        print(f"\n{nome}: {custo_us:.1f}µs por requisição (limitador em memória)")
+        assert custo_us < 100
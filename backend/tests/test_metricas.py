@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from app import metricas_utils, pdf_utils
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_contadores_do_qr_em_disco_nao_perdem_incrementos(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_utils, "QR_CACHE_DIR", str(tmp_path))
+    antes = pdf_utils.qr_cache_info()
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        list(ex.map(lambda i: pdf_utils._qr_png(f"http://x/rastreio/{i % 5}", 64), range(800)))
+    depois = pdf_utils.qr_cache_info()
+    consultas = (depois["disco_hits"] - antes["disco_hits"]) + (depois["disco_misses"] - antes["disco_misses"])
+    assert consultas == 800
+    assert depois["disco_misses"] - antes["disco_misses"] >= 5
+
+
+def test_metrics_exporta_cache_de_qr_como_counter(client):
+    pdf_utils._generate_qr_data_uri("http://x/rastreio/metricas", 64)
+    texto = client.get("/metrics").text
+    assert "# TYPE qr_cache_lookups_total counter" in texto
+    assert 'qr_cache_lookups_total{camada="memoria",resultado="miss"}' in texto
+    assert 'qr_cache_lookups_total{camada="disco",resultado="hit"}' in texto
+    # o gauge fica só com o que sobe e desce
+    assert "# TYPE qr_cache gauge" in texto
+    assert 'qr_cache{campo="hits"}' not in texto
+    assert 'qr_cache{campo="tamanho"}' in texto
+
+
+def test_metrics_desligado_e_404(client, monkeypatch):
+    monkeypatch.setattr(metricas_utils, "METRICAS_ENABLED", False)
+    assert client.get("/metrics").status_code == 404
+    assert client.get("/metrics", headers={"Authorization": "Bearer qualquer"}).status_code == 404
+
+
+def test_metrics_com_token_exige_o_bearer(client, monkeypatch):
+    monkeypatch.setattr(metricas_utils, "METRICAS_TOKEN", "segredo")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer errado"}).status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "segredo"}).status_code == 401
+    r = client.get("/metrics", headers={"Authorization": "Bearer segredo"})
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain")
+
+
+def test_metrics_desligado_por_padrao_e_producao_exige_token():
+    env = {k: v for k, v in os.environ.items() if not k.startswith("METRICAS_")}
+
+    def _subir(**extra):
+        codigo = "from app import metricas_utils as m; print(m.METRICAS_ENABLED)"
+        return subprocess.run([sys.executable, "-c", codigo], env={**env, **extra}, cwd=BACKEND, capture_output=True, text=True)
+
+    assert _subir().stdout.strip() == "False"
+    r = _subir(APP_ENV="production", METRICAS_ENABLED="true")
+    assert r.returncode != 0 and "METRICAS_TOKEN" in r.stderr
+    assert _subir(APP_ENV="production", METRICAS_ENABLED="true", METRICAS_TOKEN="segredo").returncode == 0
+    assert _subir(APP_ENV="production").stdout.strip() == "False"
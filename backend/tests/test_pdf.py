@@ -0,0 +1,161 @@
+import io
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import qrcode
+from PIL import Image
+
+from app import models, pdf_cache as pdf_cache_mod, pdf_utils
+from app.pdf_cache import PdfCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PdfCache(str(tmp_path), 10 * 1024 * 1024)
+
+
+def test_get_abre_o_caminho_exato_sem_glob(cache, monkeypatch):
+    cache.put("abc", b"%PDF-1", ficha_id=7, cliente_id=3)
+
+    def _sem_glob(*a, **kw):
+        raise AssertionError("get não deve listar o diretório")
+
+    monkeypatch.setattr(pdf_cache_mod.glob, "glob", _sem_glob)
+    assert cache.get("abc", ficha_id=7, cliente_id=3) == b"%PDF-1"
+    assert cache.get("abc", ficha_id=8, cliente_id=3) is None
+    assert cache.get("outra", ficha_id=7, cliente_id=3) is None
+
+
+def test_invalidacao_e_nova_versao_removem_os_antigos(cache):
+    cache.put("v1", b"1", ficha_id=1, cliente_id=1)
+    cache.put("v2", b"2", ficha_id=1, cliente_id=1)
+    assert cache.get("v1", ficha_id=1, cliente_id=1) is None
+    assert cache.get("v2", ficha_id=1, cliente_id=1) == b"2"
+
+    cache.put("x", b"x", ficha_id=2, cliente_id=1)
+    cache.put("y", b"y", ficha_id=3, cliente_id=2)
+    assert cache.invalidar_ficha(1) == 1
+    assert cache.invalidar_cliente(1) == 1
+    assert cache.get("y", ficha_id=3, cliente_id=2) == b"y"
+
+
+def test_pdf_da_ficha_vem_do_cache_na_segunda_vez(client, headers, db, dados, monkeypatch):
+    ficha = db.query(models.Ficha).filter(models.Ficha.codigo_rastreio == "C0X0").one()
+    renderizados = []
+    original = pdf_utils._renderizar_pdf
+
+    def _contar(*args, **kwargs):
+        renderizados.append(1)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(pdf_utils, "_renderizar_pdf", _contar)
+    pdf_cache_mod.pdf_cache.limpar()
+    primeiro = client.get(f"/fichas/{ficha.id}/pdf", headers=headers)
+    segundo = client.get(f"/fichas/{ficha.id}/pdf", headers=headers)
+    assert primeiro.status_code == segundo.status_code == 200
+    assert primeiro.content == segundo.content and primeiro.content.startswith(b"%PDF")
+    assert len(renderizados) == 1
+
+
+@pytest.mark.parametrize("size", [200, 50, 12])
+def test_qr_menor_que_os_modulos_nao_e_recortado(size):
+    texto = "https://oficina.exemplo.com/rastreio/" + "A1B2C3D4" * 6
+    img = Image.open(io.BytesIO(pdf_utils._render_qr_png(texto, size))).convert("L")
+    referencia = qrcode.QRCode(border=1)
+    referencia.add_data(texto)
+    referencia.make(fit=True)
+    matriz = referencia.get_matrix()
+    modulos = len(matriz)
+    assert img.size == (max(size, modulos),) * 2
+
+    # amostra o centro de cada módulo: a imagem tem o código inteiro, sem corte
+    caixa = img.size[0] // modulos
+    offset = (img.size[0] - caixa * modulos) // 2
+    lido = [[img.getpixel((offset + x * caixa + caixa // 2, offset + y * caixa + caixa // 2)) < 128
+             for x in range(modulos)] for y in range(modulos)]
+    assert lido == matriz
+
+
+def test_motor_sem_renderizar_nao_instancia():
+    class MotorIncompleto(pdf_utils.MotorPdf):
+        nome = "incompleto"
+
+    with pytest.raises(TypeError):
+        MotorIncompleto()
+
+
+def _contexto(i: int = 1):
+    return {
+        "ficha": {"id": i, "marca": "Samsung", "modelo": "A10", "codigo_rastreio": f"BENCH{i}", "defeito": "tela"},
+        "cliente": {"id": 1, "nome": "Fulano", "telefone": "11999999999"},
+        "base_url": "http://localhost:3000",
+    }
+
+
+def test_timeout_do_pool_segura_a_vaga_ate_o_worker_terminar(monkeypatch):
+    liberar = threading.Event()
+
+    def _lento(*args):
+        liberar.wait(5)
+        return b"%PDF"
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(pdf_utils, "PDF_PROCESSOS", 1)
+    monkeypatch.setattr(pdf_utils, "PDF_RENDER_TIMEOUT", 0.05)
+    monkeypatch.setattr(pdf_utils, "_pool", lambda: pool)
+    monkeypatch.setattr(pdf_utils, "_renderizar_no_worker", _lento)
+    vagas = pdf_utils._vagas._value
+    try:
+        with pytest.raises(pdf_utils.PdfSobrecarregado):
+            pdf_utils._renderizar_pdf(_contexto(), 220, motor="reportlab")
+        # o worker ainda está ocupado: a vaga não voltou
+        assert pdf_utils._vagas._value == vagas - 1
+        liberar.set()
+        pool.shutdown(wait=True)
+        assert pdf_utils._vagas._value == vagas
+    finally:
+        liberar.set()
+        pool.shutdown(wait=True)
+
+
+def test_wkhtmltopdf_nao_passa_pelo_pool(monkeypatch):
+    monkeypatch.setattr(pdf_utils, "PDF_PROCESSOS", 1)
+    monkeypatch.setattr(pdf_utils, "_pool", lambda: pytest.fail("wkhtmltopdf já roda em processo externo"))
+    monkeypatch.setattr(pdf_utils.MotorWkhtmltopdf, "renderizar", lambda self, *a, **kw: b"%PDF")
+    assert pdf_utils._renderizar_pdf(_contexto(), 220, motor="wkhtmltopdf") == b"%PDF"
+
+
+def _pdfs_por_segundo(total: int, threads: int, motor: str) -> float:
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        list(ex.map(lambda i: pdf_utils._renderizar_pdf(_contexto(i), 220, motor=motor), range(total)))
+    return total / (time.perf_counter() - inicio)
+
+
+@pytest.mark.benchmark
+def test_benchmark_pdfs_por_segundo(monkeypatch):
+    # sem cache: mede só a renderização de cada motor
+    threads = pdf_utils.PDF_MAX_CONCORRENCIA
+    resultados = {"reportlab (threads)": _pdfs_por_segundo(200, threads, "reportlab")}
+
+    processos = min(4, os.cpu_count() or 2)
+    monkeypatch.setattr(pdf_utils, "PDF_PROCESSOS", processos)
+    monkeypatch.setattr(pdf_utils, "PDF_ENGINE", "reportlab")
+    monkeypatch.setattr(pdf_utils, "_executor", None)
+    try:
+        pdf_utils._pool().submit(int).result()  # sobe e aquece os workers fora da medição
+        resultados[f"reportlab (pool {processos} processos)"] = _pdfs_por_segundo(200, threads, "reportlab")
+    finally:
+        pdf_utils._executor.shutdown()
+
+    if shutil.which("wkhtmltopdf") or os.getenv("WKHTMLTOPDF_PATH"):
+        monkeypatch.setattr(pdf_utils, "PDF_PROCESSOS", 0)
+        resultados["wkhtmltopdf"] = _pdfs_por_segundo(20, threads, "wkhtmltopdf")
+
+    for nome, taxa in resultados.items():
+        print(f"\n{nome}: {taxa:.1f} PDFs/s")
+    assert all(taxa > 0 for taxa in resultados.values())
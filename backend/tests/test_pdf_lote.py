@@ -0,0 +1,68 @@
+import io
+import threading
+import zipfile
+
+import pytest
+from pypdf import PdfReader
+
+from app import pdf_utils
+
+
+def _contextos(n):
+    return [{"ficha": {"id": i}, "cliente": {}} for i in range(n)]
+
+
+def test_lote_mantem_no_maximo_uma_janela_de_pdfs_e_cancela_ao_fechar(monkeypatch):
+    iniciados = []
+    segurar = threading.Event()
+
+    def _render(context, **kwargs):
+        iniciados.append(context["ficha"]["id"])
+        segurar.wait(2)
+        return b"%PDF"
+
+    monkeypatch.setattr(pdf_utils, "ficha_to_pdf_bytes", _render)
+    lote = pdf_utils.renderizar_lote(_contextos(50), workers=2)
+    segurar.set()
+    context, pdf = next(lote)
+    assert context["ficha"]["id"] == 0 and pdf == b"%PDF"
+    # consumidor parado: só a janela (2 em andamento/prontos + o que repôs) foi submetida
+    assert len(iniciados) <= 3
+    lote.close()
+    assert len(iniciados) <= 3
+
+
+def test_lote_tenta_de_novo_quando_sobrecarregado(monkeypatch):
+    chamadas = []
+
+    def _render(context, **kwargs):
+        chamadas.append(1)
+        if len(chamadas) == 1:
+            raise pdf_utils.PdfSobrecarregado("cheio")
+        return b"%PDF"
+
+    monkeypatch.setattr(pdf_utils, "ficha_to_pdf_bytes", _render)
+    monkeypatch.setattr(pdf_utils.time, "sleep", lambda s: None)
+    assert [r for _, r in pdf_utils.renderizar_lote(_contextos(1))] == [b"%PDF"]
+    assert len(chamadas) == 2
+
+
+def test_zip_sem_vaga_responde_503_antes_de_comecar(client, headers, dados, monkeypatch):
+    def _cheio(context, **kwargs):
+        raise pdf_utils.PdfSobrecarregado("cheio")
+
+    monkeypatch.setattr(pdf_utils, "ficha_to_pdf_bytes", _cheio)
+    monkeypatch.setattr(pdf_utils.time, "sleep", lambda s: None)
+    r = client.post("/fichas/pdf/batch", json={"q": "Cliente C1", "formato": "zip"}, headers=headers)
+    assert r.status_code == 503 and r.headers["retry-after"] == "5"
+
+
+def test_lote_em_zip_e_mesclado(client, headers, dados):
+    r = client.post("/fichas/pdf/batch", json={"q": "Cliente C1", "formato": "zip"}, headers=headers)
+    assert r.status_code == 200
+    nomes = zipfile.ZipFile(io.BytesIO(r.content)).namelist()
+    assert len(nomes) == 3 and all(n.startswith("ficha_") for n in nomes)
+
+    r = client.post("/fichas/pdf/batch", json={"q": "Cliente C1", "formato": "pdf"}, headers=headers)
+    assert r.status_code == 200
+    assert len(PdfReader(io.BytesIO(r.content)).pages) == 3
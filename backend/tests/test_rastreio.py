@@ -0,0 +1,54 @@
+from app import models, rastreio_cache
+
+
+def _ficha(db, admin):
+    return (
+        db.query(models.Ficha)
+        .join(models.Cliente, models.Ficha.cliente_id == models.Cliente.id)
+        .filter(models.Cliente.admin_id == admin.id)
+        .order_by(models.Ficha.id)
+        .first()
+    )
+
+
+def test_etag_devolve_304_e_mudanca_de_status_traz_corpo_novo(client, db, admin, headers, dados):
+    ficha = _ficha(db, admin)
+    rota = f"/rastreio/{ficha.codigo_rastreio}"
+
+    r = client.get(rota)
+    assert r.status_code == 200
+    etag = r.headers["etag"]
+    assert r.json()["status"] == ficha.status
+
+    r = client.get(rota, headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.headers["etag"] == etag and not r.content
+    # lista de etags também vale
+    assert client.get(rota, headers={"If-None-Match": f'W/"outro", {etag}'}).status_code == 304
+
+    assert client.put(f"/fichas/{ficha.id}", json={"status": "ENTREGUE"}, headers=headers).status_code == 200
+    r = client.get(rota, headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.json()["status"] == "ENTREGUE"
+    assert r.headers["etag"] != etag
+
+
+def test_edicao_fora_da_pagina_publica_mantem_a_etag(client, db, admin, headers, dados):
+    ficha = _ficha(db, admin)
+    rota = f"/rastreio/{ficha.codigo_rastreio}"
+    etag = client.get(rota).headers["etag"]
+    assert client.put(f"/fichas/{ficha.id}", json={"modelo": "Outro"}, headers=headers).status_code == 200
+    assert client.get(rota, headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_varios_workers_sem_redis_nao_usam_cache_local(client, db, admin, dados, monkeypatch, contador_sql):
+    monkeypatch.setattr(rastreio_cache, "WORKERS", 4)
+    ficha = _ficha(db, admin)
+    rota = f"/rastreio/{ficha.codigo_rastreio}"
+
+    _, primeira = contador_sql.medir(client.get, rota)
+    _, segunda = contador_sql.medir(client.get, rota)
+    # sem cache compartilhado, cada consulta vai ao banco (e a ETag continua valendo)
+    assert primeira == segunda == 1
+    assert not rastreio_cache._local._dados
+    etag = client.get(rota).headers["etag"]
+    assert client.get(rota, headers={"If-None-Match": etag}).status_code == 304
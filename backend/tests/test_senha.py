@@ -0,0 +1,109 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+import pytest
+
+from app import senha_utils
+
+
+def _hash(senha: str, rounds: int = 4) -> str:
+    return bcrypt.hashpw(senha.encode("utf-8"), bcrypt.gensalt(rounds)).decode("ascii")
+
+
+def test_verificacao_em_caminho_unico():
+    guardado = _hash("segredo")
+    assert senha_utils.verificar_senha("segredo", guardado) == (True, None)
+    assert senha_utils.verificar_senha("errada", guardado) == (False, None)
+    assert senha_utils.verificar_senha("segredo", "lixo") == (False, None)
+    # bcrypt só olha 72 bytes: senhas longas não quebram a verificação
+    longa = "x" * 100
+    assert senha_utils.verificar_senha(longa, _hash(longa[:72]))[0] is True
+
+
+@pytest.fixture
+def pool_lento(monkeypatch):
+    liberar = threading.Event()
+
+    def _lento(password, stored):
+        liberar.wait(5)
+        return False, None
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(senha_utils, "SENHA_PROCESSOS", 1)
+    monkeypatch.setattr(senha_utils, "_pool", lambda: pool)
+    monkeypatch.setattr(senha_utils, "_verificar", _lento)
+    yield liberar, pool
+    liberar.set()
+    pool.shutdown(wait=True)
+
+
+def test_timeout_mantem_a_vaga_ate_o_worker_terminar(pool_lento, monkeypatch):
+    liberar, pool = pool_lento
+    monkeypatch.setattr(senha_utils, "SENHA_TIMEOUT", 0.05)
+    with pytest.raises(senha_utils.VerificacaoSobrecarregada):
+        senha_utils.verificar_senha("x", "y")
+    assert senha_utils._em_andamento == 1
+    liberar.set()
+    pool.shutdown(wait=True)
+    assert senha_utils._em_andamento == 0
+
+
+def test_fila_cheia_responde_sobrecarregado(pool_lento, monkeypatch):
+    liberar, _ = pool_lento
+    monkeypatch.setattr(senha_utils, "SENHA_FILA_MAX", 2)
+    monkeypatch.setattr(senha_utils, "SENHA_TIMEOUT", 5)
+    ex = ThreadPoolExecutor(max_workers=2)
+    pendentes = [ex.submit(senha_utils.verificar_senha, "x", "y") for _ in range(2)]
+    while senha_utils._em_andamento < 2:
+        time.sleep(0.01)
+    with pytest.raises(senha_utils.VerificacaoSobrecarregada):
+        senha_utils.verificar_senha("x", "y")
+    liberar.set()
+    assert [p.result() for p in pendentes] == [(False, None), (False, None)]
+    ex.shutdown()
+
+
+def _enxurrada(guardado: str, total: int, threads: int):
+    # muitas senhas erradas ao mesmo tempo + um login certo no meio
+    recusados = []
+
+    def _tentar(i):
+        try:
+            return senha_utils.verificar_senha("errada", guardado)
+        except senha_utils.VerificacaoSobrecarregada:
+            recusados.append(i)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        futuros = [ex.submit(_tentar, i) for i in range(total)]
+        t0 = time.perf_counter()
+        try:
+            senha_utils.verificar_senha("certa", guardado)
+            login_ok_ms = (time.perf_counter() - t0) * 1000
+        except senha_utils.VerificacaoSobrecarregada:
+            login_ok_ms = None
+        for f in futuros:
+            f.result()
+    duracao = time.perf_counter() - inicio
+    return (total - len(recusados)) / duracao, len(recusados), login_ok_ms
+
+
+@pytest.mark.benchmark
+def test_benchmark_logins_por_segundo_sob_enxurrada(monkeypatch):
+    guardado = _hash("certa", rounds=10)
+    resultados = {"thread da requisição": _enxurrada(guardado, 200, 64)}
+
+    monkeypatch.setattr(senha_utils, "SENHA_PROCESSOS", 2)
+    monkeypatch.setattr(senha_utils, "_executor", None)
+    try:
+        senha_utils.verificar_senha("aquecer", guardado)
+        resultados["pool de 2 processos"] = _enxurrada(guardado, 200, 64)
+    finally:
+        senha_utils._executor.shutdown()
+
+    for nome, (por_segundo, recusados, login_ok_ms) in resultados.items():
+        login = f"{login_ok_ms:.0f}ms" if login_ok_ms is not None else "recusado (503)"
+        print(f"\n{nome}: {por_segundo:.1f} verificações/s, {recusados} recusadas na fila, login certo em {login}")
+    assert all(r[0] > 0 for r in resultados.values())
@@ -121,7 +121,11 @@ const Dashboard = () => {
               </button>
             ))}
             <button className='nav-button logout' onClick={() => {
+              // revoga o refresh token no servidor (sem esperar a resposta)
+              const refresh = localStorage.getItem('refresh_token');
+              if (refresh) api.post('/admin/logout', {refresh_token: refresh}).catch(() => {});
               localStorage.removeItem('token');
+              localStorage.removeItem('refresh_token');
               navigate('/');
             }}>Sair</button>
         </nav>
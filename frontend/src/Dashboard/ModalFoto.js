@@ -70,9 +70,11 @@ export default function ModalFoto({
         try {
             const formData = new FormData();
             formData.append('foto', fotoFile);
-            await api.post('/upload-foto', formData, {
+            const { data } = await api.post('/upload-foto', formData, {
                 headers: { 'Content-Type': 'multipart/form-data' }
             });
+            // token novo já traz a foto atualizada
+            if (data?.access_token) localStorage.setItem('token', data.access_token);
             setFotoPreview(null);
             setFotoFile(null);
             setModalFotoOpen(false);
@@ -51,6 +51,12 @@ export default function ModalEdicaoFicha({ open, fichaId, onClose, onSaved }) {
         return p;
     };
 
+    const formatMudancas = (m) => {
+        if (!m || typeof m !== 'object') return '';
+        const partes = Object.entries(m).map(([k, v]) => `${k}: '${v?.old ?? ''}' -> '${v?.new ?? ''}'`);
+        return partes.length ? ` ${partes.join('; ')}` : '';
+    };
+
     const formatPrevisao = (p) => {
        if (!p) return '-';
        const d = Date.parse(p);
@@ -112,12 +118,14 @@ export default function ModalEdicaoFicha({ open, fichaId, onClose, onSaved }) {
                 setSaving(false);
                 return onClose?.();
             }
+            // versão lida: se outra pessoa salvou antes, o backend responde 409
+            if (ficha?.versao != null) payload.versao = ficha.versao;
             const { data } = await api.put(`/fichas/${fichaId}`, payload);
             onSaved?.(data);
             onClose?.();
         } catch (error) {
             console.error("Erro ao salvar ficha:", error);
-            setError(error?.response?.data?.message || "Erro ao salvar ficha. Verifique o console para mais detalhes.");
+            setError(error?.response?.data?.detail || error?.response?.data?.message || "Erro ao salvar ficha. Verifique o console para mais detalhes.");
         } finally {
             setSaving(false);
         }
@@ -208,7 +216,7 @@ export default function ModalEdicaoFicha({ open, fichaId, onClose, onSaved }) {
                                         {logs.length === 0 ? <li className="empty">Nenhum registro</li> : logs.map(l => (
                                             <li key={l.id || `${l.data}-${l.status}`} className="history-item">
                                                 <div className="history-date">{new Date(l.data || l.created_at || l.data_hora).toLocaleString()}</div>
-                                                <div className="history-text">{l.status}{l.descricao ? `: ${l.descricao}` : ''}</div>
+                                                <div className="history-text">{l.status}{l.descricao ? `: ${l.descricao}` : ''}{formatMudancas(l.mudancas)}</div>
                                             </li>
                                         ))}
                                         
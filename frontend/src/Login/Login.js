@@ -38,6 +38,7 @@ const Login = () => {
             };
             const { data } = await api.post('/admin/login', payload);
             localStorage.setItem('token', data.access_token);
+            if (data.refresh_token) localStorage.setItem('refresh_token', data.refresh_token);
             window.location.href = '/dashboard';
         } catch (err) {
             const detail = err?.response?.data?.detail;
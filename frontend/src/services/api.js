@@ -29,13 +29,46 @@ api.interceptors.request.use(
 );
 
 
+// Renova o access token com o refresh token (uma renovação por vez)
+let renovando = null;
+const renovarToken = () => {
+    if (!renovando) {
+        const refresh = localStorage.getItem("refresh_token");
+        renovando = (refresh
+            ? axios.post(`${API_BASE}/admin/refresh`, { refresh_token: refresh }, { timeout: 10000 })
+            : Promise.reject(new Error("sem refresh token"))
+        )
+            .then(({ data }) => {
+                localStorage.setItem("token", data.access_token);
+                if (data.refresh_token) localStorage.setItem("refresh_token", data.refresh_token);
+                return data.access_token;
+            })
+            .finally(() => { renovando = null; });
+    }
+    return renovando;
+};
+
+
 //Trata 401 globalmente
 api.interceptors.response.use(
     (res) => res,
-    (err) => {
+    async (err) => {
+        const original = err?.config;
+        if (err?.response?.status === 401 && !USE_COOKIE && original && !original._renovado && original.url !== '/admin/login') {
+            original._renovado = true;
+            try {
+                const token = await renovarToken();
+                original.headers = original.headers || {};
+                original.headers['Authorization'] = `Bearer ${token}`;
+                return api(original);
+            } catch (e) {
+                // segue para o logout abaixo
+            }
+        }
         try{
             if (err?.response?.status === 401) {
                 localStorage.removeItem("token");          // logout
+                localStorage.removeItem("refresh_token");
                 if (window.location.pathname !== "/") {    // volta para o login
                     window.location.replace("/");
                 }